@@ -4,7 +4,7 @@ import { getDatabase } from '@/lib/database/connection'
 // Force dynamic rendering for this API route
 export const dynamic = 'force-dynamic'
 
-type QueryParam = string
+type QueryParam = string | number
 
 interface BasicStatsRow {
   total_activities: number
@@ -60,6 +60,123 @@ interface RecentActivityRow {
   [key: string]: unknown
 }
 
+// Rollup tables are maintained by scripts/activity_rollups.py at sync time.
+// Triggers log every activity write in activity_stats_changes until the next
+// sync folds it in, so rollups are only read while that log is empty;
+// otherwise (and for databases created elsewhere) raw activities are aggregated
+function hasStatsRollups(db: ReturnType<typeof getDatabase>): boolean {
+  const tables = db.prepare(`
+    SELECT COUNT(*) as count FROM sqlite_master
+    WHERE type = 'table' AND name IN ('activity_stats', 'activity_stats_changes')
+  `).get() as { count: number }
+  if (tables.count < 2) return false
+  if (db.prepare('SELECT 1 FROM activity_stats_changes LIMIT 1').get()) return false
+  return Boolean(db.prepare('SELECT 1 FROM activity_stats LIMIT 1').get())
+}
+
+// activities.user_id is added by scripts/activity_db.py; databases built by
+// scripts/migrate-strava-json.js hold a single athlete and have no such column
+function hasUserColumn(db: ReturnType<typeof getDatabase>): boolean {
+  const columns = db.prepare('PRAGMA table_info(activities)').all() as { name: string }[]
+  return columns.some((column) => column.name === 'user_id')
+}
+
+// Basic totals and the type distribution from the year rollups (all years
+// when `year` is null); only valid without a month or type filter
+function rollupTotals(db: ReturnType<typeof getDatabase>, userId: number, year: number | null) {
+  const yearFilter = year ? 'AND bucket = ?' : ''
+  const yearParams = year ? [year.toString()] : []
+  const basicStats = db.prepare(`
+    SELECT
+      COALESCE(SUM(activities), 0) as total_activities,
+      SUM(distance) as total_distance,
+      SUM(moving_time) as total_time,
+      SUM(elevation_gain) as total_elevation,
+      SUM(distance) / SUM(activities) as avg_distance,
+      SUM(moving_time) * 1.0 / SUM(activities) as avg_time,
+      MAX(longest_distance) as longest_distance,
+      MIN(first_activity) as first_activity,
+      MAX(last_activity) as last_activity
+    FROM activity_stats
+    WHERE user_id = ? AND period = 'year' ${yearFilter}
+  `).get(userId, ...yearParams) as BasicStatsRow
+
+  const typeDistribution = db.prepare(`
+    SELECT
+      type,
+      SUM(activities) as count,
+      SUM(distance) as total_distance,
+      SUM(moving_time) as total_time
+    FROM activity_stats
+    WHERE user_id = ? AND period = 'year' ${yearFilter}
+    GROUP BY type
+    ORDER BY count DESC, type
+  `).all(userId, ...yearParams) as TypeDistributionRow[]
+
+  return { basicStats, typeDistribution }
+}
+
+function rollupSeries(
+  db: ReturnType<typeof getDatabase>,
+  period: 'day' | 'week' | 'month',
+  userId: number,
+  year: number,
+  type: string[] | null
+) {
+  const typeFilter = type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''
+  return db.prepare(`
+    SELECT
+      bucket,
+      SUM(activities) as activities,
+      SUM(distance) as distance,
+      SUM(moving_time) as time
+    FROM activity_stats
+    WHERE user_id = ? AND period = ? AND bucket LIKE ?
+    ${typeFilter}
+    GROUP BY bucket
+    ORDER BY bucket
+  `).all(userId, period, `${year}-%`, ...(type || [])) as { bucket: string; activities: number; distance: number | null; time: number | null }[]
+}
+
+function rollupRecords(
+  db: ReturnType<typeof getDatabase>,
+  userId: number,
+  year: number | null,
+  type: string[] | null
+) {
+  const typeFilter = type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''
+  const best = (record: string, order: 'ASC' | 'DESC') => db.prepare(`
+    SELECT name, value, distance, moving_time, total_elevation_gain, start_date
+    FROM personal_records
+    WHERE user_id = ? AND record = ? AND year = ?
+    ${typeFilter}
+    ORDER BY value ${order}, start_date
+    LIMIT 1
+  `).get(userId, record, year ? year.toString() : 'all', ...(type || [])) as {
+    name: string; value: number; distance: number; moving_time: number; total_elevation_gain: number; start_date: string
+  } | undefined
+
+  const longest = best('longest_distance', 'DESC')
+  const fastest = best('fastest_pace', 'ASC')
+  const elevation = best('most_elevation', 'DESC')
+  return {
+    longestRun: longest && { name: longest.name, distance: longest.distance, start_date: longest.start_date },
+    fastestPace: fastest && {
+      name: fastest.name,
+      distance: fastest.distance,
+      moving_time: fastest.moving_time,
+      start_date: fastest.start_date,
+      pace_per_km: fastest.value
+    },
+    mostElevation: elevation && {
+      name: elevation.name,
+      total_elevation_gain: elevation.total_elevation_gain,
+      distance: elevation.distance,
+      start_date: elevation.start_date
+    }
+  }
+}
+
 export async function GET(request: NextRequest) {
   try {
     const db = getDatabase()
@@ -67,10 +184,14 @@ export async function GET(request: NextRequest) {
     const year = searchParams.get('year') ? parseInt(searchParams.get('year')!) : null // Don't default to current year
     const month = searchParams.get('month') ? parseInt(searchParams.get('month')!) : null
     const type = searchParams.get('type')?.split(',').filter(Boolean) || null
+    // Stats are per athlete; the web app's own athlete is user 1
+    const userId = searchParams.get('user') ? parseInt(searchParams.get('user')!) : 1
 
     // Build WHERE clause based on parameters
-    let whereClause = 'WHERE 1=1'
-    const params: QueryParam[] = []
+    const userScoped = hasUserColumn(db)
+    const userParams: QueryParam[] = userScoped ? [userId] : []
+    let whereClause = userScoped ? 'WHERE user_id = ?' : 'WHERE 1=1'
+    const params: QueryParam[] = [...userParams]
 
     // Only filter by year if explicitly provided
     if (year) {
@@ -88,8 +209,13 @@ export async function GET(request: NextRequest) {
       params.push(...type)
     }
 
+    // Rollups are kept per athlete, so they need the user_id column too
+    const useRollups = userScoped && hasStatsRollups(db)
+    const rollupTotalsApply = useRollups && !month && !(type && type.length > 0)
+    const totals = rollupTotalsApply ? rollupTotals(db, userId, year) : null
+
     // Basic stats for the specified period (or all-time if no year specified)
-    const basicStats = db.prepare(`
+    const basicStats = totals ? totals.basicStats : db.prepare(`
       SELECT 
         COUNT(*) as total_activities,
         SUM(distance) as total_distance,
@@ -105,7 +231,7 @@ export async function GET(request: NextRequest) {
     `).get(...params) as BasicStatsRow
 
     // Activity type distribution for the specified period
-    const typeDistributionRaw = db.prepare(`
+    const typeDistributionRaw = totals ? totals.typeDistribution : db.prepare(`
       SELECT 
         type,
         COUNT(*) as count,
@@ -114,7 +240,7 @@ export async function GET(request: NextRequest) {
       FROM activities 
       ${whereClause}
       GROUP BY type 
-      ORDER BY count DESC
+      ORDER BY count DESC, type
     `).all(...params) as TypeDistributionRow[]
 
     const totalActivities = typeDistributionRaw.reduce((sum, item) => sum + item.count, 0)
@@ -126,9 +252,21 @@ export async function GET(request: NextRequest) {
       percentage: totalActivities > 0 ? Math.round((item.count / totalActivities) * 100 * 100) / 100 : 0
     }))
 
+    // Year-scoped raw queries below
+    const yearWhere = `WHERE ${userScoped ? 'user_id = ? AND ' : ''}strftime('%Y', start_date) = ?`
+    const yearParams: QueryParam[] = year ? [...userParams, year.toString()] : []
+
     // Monthly stats - only if year is specified, otherwise return empty array
     let monthlyStats: MonthlyStatsRow[] = []
-    if (year) {
+    if (year && useRollups) {
+      monthlyStats = rollupSeries(db, 'month', userId, year, type).map((row) => ({
+        month: row.bucket,
+        activities: row.activities,
+        distance: row.distance,
+        time: row.time,
+        avg_distance: row.activities > 0 ? (row.distance || 0) / row.activities : null
+      }))
+    } else if (year) {
       monthlyStats = db.prepare(`
         SELECT 
           strftime('%Y-%m', start_date) as month,
@@ -137,11 +275,11 @@ export async function GET(request: NextRequest) {
           SUM(moving_time) as time,
           AVG(distance) as avg_distance
         FROM activities 
-        WHERE strftime('%Y', start_date) = ?
+        ${yearWhere}
         ${type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''}
         GROUP BY strftime('%Y-%m', start_date)
         ORDER BY month
-      `).all(year.toString(), ...(type || [])) as MonthlyStatsRow[]
+      `).all(...yearParams, ...(type || [])) as MonthlyStatsRow[]
     }
 
     // Transform monthly data
@@ -155,7 +293,14 @@ export async function GET(request: NextRequest) {
 
     // Weekly stats - only if year is specified, otherwise return empty array
     let weeklyStatsRaw: WeeklyStatsRow[] = []
-    if (year) {
+    if (year && useRollups) {
+      weeklyStatsRaw = rollupSeries(db, 'week', userId, year, type).map((row) => ({
+        week: row.bucket.slice(5),
+        activities: row.activities,
+        distance: row.distance,
+        time: row.time
+      }))
+    } else if (year) {
       weeklyStatsRaw = db.prepare(`
         SELECT 
           strftime('%W', start_date) as week,
@@ -163,11 +308,11 @@ export async function GET(request: NextRequest) {
           SUM(distance) as distance,
           SUM(moving_time) as time
         FROM activities 
-        WHERE strftime('%Y', start_date) = ?
+        ${yearWhere}
         ${type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''}
         GROUP BY strftime('%W', start_date)
         ORDER BY week
-      `).all(year.toString(), ...(type || [])) as WeeklyStatsRow[]
+      `).all(...yearParams, ...(type || [])) as WeeklyStatsRow[]
     }
 
     // Transform weekly data
@@ -192,14 +337,14 @@ export async function GET(request: NextRequest) {
             ELSE 0 
           END as pace
         FROM activities 
-        WHERE strftime('%Y', start_date) = ?
+        ${yearWhere}
         AND type IN ('Run', 'Walk')
         AND distance > 1000
         AND moving_time > 0
         ${type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''}
         ORDER BY start_date DESC
         LIMIT 50
-      `).all(year.toString(), ...(type || [])) as PaceAnalysisRow[]
+      `).all(...yearParams, ...(type || [])) as PaceAnalysisRow[]
     }
 
     // Transform pace data
@@ -212,7 +357,14 @@ export async function GET(request: NextRequest) {
 
     // Daily stats for heatmap - only if year is specified
     let dailyStatsRaw: DailyStatsRow[] = []
-    if (year) {
+    if (year && useRollups) {
+      dailyStatsRaw = rollupSeries(db, 'day', userId, year, type).map((row) => ({
+        date: row.bucket,
+        activities: row.activities,
+        distance: row.distance,
+        duration: row.time
+      }))
+    } else if (year) {
       dailyStatsRaw = db.prepare(`
         SELECT 
           DATE(start_date) as date,
@@ -220,11 +372,11 @@ export async function GET(request: NextRequest) {
           SUM(distance) as distance,
           SUM(moving_time) as duration
         FROM activities 
-        WHERE strftime('%Y', start_date) = ?
+        ${yearWhere}
         ${type && type.length > 0 ? `AND type IN (${type.map(() => '?').join(',')})` : ''}
         GROUP BY DATE(start_date)
         ORDER BY date
-      `).all(year.toString(), ...(type || [])) as DailyStatsRow[]
+      `).all(...yearParams, ...(type || [])) as DailyStatsRow[]
     }
 
     // Transform daily data for heatmap
@@ -235,13 +387,14 @@ export async function GET(request: NextRequest) {
       duration: item.duration || 0
     }))
 
-    // Personal records for the specified period
-    const personalRecords = {
+    // Personal records for the specified period; rollups cover per-year and all-time
+    const personalRecords = useRollups && !month ? rollupRecords(db, userId, year, type) : {
       longestRun: db.prepare(`
         SELECT name, distance, start_date 
         FROM activities 
         ${whereClause}
-        ORDER BY distance DESC 
+        AND distance IS NOT NULL
+        ORDER BY distance DESC, start_date
         LIMIT 1
       `).get(...params),
       
@@ -255,7 +408,7 @@ export async function GET(request: NextRequest) {
         ${whereClause}
         AND distance > 1000
         AND moving_time > 0
-        ORDER BY pace_per_km ASC 
+        ORDER BY pace_per_km ASC, start_date
         LIMIT 1
       `).get(...params),
       
@@ -264,7 +417,7 @@ export async function GET(request: NextRequest) {
         FROM activities 
         ${whereClause}
         AND total_elevation_gain > 0
-        ORDER BY total_elevation_gain DESC 
+        ORDER BY total_elevation_gain DESC, start_date
         LIMIT 1
       `).get(...params)
     }
@@ -288,6 +441,7 @@ export async function GET(request: NextRequest) {
 
     return NextResponse.json({
       success: true,
+      user: userId,
       year,
       month,
       type,
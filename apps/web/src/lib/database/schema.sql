@@ -94,8 +94,9 @@ CREATE TABLE activities (
 CREATE TABLE activity_segments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     activity_id INTEGER NOT NULL,
-    segment_type VARCHAR(50), -- 'lap', 'split', 'climb', 'interval'
+    segment_type VARCHAR(50), -- 'split', 'lap', 'best_effort', 'segment_effort'
     sequence_number INTEGER,
+    name VARCHAR(255), -- best effort distance ('5k') or lap/segment name
     
     -- Segment metrics
     distance REAL,
@@ -250,7 +251,8 @@ CREATE INDEX idx_activities_user_date ON activities(user_id, start_date DESC);
 CREATE INDEX idx_activities_type ON activities(type);
 CREATE INDEX idx_activities_source ON activities(source);
 CREATE INDEX idx_activities_external_id ON activities(external_id, source);
-CREATE INDEX idx_activity_segments_activity ON activity_segments(activity_id);
+CREATE INDEX idx_activity_segments_activity_type ON activity_segments(activity_id, segment_type);
+CREATE INDEX idx_activity_segments_type_name ON activity_segments(segment_type, name, elapsed_time);
 CREATE INDEX idx_activity_data_points_activity ON activity_data_points(activity_id);
 CREATE INDEX idx_sync_logs_user_source ON sync_logs(user_id, source);
 CREATE INDEX idx_sync_logs_date ON sync_logs(started_at DESC);
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+SQLite sink for synced Strava activities
+
+Upserts activities straight into running_page_2.db keyed on
+(source, external_id), in batched executemany transactions under WAL.
+Rows whose content did not change are left untouched, so a sync writes in
+proportion to the delta rather than to the whole history. The table
+layout matches scripts/migrate-strava-json.js, which remains available
+for one-off imports of JSON datasets.
+
+Derived tables are maintained alongside: splits, laps and efforts in
+activity_segments, per-sample streams in activity_data_points, stats
+rollups for the buckets writes touched (scripts/activity_rollups.py),
+simplified route geometry for changed routes
+(scripts/activity_geometry.py), heatmap counts for new routes
+(scripts/heatmap.py), the spatial index (scripts/activity_spatial.py) and
+repeated-route clusters (scripts/route_clusters.py).
+"""
+
+import json
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+import activity_geometry
+import activity_rollups
+import activity_spatial
+import heatmap
+import route_clusters
+from activity_geometry import GEOMETRY_SCHEMA_SQL
+from activity_rollups import ROLLUP_SCHEMA_SQL
+from activity_spatial import SPATIAL_SCHEMA_SQL
+from heatmap import HEATMAP_SCHEMA_SQL
+from route_clusters import ROUTE_CLUSTER_SCHEMA_SQL
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  email TEXT UNIQUE,
+  name TEXT,
+  timezone TEXT DEFAULT 'UTC',
+  preferences TEXT,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS activities (
+  id INTEGER PRIMARY KEY,
+  external_id TEXT UNIQUE NOT NULL,
+  source TEXT NOT NULL DEFAULT 'strava',
+  user_id INTEGER DEFAULT 1,
+  name TEXT NOT NULL,
+  description TEXT,
+  type TEXT NOT NULL,
+  sport_type TEXT,
+  start_date TEXT NOT NULL,
+  start_date_local TEXT,
+  timezone TEXT,
+  distance REAL DEFAULT 0,
+  moving_time INTEGER DEFAULT 0,
+  elapsed_time INTEGER DEFAULT 0,
+  total_elevation_gain REAL DEFAULT 0,
+  average_speed REAL DEFAULT 0,
+  max_speed REAL DEFAULT 0,
+  start_latitude REAL,
+  start_longitude REAL,
+  end_latitude REAL,
+  end_longitude REAL,
+  location_city TEXT,
+  location_state TEXT,
+  location_country TEXT,
+  summary_polyline TEXT,
+  map_id TEXT,
+  average_heartrate REAL,
+  max_heartrate REAL,
+  calories INTEGER,
+  average_cadence REAL,
+  average_power REAL,
+  weighted_average_power REAL,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  synced_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  streams_checked_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sync_logs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER DEFAULT 1,
+  source TEXT NOT NULL,
+  sync_type TEXT,
+  status TEXT NOT NULL,
+  activities_processed INTEGER DEFAULT 0,
+  activities_created INTEGER DEFAULT 0,
+  activities_updated INTEGER DEFAULT 0,
+  activities_skipped INTEGER DEFAULT 0,
+  error_message TEXT,
+  error_details TEXT,
+  started_at TEXT NOT NULL,
+  completed_at TEXT,
+  duration_seconds INTEGER,
+  sync_params TEXT,
+  api_calls_made INTEGER DEFAULT 0,
+  rate_limit_remaining INTEGER,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS data_source_settings (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER DEFAULT 1,
+  source TEXT NOT NULL,
+  access_token TEXT,
+  refresh_token TEXT,
+  token_expires_at TEXT,
+  auto_sync INTEGER DEFAULT 1,
+  sync_frequency TEXT DEFAULT 'daily',
+  last_sync_at TEXT,
+  activity_types TEXT,
+  privacy_settings TEXT,
+  is_active INTEGER DEFAULT 1,
+  connection_status TEXT DEFAULT 'connected',
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE(user_id, source)
+);
+
+CREATE TABLE IF NOT EXISTS activity_segments (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  activity_id INTEGER NOT NULL,
+  segment_type TEXT,
+  sequence_number INTEGER,
+  name TEXT,
+  distance REAL,
+  moving_time INTEGER,
+  elapsed_time INTEGER,
+  average_speed REAL,
+  max_speed REAL,
+  average_heartrate REAL,
+  max_heartrate REAL,
+  total_elevation_gain REAL,
+  start_index INTEGER,
+  end_index INTEGER,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (activity_id) REFERENCES activities(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS activity_data_points (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  activity_id INTEGER NOT NULL,
+  timestamp TEXT,
+  elapsed_time INTEGER,
+  latitude REAL,
+  longitude REAL,
+  altitude REAL,
+  distance REAL,
+  speed REAL,
+  heartrate INTEGER,
+  cadence INTEGER,
+  power REAL,
+  temperature REAL,
+  grade REAL,
+  bearing REAL,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (activity_id) REFERENCES activities(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_activities_start_date ON activities(start_date);
+CREATE INDEX IF NOT EXISTS idx_activities_type ON activities(type);
+CREATE INDEX IF NOT EXISTS idx_activities_external_id ON activities(external_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_activities_source_external_id ON activities(source, external_id);
+CREATE INDEX IF NOT EXISTS idx_activities_user ON activities(user_id, start_date);
+CREATE INDEX IF NOT EXISTS idx_activity_segments_activity_type ON activity_segments(activity_id, segment_type);
+CREATE INDEX IF NOT EXISTS idx_activity_segments_type_name ON activity_segments(segment_type, name, elapsed_time);
+CREATE INDEX IF NOT EXISTS idx_activity_data_points_activity ON activity_data_points(activity_id);
+CREATE INDEX IF NOT EXISTS idx_sync_logs_user_source ON sync_logs(user_id, source);
+CREATE INDEX IF NOT EXISTS idx_sync_logs_date ON sync_logs(started_at DESC);
+
+INSERT OR IGNORE INTO users (id, email, name, timezone)
+VALUES (1, 'user@example.com', 'Runner', 'UTC');
+"""
+
+# Columns compared to decide whether an existing row changed
+CONTENT_COLUMNS = (
+    'name', 'description', 'type', 'sport_type',
+    'start_date', 'start_date_local', 'timezone',
+    'distance', 'moving_time', 'elapsed_time', 'total_elevation_gain',
+    'average_speed', 'max_speed',
+    'start_latitude', 'start_longitude', 'end_latitude', 'end_longitude',
+    'location_city', 'location_state', 'location_country',
+    'summary_polyline', 'map_id',
+    'average_heartrate', 'max_heartrate', 'calories',
+    'average_cadence', 'average_power', 'weighted_average_power',
+)
+
+INSERT_COLUMNS = ('external_id', 'source', 'user_id') + CONTENT_COLUMNS + ('synced_at',)
+
+UPSERT_SQL = f"""
+INSERT INTO activities ({', '.join(INSERT_COLUMNS)})
+VALUES ({', '.join(':' + c for c in INSERT_COLUMNS)})
+ON CONFLICT(source, external_id) DO UPDATE SET
+  {', '.join(f'{c} = excluded.{c}' for c in CONTENT_COLUMNS)},
+  synced_at = excluded.synced_at,
+  updated_at = excluded.synced_at
+WHERE {' OR '.join(f'activities.{c} IS NOT excluded.{c}' for c in CONTENT_COLUMNS)}
+"""
+
+DEFAULT_BATCH_SIZE = 500
+
+# (table, column, declaration) for databases created from an older schema
+ADDED_COLUMNS = (
+    ('activity_segments', 'name', 'TEXT'),
+    ('activities', 'user_id', 'INTEGER DEFAULT 1'),
+    ('activities', 'streams_checked_at', 'TEXT'),
+)
+
+ACTIVITY_TYPES = ['Run', 'Walk', 'Ride', 'Swim', 'Hike']
+
+
+def convert_strava_activity(activity, synced_at, user_id=1):
+    """Map a Strava summary or detail payload onto activities columns"""
+    start_latlng = activity.get('start_latlng') or None
+    end_latlng = activity.get('end_latlng') or None
+    activity_map = activity.get('map') or {}
+    return {
+        'external_id': str(activity['id']),
+        'source': 'strava',
+        'user_id': user_id,
+        'name': activity.get('name') or 'Untitled Activity',
+        'description': activity.get('description') or None,
+        'type': activity.get('type') or 'Unknown',
+        'sport_type': activity.get('sport_type') or activity.get('type') or 'Unknown',
+        'start_date': activity['start_date'],
+        'start_date_local': activity.get('start_date_local'),
+        'timezone': activity.get('timezone') or None,
+        'distance': activity.get('distance') or 0,
+        'moving_time': activity.get('moving_time') or 0,
+        'elapsed_time': activity.get('elapsed_time') or 0,
+        'total_elevation_gain': activity.get('total_elevation_gain') or 0,
+        'average_speed': activity.get('average_speed') or 0,
+        'max_speed': activity.get('max_speed') or 0,
+        'start_latitude': start_latlng[0] if start_latlng else None,
+        'start_longitude': start_latlng[1] if start_latlng else None,
+        'end_latitude': end_latlng[0] if end_latlng else None,
+        'end_longitude': end_latlng[1] if end_latlng else None,
+        'location_city': activity.get('location_city') or None,
+        'location_state': activity.get('location_state') or None,
+        'location_country': activity.get('location_country') or None,
+        'summary_polyline': activity_map.get('summary_polyline') or None,
+        'map_id': activity_map.get('id') or None,
+        'average_heartrate': activity.get('average_heartrate') or None,
+        'max_heartrate': activity.get('max_heartrate') or None,
+        'calories': activity.get('calories') or None,
+        'average_cadence': activity.get('average_cadence') or None,
+        'average_power': activity.get('average_watts') or None,
+        'weighted_average_power': activity.get('weighted_average_watts') or None,
+        'synced_at': synced_at,
+    }
+
+
+class UpsertResult:
+    """Counts of rows created, updated and left unchanged by an upsert"""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+
+    @property
+    def processed(self):
+        return self.created + self.updated + self.unchanged
+
+
+class ActivityDatabase:
+    """Batched upserts into the activities table"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.add_missing_columns()
+        self.conn.executescript(SCHEMA_SQL)
+        activity_rollups.migrate(self.conn)
+        # Writes made before the change log existed are unknown to the rollups
+        self.rollups_tracked = activity_rollups.is_tracked(self.conn)
+        self.conn.executescript(ROLLUP_SCHEMA_SQL)
+        self.conn.executescript(GEOMETRY_SCHEMA_SQL)
+        self.conn.executescript(HEATMAP_SCHEMA_SQL)
+        self.conn.executescript(SPATIAL_SCHEMA_SQL)
+        self.conn.executescript(ROUTE_CLUSTER_SCHEMA_SQL)
+
+    def add_missing_columns(self):
+        """Add columns introduced after a table was first created"""
+        for table, column, decl in ADDED_COLUMNS:
+            columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+            if columns and column not in columns:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+    def activity_row_ids(self, external_ids, source='strava'):
+        """Map external ids to activities.id"""
+        external_ids = list(external_ids)
+        row_ids = {}
+        for offset in range(0, len(external_ids), DEFAULT_BATCH_SIZE):
+            chunk = external_ids[offset:offset + DEFAULT_BATCH_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            row_ids.update(self.conn.execute(
+                f'SELECT external_id, id FROM activities WHERE source = ? AND external_id IN ({placeholders})',
+                [source, *chunk],
+            ))
+        return row_ids
+
+    def delete_activities(self, external_ids, result=None, source='strava'):
+        """Delete activities (derived rows cascade), counting them in `result`"""
+        result = result or UpsertResult()
+        external_ids = [str(i) for i in external_ids]
+        for offset in range(0, len(external_ids), DEFAULT_BATCH_SIZE):
+            chunk = external_ids[offset:offset + DEFAULT_BATCH_SIZE]
+            with self.conn:
+                result.deleted += self.conn.execute(
+                    f"DELETE FROM activities WHERE source = ? AND external_id IN ({','.join('?' * len(chunk))})",
+                    [source, *chunk],
+                ).rowcount
+        return result
+
+    def upsert_activities(self, activities, batch_size=DEFAULT_BATCH_SIZE, user_id=1):
+        """Upsert Strava payloads in batches of one transaction each"""
+        result = UpsertResult()
+        synced_at = datetime.now(timezone.utc).isoformat()
+        batch = []
+
+        def flush():
+            existing = self.activity_row_ids(row['external_id'] for row in batch)
+            with self.conn:
+                # rowcount leaves out the rows the rollup triggers write
+                touched = self.conn.executemany(UPSERT_SQL, batch).rowcount
+            created = sum(1 for row in batch if row['external_id'] not in existing)
+            result.created += created
+            result.updated += touched - created
+            result.unchanged += len(batch) - touched
+            batch.clear()
+
+        for activity in activities:
+            batch.append(convert_strava_activity(activity, synced_at, user_id))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+        return result
+
+    def activities_missing_streams(self, external_ids, source='strava'):
+        """(id, external_id, start_date) for activities with no stored data points
+
+        Activities already found to have no streams (streams_checked_at) are
+        left out.
+        """
+        external_ids = list(external_ids)
+        missing = []
+        for offset in range(0, len(external_ids), DEFAULT_BATCH_SIZE):
+            chunk = external_ids[offset:offset + DEFAULT_BATCH_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            missing.extend(self.conn.execute(
+                f'''
+                SELECT a.id, a.external_id, a.start_date FROM activities a
+                WHERE a.source = ? AND a.external_id IN ({placeholders})
+                  AND a.streams_checked_at IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM activity_data_points p WHERE p.activity_id = a.id)
+                ''',
+                [source, *chunk],
+            ))
+        missing.sort(key=lambda row: row[2], reverse=True)
+        return missing
+
+    def mark_streams_checked(self, activity_ids):
+        """Record activities Strava has no usable streams for, so they are not asked again"""
+        checked_at = datetime.now(timezone.utc).isoformat()
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE activities SET streams_checked_at = ? WHERE id = ?',
+                [(checked_at, activity_id) for activity_id in activity_ids],
+            )
+
+    def replace_data_points(self, activity_id, rows, columns):
+        """Swap an activity's data points for `rows` in one transaction"""
+        sql = (f"INSERT INTO activity_data_points ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        with self.conn:
+            self.conn.execute('DELETE FROM activity_data_points WHERE activity_id = ?', (activity_id,))
+            self.conn.executemany(sql, rows)
+
+    def refresh_rollups(self):
+        """Refresh stats rollups for the buckets logged since the last refresh
+
+        The first run against a database without rollups, or without the
+        change log, rebuilds them all.
+        """
+        empty = self.conn.execute('SELECT 1 FROM activity_stats LIMIT 1').fetchone() is None
+        has_activities = self.conn.execute('SELECT 1 FROM activities LIMIT 1').fetchone()
+        if has_activities and (empty or not self.rollups_tracked):
+            activity_rollups.rebuild(self.conn)
+            self.rollups_tracked = True
+            return None
+        return activity_rollups.refresh(self.conn)
+
+    def refresh_geometry(self):
+        """Recompute activity_geometry for new or changed routes"""
+        return activity_geometry.refresh_geometry(self.conn)
+
+    def refresh_heatmap(self):
+        """Add new routes to the heatmap count grids; (added, rebuilt)"""
+        return heatmap.refresh_heatmap(self.conn)
+
+    def refresh_spatial_index(self):
+        """Re-index changed routes and start points; (reindexed, removed)"""
+        return activity_spatial.refresh_spatial_index(self.conn)
+
+    def refresh_route_clusters(self):
+        """Match new or re-drawn routes to route clusters; (matched, created)"""
+        return route_clusters.refresh_route_clusters(self.conn)
+
+    def replace_segments(self, activity_ids, rows, columns):
+        """Swap the segments of `activity_ids` for `rows` in one transaction"""
+        activity_ids = list(activity_ids)
+        sql = (f"INSERT INTO activity_segments ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        with self.conn:
+            for offset in range(0, len(activity_ids), DEFAULT_BATCH_SIZE):
+                chunk = activity_ids[offset:offset + DEFAULT_BATCH_SIZE]
+                self.conn.execute(
+                    f"DELETE FROM activity_segments WHERE activity_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            self.conn.executemany(sql, rows)
+
+    def sync_connections(self, source='strava'):
+        """(user_id, refresh_token, last_sync_at) of active auto-sync connections, stalest first"""
+        return self.conn.execute(
+            '''
+            SELECT user_id, refresh_token, last_sync_at FROM data_source_settings
+            WHERE source = ? AND is_active = 1 AND auto_sync = 1
+            ORDER BY last_sync_at IS NOT NULL, last_sync_at, user_id
+            ''',
+            (source,),
+        ).fetchall()
+
+    def record_sync(self, sync_type, status, result, started_at, completed_at=None,
+                    error_message=None, source='strava', user_id=1, metrics=None, params=None):
+        """Log a sync run and update the source's data_source_settings row
+
+        A 'success' run stamps last_sync_at and marks the connection
+        'connected'; any other status marks it 'error' and leaves
+        last_sync_at at the last run that worked.
+
+        With a SyncMetrics, the row also gets the API call count, remaining
+        rate limit and, in sync_params, `params` plus the metrics summary.
+        Returns the sync_logs id.
+        """
+        completed_at = completed_at or datetime.now(timezone.utc)
+        succeeded = status == 'success'
+        sync_params = None
+        if metrics is not None or params:
+            sync_params = json.dumps({
+                'params': params or {},
+                **(metrics.summary() if metrics is not None else {}),
+            })
+        with self.conn:
+            cursor = self.conn.execute(
+                '''
+                INSERT INTO sync_logs (
+                  user_id, source, sync_type, status, activities_processed,
+                  activities_created, activities_updated, activities_skipped,
+                  error_message, started_at, completed_at, duration_seconds,
+                  sync_params, api_calls_made, rate_limit_remaining
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (
+                    user_id, source, sync_type, status, result.processed,
+                    result.created, result.updated, result.unchanged,
+                    error_message, started_at.isoformat(), completed_at.isoformat(),
+                    int((completed_at - started_at).total_seconds()),
+                    sync_params,
+                    metrics.api_calls if metrics is not None else 0,
+                    metrics.rate_limit_remaining if metrics is not None else None,
+                ),
+            )
+            self.conn.execute(
+                '''
+                INSERT INTO data_source_settings (
+                  user_id, source, auto_sync, sync_frequency, last_sync_at,
+                  activity_types, privacy_settings, is_active, connection_status,
+                  created_at, updated_at
+                ) VALUES (?, ?, 1, 'daily', ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT(user_id, source) DO UPDATE SET
+                  last_sync_at = COALESCE(excluded.last_sync_at, data_source_settings.last_sync_at),
+                  is_active = excluded.is_active,
+                  connection_status = excluded.connection_status,
+                  updated_at = excluded.updated_at
+                ''',
+                (
+                    user_id, source, completed_at.isoformat() if succeeded else None,
+                    json.dumps(ACTIVITY_TYPES),
+                    json.dumps({'credentialStorage': 'github-actions-secrets'}),
+                    'connected' if succeeded else 'error',
+                    completed_at.isoformat(), completed_at.isoformat(),
+                ),
+            )
+        return cursor.lastrowid
+
+    def merge_sync_metrics(self, log_id, summary):
+        """Fold a later step's SyncMetrics summary into a logged run's sync_params"""
+        row = self.conn.execute('SELECT sync_params FROM sync_logs WHERE id = ?', (log_id,)).fetchone()
+        if row is None:
+            return False
+        try:
+            sync_params = json.loads(row[0]) if row[0] else {}
+        except ValueError:
+            sync_params = {}
+        for key in ('stages', 'requests'):
+            sync_params[key] = {**sync_params.get(key, {}), **summary.get(key, {})}
+        sync_params['bytes'] = sync_params.get('bytes', 0) + summary.get('bytes', 0)
+        with self.conn:
+            self.conn.execute('UPDATE sync_logs SET sync_params = ? WHERE id = ?',
+                              (json.dumps(sync_params), log_id))
+        return True
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Precomputed route geometry for each activity
+
+For every activity with a summary polyline, activity_geometry stores a
+simplified polyline that fits a static-map URL budget, the route bounds,
+and the map center and zoom (from the bounds padded by 10%). Rows are
+keyed to the polyline hash, so only new or changed routes are recomputed,
+and map generation reads them instead of decoding every route each run.
+"""
+
+from urllib.parse import quote
+
+from polylines import decode, polyline_hash, simplify_to_budget
+
+GEOMETRY_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS activity_geometry (
+  activity_id INTEGER PRIMARY KEY,
+  polyline_hash TEXT NOT NULL,
+  simplified_polyline TEXT NOT NULL,
+  point_count INTEGER NOT NULL,
+  simplified_point_count INTEGER NOT NULL,
+  tolerance REAL NOT NULL,
+  min_lat REAL,
+  max_lat REAL,
+  min_lng REAL,
+  max_lng REAL,
+  center_lat REAL,
+  center_lng REAL,
+  zoom INTEGER,
+  length_m REAL,
+  FOREIGN KEY (activity_id) REFERENCES activities(id) ON DELETE CASCADE
+);
+"""
+
+GEOMETRY_COLUMNS = (
+    'activity_id', 'polyline_hash', 'simplified_polyline', 'point_count',
+    'simplified_point_count', 'tolerance', 'min_lat', 'max_lat', 'min_lng', 'max_lng',
+    'center_lat', 'center_lng', 'zoom', 'length_m',
+)
+
+# URL-quoted characters left for the route in a 2000-character static map
+# URL once style, markers, center and access token are accounted for
+URL_POLYLINE_BUDGET = 1500
+
+MAP_PADDING = 0.1
+
+
+def quoted_length(encoded):
+    """Length of a polyline once quoted into a URL"""
+    return len(quote(encoded))
+
+
+def zoom_for_bounds(bounds):
+    """Static map zoom level that fits a bounding box"""
+    lat_diff = bounds['max_lat'] - bounds['min_lat']
+    lng_diff = bounds['max_lng'] - bounds['min_lng']
+    max_diff = max(lat_diff, lng_diff)
+
+    if max_diff < 0.01:
+        return 14
+    elif max_diff < 0.05:
+        return 12
+    elif max_diff < 0.1:
+        return 11
+    elif max_diff < 0.5:
+        return 9
+    elif max_diff < 1:
+        return 8
+    else:
+        return 7
+
+
+def build_geometry(encoded, route=None, budget=URL_POLYLINE_BUDGET):
+    """Geometry dict (GEOMETRY_COLUMNS minus activity_id) for a polyline
+
+    Returns None for empty or malformed polylines.
+    """
+    if route is None:
+        try:
+            route = decode(encoded)
+        except IndexError:
+            return None
+    if not len(route):
+        return None
+
+    simplified, simplified_count, tolerance = simplify_to_budget(
+        encoded, route, budget, measure=quoted_length)
+    padded = route.bounds(padding=MAP_PADDING)
+    return {
+        'polyline_hash': polyline_hash(encoded),
+        'simplified_polyline': simplified,
+        'point_count': len(route),
+        'simplified_point_count': simplified_count,
+        'tolerance': tolerance,
+        'min_lat': route.min_lat,
+        'max_lat': route.max_lat,
+        'min_lng': route.min_lng,
+        'max_lng': route.max_lng,
+        'center_lat': (padded['min_lat'] + padded['max_lat']) / 2,
+        'center_lng': (padded['min_lng'] + padded['max_lng']) / 2,
+        'zoom': zoom_for_bounds(padded),
+        'length_m': route.length_m,
+    }
+
+
+def refresh_geometry(conn, batch_size=500):
+    """Compute geometry for activities whose route is new or changed"""
+    rows = conn.execute('''
+        SELECT a.id, a.summary_polyline, g.polyline_hash
+        FROM activities a LEFT JOIN activity_geometry g ON g.activity_id = a.id
+        WHERE a.summary_polyline IS NOT NULL AND a.summary_polyline != ''
+    ''').fetchall()
+    stale = [(row_id, encoded) for row_id, encoded, stored_hash in rows
+             if stored_hash != polyline_hash(encoded)]
+
+    sql = (f"INSERT OR REPLACE INTO activity_geometry ({', '.join(GEOMETRY_COLUMNS)}) "
+           f"VALUES ({', '.join(':' + c for c in GEOMETRY_COLUMNS)})")
+    updated = 0
+    for start in range(0, len(stale), batch_size):
+        batch = []
+        for row_id, encoded in stale[start:start + batch_size]:
+            geometry = build_geometry(encoded)
+            if geometry:
+                geometry['activity_id'] = row_id
+                batch.append(geometry)
+        with conn:
+            conn.executemany(sql, batch)
+        updated += len(batch)
+    return updated
+
+
+def load_geometry(conn, external_ids, source='strava'):
+    """{external_id: geometry dict} for the given activities"""
+    external_ids = [str(i) for i in external_ids]
+    geometry = {}
+    for start in range(0, len(external_ids), 500):
+        chunk = external_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor = conn.execute(
+            f'''
+            SELECT a.external_id, {', '.join('g.' + c for c in GEOMETRY_COLUMNS[1:])}
+            FROM activities a JOIN activity_geometry g ON g.activity_id = a.id
+            WHERE a.source = ? AND a.external_id IN ({placeholders})
+            ''',
+            [source, *chunk],
+        )
+        for external_id, *values in cursor:
+            geometry[external_id] = dict(zip(GEOMETRY_COLUMNS[1:], values))
+    return geometry
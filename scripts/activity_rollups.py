@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Materialized stats rollups for the activities table
+
+activity_stats holds per athlete x day/week/month/year x type totals and
+personal_records the longest, fastest and hilliest activity per athlete x
+year x type (year 'all' for all time). Both are refreshed only for the
+buckets touched by new or changed activities, so the deployed read-only
+database ships precomputed answers for /api/stats instead of raw rows to
+scan.
+
+Triggers on activities log the buckets every insert, relevant update and
+delete touches in activity_stats_changes, whichever program writes the
+row (the sync, the web app's Strava sync route, the JSON migration).
+refresh() drains that log. /api/stats only reads the rollups while the log
+is empty, so writes made outside the sync never serve stale totals.
+
+Buckets use the same keys as the SQLite expressions in /api/stats on the
+UTC start_date: day 'YYYY-MM-DD', week 'YYYY-WW' (strftime %W, Monday
+first), month 'YYYY-MM', year 'YYYY'.
+"""
+
+from datetime import date, timedelta
+
+ROLLUP_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS activity_stats (
+  user_id INTEGER NOT NULL,
+  period TEXT NOT NULL,
+  bucket TEXT NOT NULL,
+  type TEXT NOT NULL,
+  activities INTEGER NOT NULL,
+  distance REAL NOT NULL,
+  moving_time INTEGER NOT NULL,
+  elevation_gain REAL NOT NULL,
+  longest_distance REAL,
+  first_activity TEXT,
+  last_activity TEXT,
+  PRIMARY KEY (user_id, period, bucket, type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS personal_records (
+  user_id INTEGER NOT NULL,
+  record TEXT NOT NULL,
+  year TEXT NOT NULL,
+  type TEXT NOT NULL,
+  activity_id INTEGER NOT NULL,
+  name TEXT,
+  value REAL NOT NULL,
+  distance REAL,
+  moving_time INTEGER,
+  total_elevation_gain REAL,
+  start_date TEXT,
+  PRIMARY KEY (user_id, record, year, type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS activity_stats_changes (
+  id INTEGER PRIMARY KEY,
+  user_id INTEGER,
+  start_date TEXT NOT NULL,
+  type TEXT NOT NULL
+);
+
+-- INSERT OR REPLACE deletes the old row without firing delete triggers
+CREATE TRIGGER IF NOT EXISTS activity_stats_on_replace BEFORE INSERT ON activities
+BEGIN
+  INSERT INTO activity_stats_changes (user_id, start_date, type)
+  SELECT user_id, start_date, type FROM activities
+  WHERE external_id = NEW.external_id AND source = NEW.source
+    AND (user_id IS NOT NEW.user_id OR start_date IS NOT NEW.start_date OR type IS NOT NEW.type
+      OR name IS NOT NEW.name OR distance IS NOT NEW.distance OR moving_time IS NOT NEW.moving_time
+      OR total_elevation_gain IS NOT NEW.total_elevation_gain);
+END;
+
+CREATE TRIGGER IF NOT EXISTS activity_stats_on_insert AFTER INSERT ON activities
+BEGIN
+  INSERT INTO activity_stats_changes (user_id, start_date, type)
+  VALUES (NEW.user_id, NEW.start_date, NEW.type);
+END;
+
+CREATE TRIGGER IF NOT EXISTS activity_stats_on_update
+AFTER UPDATE OF user_id, start_date, type, name, distance, moving_time, total_elevation_gain ON activities
+WHEN OLD.user_id IS NOT NEW.user_id OR OLD.start_date IS NOT NEW.start_date
+  OR OLD.type IS NOT NEW.type OR OLD.name IS NOT NEW.name OR OLD.distance IS NOT NEW.distance
+  OR OLD.moving_time IS NOT NEW.moving_time OR OLD.total_elevation_gain IS NOT NEW.total_elevation_gain
+BEGIN
+  INSERT INTO activity_stats_changes (user_id, start_date, type)
+  VALUES (OLD.user_id, OLD.start_date, OLD.type), (NEW.user_id, NEW.start_date, NEW.type);
+END;
+
+CREATE TRIGGER IF NOT EXISTS activity_stats_on_delete AFTER DELETE ON activities
+BEGIN
+  INSERT INTO activity_stats_changes (user_id, start_date, type)
+  VALUES (OLD.user_id, OLD.start_date, OLD.type);
+END;
+"""
+
+PERIODS = ('day', 'week', 'month', 'year')
+
+# record -> (value expression, extra filter, order); the filters match the
+# raw fallback queries in /api/stats
+RECORDS = {
+    'longest_distance': ('distance', 'distance IS NOT NULL', 'DESC'),
+    'fastest_pace': ('(moving_time / 60.0) / (distance / 1000.0)', 'distance > 1000 AND moving_time > 0', 'ASC'),
+    'most_elevation': ('total_elevation_gain', 'total_elevation_gain > 0', 'DESC'),
+}
+
+BUCKET_SQL = {
+    'day': "strftime('%Y-%m-%d', start_date)",
+    'week': "strftime('%Y-%W', start_date)",
+    'month': "strftime('%Y-%m', start_date)",
+    'year': "strftime('%Y', start_date)",
+}
+
+STATS_SELECT = """
+SELECT user_id, ?, {bucket}, type, COUNT(*), COALESCE(SUM(distance), 0), COALESCE(SUM(moving_time), 0),
+       COALESCE(SUM(total_elevation_gain), 0), MAX(distance), MIN(start_date), MAX(start_date)
+FROM activities
+"""
+
+
+def bucket_range(period, day):
+    """(bucket key, first day, day after last) of the bucket containing `day`"""
+    if period == 'day':
+        return day.isoformat(), day, day + timedelta(days=1)
+    if period == 'month':
+        end = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        return day.strftime('%Y-%m'), day.replace(day=1), end
+    if period == 'year':
+        return str(day.year), date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    # %W weeks start on Monday; days before the first Monday are week 00
+    start = max(day - timedelta(days=day.weekday()), date(day.year, 1, 1))
+    end = min(day + timedelta(days=7 - day.weekday()), date(day.year + 1, 1, 1))
+    return day.strftime('%Y-%W'), start, end
+
+
+def touched_buckets(keys):
+    """{(user, period, bucket, start, end, type)} and {(user, year, type)} for (user_id, start_date, type)"""
+    buckets = set()
+    record_keys = set()
+    for user_id, start_date, activity_type in keys:
+        if user_id is None:
+            # /api/stats filters on user_id, which never matches NULL
+            continue
+        day = date.fromisoformat(start_date[:10])
+        for period in PERIODS:
+            buckets.add((user_id, period, *bucket_range(period, day), activity_type))
+        record_keys.add((user_id, str(day.year), activity_type))
+        record_keys.add((user_id, 'all', activity_type))
+    return buckets, record_keys
+
+
+def migrate(conn):
+    """Drop rollup tables from before they were kept per athlete; rebuild() refills them"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(activity_stats)')}
+    if columns and 'user_id' not in columns:
+        conn.execute('DROP TABLE activity_stats')
+        conn.execute('DROP TABLE IF EXISTS personal_records')
+
+
+def is_tracked(conn):
+    """Whether activity writes are being logged for the rollups"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activity_stats_changes'"
+    ).fetchone() is not None
+
+
+def refresh_record(conn, record, user_id, year, activity_type):
+    value_sql, condition, order = RECORDS[record]
+    where = f'user_id = ? AND type = ? AND {condition}'
+    params = [user_id, activity_type]
+    if year != 'all':
+        where += ' AND start_date >= ? AND start_date < ?'
+        params += [year, str(int(year) + 1)]
+    conn.execute('DELETE FROM personal_records WHERE user_id = ? AND record = ? AND year = ? AND type = ?',
+                 (user_id, record, year, activity_type))
+    conn.execute(
+        f'''
+        INSERT INTO personal_records
+        SELECT ?, ?, ?, type, id, name, {value_sql}, distance, moving_time, total_elevation_gain, start_date
+        FROM activities WHERE {where}
+        ORDER BY {value_sql} {order}, start_date LIMIT 1
+        ''',
+        [user_id, record, year, *params],
+    )
+
+
+def rebuild(conn):
+    """Recompute every rollup from scratch"""
+    with conn:
+        conn.execute('DELETE FROM activity_stats_changes')
+        conn.execute('DELETE FROM activity_stats')
+        for period, bucket_sql in BUCKET_SQL.items():
+            conn.execute(
+                f"INSERT INTO activity_stats {STATS_SELECT.format(bucket=bucket_sql)} "
+                "WHERE user_id IS NOT NULL GROUP BY user_id, 3, type",
+                (period,),
+            )
+        conn.execute('DELETE FROM personal_records')
+        keys = conn.execute(
+            "SELECT DISTINCT user_id, strftime('%Y', start_date), type FROM activities "
+            "WHERE user_id IS NOT NULL"
+        ).fetchall()
+        all_time = {(user_id, 'all', activity_type) for user_id, _, activity_type in keys}
+        for user_id, year, activity_type in keys + sorted(all_time):
+            for record in RECORDS:
+                refresh_record(conn, record, user_id, year, activity_type)
+
+
+def refresh(conn):
+    """Recompute only the buckets and records logged in activity_stats_changes"""
+    with conn:
+        last_change = conn.execute('SELECT MAX(id) FROM activity_stats_changes').fetchone()[0]
+        if last_change is None:
+            return 0
+        keys = conn.execute(
+            'SELECT DISTINCT user_id, start_date, type FROM activity_stats_changes WHERE id <= ?',
+            (last_change,),
+        ).fetchall()
+        buckets, record_keys = touched_buckets(keys)
+        for user_id, period, bucket, start, end, activity_type in buckets:
+            conn.execute(
+                'DELETE FROM activity_stats WHERE user_id = ? AND period = ? AND bucket = ? AND type = ?',
+                (user_id, period, bucket, activity_type),
+            )
+            # Range on start_date so the lookup uses idx_activities_user
+            conn.execute(
+                f"INSERT INTO activity_stats {STATS_SELECT.format(bucket='?')} "
+                "WHERE user_id = ? AND start_date >= ? AND start_date < ? AND type = ? "
+                "GROUP BY type",
+                (period, bucket, user_id, start.isoformat(), end.isoformat(), activity_type),
+            )
+        for user_id, year, activity_type in record_keys:
+            for record in RECORDS:
+                refresh_record(conn, record, user_id, year, activity_type)
+        conn.execute('DELETE FROM activity_stats_changes WHERE id <= ?', (last_change,))
+    return len(buckets)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Flatten splits, laps and efforts from Strava detail payloads
+
+Each detail carries splits_metric, laps, best_efforts and segment_efforts
+arrays. This module turns them into activity_segments rows so questions
+like "fastest 5k" or "split pace trend" become indexed queries instead of
+parsing JSON per request.
+"""
+
+SEGMENT_COLUMNS = (
+    'activity_id', 'segment_type', 'sequence_number', 'name',
+    'distance', 'moving_time', 'elapsed_time', 'average_speed', 'max_speed',
+    'average_heartrate', 'max_heartrate', 'total_elevation_gain',
+    'start_index', 'end_index',
+)
+
+# Detail array -> segment_type stored in activity_segments
+SEGMENT_SOURCES = (
+    ('splits_metric', 'split'),
+    ('laps', 'lap'),
+    ('best_efforts', 'best_effort'),
+    ('segment_efforts', 'segment_effort'),
+)
+
+
+def average_speed(item):
+    """Reported average speed, else distance over moving time"""
+    if item.get('average_speed') is not None:
+        return item['average_speed']
+    moving_time = item.get('moving_time') or item.get('elapsed_time')
+    if item.get('distance') and moving_time:
+        return item['distance'] / moving_time
+    return None
+
+
+def segment_name(segment_type, item):
+    if segment_type == 'segment_effort':
+        return item.get('name') or (item.get('segment') or {}).get('name')
+    return item.get('name')
+
+
+def segment_rows(activity_id, detail):
+    """Build activity_segments tuples (see SEGMENT_COLUMNS) from a detail payload"""
+    rows = []
+    for key, segment_type in SEGMENT_SOURCES:
+        for index, item in enumerate(detail.get(key) or [], start=1):
+            rows.append((
+                activity_id,
+                segment_type,
+                item.get('split') or item.get('lap_index') or index,
+                segment_name(segment_type, item),
+                item.get('distance'),
+                item.get('moving_time'),
+                item.get('elapsed_time'),
+                average_speed(item),
+                item.get('max_speed'),
+                item.get('average_heartrate'),
+                item.get('max_heartrate'),
+                item.get('total_elevation_gain'),
+                item.get('start_index'),
+                item.get('end_index'),
+            ))
+    return rows
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Spatial index over activity routes and start points
+
+activity_rtree is an SQLite R*Tree over each activity's route bounding box
+(or its start point when it has no route), and activity_cells lists the
+geohash cells (precision 6, about 1.2 x 0.6 km) each route passes through.
+Both are refreshed at sync time for activities whose route or start point
+changed, tracked by a key in activity_spatial_keys, so location queries
+read the index instead of scanning activities and decoding polylines.
+
+Query helpers: activities_in_bbox, activities_near (by start point or by
+route) and activities_in_cell (any geohash prefix).
+"""
+
+import math
+
+from polylines import EARTH_RADIUS_M, LOOKUP_BATCH_SIZE, SQLITE_MAX_VARIABLES, decode, polyline_hash
+
+SPATIAL_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS activity_rtree USING rtree(
+  activity_id,
+  min_lat, max_lat,
+  min_lng, max_lng
+);
+
+CREATE TABLE IF NOT EXISTS activity_cells (
+  cell TEXT NOT NULL,
+  activity_id INTEGER NOT NULL,
+  PRIMARY KEY (cell, activity_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_activity_cells_activity ON activity_cells(activity_id);
+
+CREATE TABLE IF NOT EXISTS activity_spatial_keys (
+  activity_id INTEGER PRIMARY KEY,
+  spatial_key TEXT NOT NULL
+);
+"""
+
+CELL_PRECISION = 6
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Sorts after every geohash character, for prefix range scans
+PREFIX_END = '{'
+
+
+def geohash(lat, lng, precision=CELL_PRECISION):
+    """Geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision=CELL_PRECISION):
+    """(lat degrees, lng degrees) spanned by a geohash cell"""
+    total_bits = 5 * precision
+    return 180.0 / 2 ** (total_bits // 2), 360.0 / 2 ** ((total_bits + 1) // 2)
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    to_rad = math.pi / 180.0
+    dlat = (lat2 - lat1) * to_rad
+    dlng = (lng2 - lng1) * to_rad
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(lat1 * to_rad) * math.cos(lat2 * to_rad) * math.sin(dlng / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def route_cells(points, precision=CELL_PRECISION):
+    """Geohash cells an interleaved lat/lng route passes through
+
+    Segments are sampled at half-cell steps so long straight segments do not
+    skip the cells between their ends.
+    """
+    lat_step, lng_step = cell_size(precision)
+    cells = set()
+    for i in range(0, len(points), 2):
+        lat, lng = points[i], points[i + 1]
+        if i:
+            prev_lat, prev_lng = points[i - 2], points[i - 1]
+            steps = int(max(abs(lat - prev_lat) / lat_step, abs(lng - prev_lng) / lng_step) * 2)
+            for step in range(1, steps + 1):
+                t = step / (steps + 1)
+                cells.add(geohash(prev_lat + (lat - prev_lat) * t, prev_lng + (lng - prev_lng) * t, precision))
+        cells.add(geohash(lat, lng, precision))
+    return cells
+
+
+def bbox_cells(min_lat, max_lat, min_lng, max_lng, precision=CELL_PRECISION, limit=4096):
+    """Geohash cells covering a box, or None if there would be more than `limit`"""
+    lat_step, lng_step = cell_size(precision)
+    rows = int((max_lat - min_lat) / lat_step) + 2
+    cols = int((max_lng - min_lng) / lng_step) + 2
+    if rows * cols > limit:
+        return None
+    return {
+        geohash(min(min_lat + r * lat_step, max_lat), min(min_lng + c * lng_step, max_lng), precision)
+        for r in range(rows) for c in range(cols)
+    }
+
+
+def route_distance_m(lat, lng, points):
+    """Distance from a point to the nearest segment of a route
+
+    Uses a local equirectangular projection, which is accurate at the
+    radii "near here" searches use.
+    """
+    scale_y = math.radians(1) * EARTH_RADIUS_M
+    scale_x = scale_y * math.cos(math.radians(lat))
+    best = math.inf
+    previous = None
+    for i in range(0, len(points), 2):
+        x, y = (points[i + 1] - lng) * scale_x, (points[i] - lat) * scale_y
+        if previous is None:
+            best = min(best, math.hypot(x, y))
+        else:
+            x0, y0 = previous
+            dx, dy = x - x0, y - y0
+            length = dx * dx + dy * dy
+            t = 0.0 if length == 0 else max(0.0, min(1.0, -(x0 * dx + y0 * dy) / length))
+            best = min(best, math.hypot(x0 + dx * t, y0 + dy * t))
+        previous = (x, y)
+    return best
+
+
+def spatial_key(encoded, start_lat, start_lng):
+    """What an activity's index rows are derived from, to detect changes"""
+    if encoded:
+        return polyline_hash(encoded)
+    if start_lat is not None and start_lng is not None:
+        return f"start:{start_lat},{start_lng}"
+    return None
+
+
+def radius_bbox(lat, lng, radius_m):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle"""
+    lat_delta = math.degrees(radius_m / EARTH_RADIUS_M)
+    lng_delta = lat_delta / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - lat_delta, lat + lat_delta, lng - lng_delta, lng + lng_delta
+
+
+def refresh_spatial_index(conn, batch_size=500):
+    """Re-index activities whose route or start point changed; drop removed ones"""
+    rows = conn.execute('''
+        SELECT a.id, a.summary_polyline, a.start_latitude, a.start_longitude, k.spatial_key
+        FROM activities a LEFT JOIN activity_spatial_keys k ON k.activity_id = a.id
+    ''').fetchall()
+    stale = []
+    for row_id, encoded, start_lat, start_lng, stored_key in rows:
+        key = spatial_key(encoded, start_lat, start_lng)
+        if key != stored_key:
+            stale.append((row_id, encoded, start_lat, start_lng, key))
+
+    with conn:
+        # R*Tree rows have no foreign key, so clear out deleted activities by hand
+        orphans = [r[0] for r in conn.execute(
+            'SELECT activity_id FROM activity_spatial_keys '
+            'WHERE activity_id NOT IN (SELECT id FROM activities)')]
+        for row_id in orphans:
+            clear_activity(conn, row_id)
+
+    for start in range(0, len(stale), batch_size):
+        with conn:
+            for row_id, encoded, start_lat, start_lng, key in stale[start:start + batch_size]:
+                clear_activity(conn, row_id)
+                if key is None:
+                    continue
+                index_activity(conn, row_id, encoded, start_lat, start_lng, key)
+    return len(stale), len(orphans)
+
+
+def clear_activity(conn, activity_id):
+    conn.execute('DELETE FROM activity_rtree WHERE activity_id = ?', (activity_id,))
+    conn.execute('DELETE FROM activity_cells WHERE activity_id = ?', (activity_id,))
+    conn.execute('DELETE FROM activity_spatial_keys WHERE activity_id = ?', (activity_id,))
+
+
+def index_activity(conn, activity_id, encoded, start_lat, start_lng, key):
+    route = None
+    if encoded:
+        try:
+            route = decode(encoded)
+        except IndexError:
+            route = None
+
+    if route is not None and len(route):
+        box = (route.min_lat, route.max_lat, route.min_lng, route.max_lng)
+        cells = route_cells(route.points)
+    elif start_lat is not None and start_lng is not None:
+        box = (start_lat, start_lat, start_lng, start_lng)
+        cells = {geohash(start_lat, start_lng)}
+    else:
+        box, cells = None, ()
+
+    if box:
+        conn.execute('INSERT INTO activity_rtree VALUES (?, ?, ?, ?, ?)', (activity_id, *box))
+    conn.executemany('INSERT INTO activity_cells (cell, activity_id) VALUES (?, ?)',
+                     [(cell, activity_id) for cell in cells])
+    conn.execute('INSERT INTO activity_spatial_keys (activity_id, spatial_key) VALUES (?, ?)',
+                 (activity_id, key))
+
+
+def activities_in_bbox(conn, min_lat, max_lat, min_lng, max_lng):
+    """Ids of activities whose route bounding box overlaps a box"""
+    return [row[0] for row in conn.execute(
+        'SELECT activity_id FROM activity_rtree '
+        'WHERE max_lat >= ? AND min_lat <= ? AND max_lng >= ? AND min_lng <= ?',
+        (min_lat, max_lat, min_lng, max_lng),
+    )]
+
+
+def activities_near(conn, lat, lng, radius_m, by='start'):
+    """Ids of activities starting (by='start') or passing (by='route') within radius_m
+
+    Candidates come from the R*Tree. Start points are then checked exactly;
+    for routes, only candidates sharing a geohash cell with the search box
+    are decoded and measured segment by segment.
+    """
+    min_lat, max_lat, min_lng, max_lng = radius_bbox(lat, lng, radius_m)
+    candidates = activities_in_bbox(conn, min_lat, max_lat, min_lng, max_lng)
+    if not candidates:
+        return []
+
+    matches = []
+    for start in range(0, len(candidates), LOOKUP_BATCH_SIZE):
+        chunk = candidates[start:start + LOOKUP_BATCH_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        if by == 'start':
+            rows = conn.execute(
+                f'SELECT id, start_latitude, start_longitude FROM activities WHERE id IN ({placeholders})',
+                chunk,
+            )
+            matches.extend(row_id for row_id, start_lat, start_lng in rows
+                           if start_lat is not None and start_lng is not None
+                           and haversine_m(lat, lng, start_lat, start_lng) <= radius_m)
+            continue
+
+        cells = bbox_cells(min_lat, max_lat, min_lng, max_lng)
+        if cells is not None:
+            cell_list = sorted(cells)
+            in_cells = set()
+            # Cells and ids share one statement's parameter limit
+            cell_batch = SQLITE_MAX_VARIABLES - len(chunk)
+            for offset in range(0, len(cell_list), cell_batch):
+                cell_chunk = cell_list[offset:offset + cell_batch]
+                in_cells.update(row[0] for row in conn.execute(
+                    f"SELECT activity_id FROM activity_cells WHERE cell IN ({','.join('?' * len(cell_chunk))}) "
+                    f"AND activity_id IN ({placeholders})",
+                    [*cell_chunk, *chunk],
+                ))
+            chunk = sorted(in_cells)
+            if not chunk:
+                continue
+            placeholders = ','.join('?' * len(chunk))
+
+        rows = conn.execute(
+            f'SELECT id, summary_polyline, start_latitude, start_longitude '
+            f'FROM activities WHERE id IN ({placeholders})',
+            chunk,
+        )
+        for row_id, encoded, start_lat, start_lng in rows:
+            try:
+                route = decode(encoded) if encoded else None
+            except IndexError:
+                route = None
+            if route is not None and len(route):
+                distance = route_distance_m(lat, lng, route.points)
+            elif start_lat is not None and start_lng is not None:
+                distance = haversine_m(lat, lng, start_lat, start_lng)
+            else:
+                continue
+            if distance <= radius_m:
+                matches.append(row_id)
+    return matches
+
+
+def activities_in_cell(conn, cell):
+    """Ids of activities whose route passes through a geohash cell
+
+    Cells shorter than CELL_PRECISION match every indexed cell they contain.
+    """
+    if len(cell) >= CELL_PRECISION:
+        rows = conn.execute('SELECT activity_id FROM activity_cells WHERE cell = ?',
+                            (cell[:CELL_PRECISION],))
+    else:
+        rows = conn.execute(
+            'SELECT DISTINCT activity_id FROM activity_cells WHERE cell >= ? AND cell < ?',
+            (cell, cell + PREFIX_END),
+        )
+    return [row[0] for row in rows]
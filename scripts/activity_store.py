@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON Lines storage for the synced activity datasets
+
+Datasets are written one activity per line (optionally gzip-compressed) as
+records arrive and read back lazily, so neither the sync nor its consumers
+hold the full history in memory. Legacy pretty-printed .json datasets are
+still readable.
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+FORMATS = ('jsonl', 'jsonl.gz')
+LEGACY_SUFFIX = 'json'
+
+
+def dataset_path(data_dir, name, output_format='jsonl'):
+    """Path a dataset is written to in the given format"""
+    if output_format not in FORMATS:
+        raise ValueError(f"unsupported dataset format: {output_format}")
+    return Path(data_dir) / f"{name}.{output_format}"
+
+
+def find_dataset(data_dir, name):
+    """Existing dataset file for `name`, preferring streaming formats"""
+    for suffix in FORMATS + (LEGACY_SUFFIX,):
+        path = Path(data_dir) / f"{name}.{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def _open_text(path, mode):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def iter_records(path):
+    """Yield records from a .jsonl, .jsonl.gz or legacy .json dataset"""
+    path = Path(path)
+    if path.suffix == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+
+    with _open_text(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def remove_other_formats(data_dir, name, keep):
+    """Delete stale copies of a dataset left in other formats"""
+    for suffix in FORMATS + (LEGACY_SUFFIX,):
+        path = Path(data_dir) / f"{name}.{suffix}"
+        if path != Path(keep) and path.exists():
+            path.unlink()
+
+
+class JsonLinesWriter:
+    """Append records to a temp file and atomically replace the target on success
+
+    If the block raises, the temp file is discarded and the previous
+    dataset is left untouched.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.count = 0
+        self.file = None
+
+    def __enter__(self):
+        if self.path.suffix == '.gz':
+            self.file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        return self
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+        self.count += 1
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
+def merge_records(source, target, upserts, deleted_ids=()):
+    """Rewrite a newest-first dataset with records replaced, added or removed
+
+    `upserts` replace records with the same id in place; ids not present
+    yet are inserted by start_date. `source` may be None for a new dataset.
+    Returns the number of records written.
+    """
+    pending = {record['id']: record for record in upserts}
+    deleted_ids = set(deleted_ids)
+    existing_ids = {record['id'] for record in iter_records(source)} if source is not None else set()
+    new_records = sorted((r for i, r in pending.items() if i not in existing_ids),
+                         key=lambda r: r['start_date'], reverse=True)
+
+    with JsonLinesWriter(target) as writer:
+        if source is not None:
+            for record in iter_records(source):
+                while new_records and new_records[0]['start_date'] >= record['start_date']:
+                    writer.write(new_records.pop(0))
+                if record['id'] not in deleted_ids:
+                    writer.write(pending.get(record['id'], record))
+        writer.write_many(new_records)
+    return writer.count
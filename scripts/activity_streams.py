@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Convert Strava activity streams into activity_data_points rows
+
+/activities/{id}/streams returns one array per stream type; this module
+zips them into per-sample rows so a whole activity can be bulk-inserted
+with a single executemany.
+"""
+
+from datetime import timedelta
+
+STREAM_KEYS = ('latlng', 'time', 'distance', 'altitude', 'heartrate', 'cadence', 'velocity_smooth')
+
+DATA_POINT_COLUMNS = (
+    'activity_id', 'timestamp', 'elapsed_time', 'latitude', 'longitude', 'altitude',
+    'distance', 'speed', 'heartrate', 'cadence',
+)
+
+
+def stream_data(streams, key):
+    """Data array for a stream type from a key_by_type or list response"""
+    if isinstance(streams, list):
+        streams = {stream.get('type'): stream for stream in streams}
+    stream = streams.get(key) or {}
+    return stream.get('data') or []
+
+
+def stream_rows(activity_id, start, streams):
+    """Build activity_data_points tuples (see DATA_POINT_COLUMNS) from streams
+
+    `start` is the activity's aware start datetime; each sample's timestamp
+    is start plus its time-stream offset.
+    """
+    times = stream_data(streams, 'time')
+    if not times:
+        return []
+
+    latlng = stream_data(streams, 'latlng')
+    distance = stream_data(streams, 'distance')
+    altitude = stream_data(streams, 'altitude')
+    heartrate = stream_data(streams, 'heartrate')
+    cadence = stream_data(streams, 'cadence')
+    velocity = stream_data(streams, 'velocity_smooth')
+
+    def at(values, index):
+        return values[index] if index < len(values) else None
+
+    rows = []
+    for index, elapsed in enumerate(times):
+        point = at(latlng, index) or (None, None)
+        rows.append((
+            activity_id,
+            (start + timedelta(seconds=elapsed)).isoformat(),
+            elapsed,
+            point[0],
+            point[1],
+            at(altitude, index),
+            at(distance, index),
+            at(velocity, index),
+            at(heartrate, index),
+            at(cadence, index),
+        ))
+    return rows
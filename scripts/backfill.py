@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Durable progress for a resumable full-history backfill
+
+A backfill pages the whole activity history (anchored at the epoch it
+started, so new uploads do not shift the pages) and then fetches every
+activity's detail, possibly over several runs. Progress lives in
+.cache/backfill/:
+
+- checkpoint.json: phase, next page, last detail id, pending ids,
+  per-activity failure counts and how far details.jsonl had got,
+  replaced atomically
+- activities.jsonl: summaries, appended one page at a time
+- details.jsonl: detail payloads, appended one activity at a time
+
+Details are flushed as they are appended and the checkpoint is saved
+every few of them; on resume, details appended after the last checkpoint
+are read back from the log rather than fetched again. A page re-fetched
+after a crash can leave duplicate summaries, and a retried detail can be
+appended twice, so the readers of both logs keep the last copy of each id.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+from activity_store import iter_records
+
+DEFAULT_BACKFILL_DIR = Path('../.cache/backfill')
+
+# Details attempted this many times without success are given up on
+MAX_DETAIL_ATTEMPTS = 3
+
+
+def repair_tail(path):
+    """Drop a partial last line left by a crash mid-append"""
+    if not path.exists():
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b'\n') + 1)
+
+
+class RecordAppender:
+    """Line-buffered appender; sync() makes what was written durable"""
+
+    def __init__(self, path):
+        repair_tail(path)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+        self.count += 1
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class BackfillCheckpoint:
+    """Checkpoint state plus the summary and detail logs of one backfill"""
+
+    def __init__(self, directory=DEFAULT_BACKFILL_DIR):
+        self.directory = Path(directory)
+        self.state_file = self.directory / 'checkpoint.json'
+        self.activities_file = self.directory / 'activities.jsonl'
+        self.details_file = self.directory / 'details.jsonl'
+        self.state = None
+
+    def exists(self):
+        return self.state_file.exists()
+
+    def load(self):
+        """Load the checkpoint; returns None if there is none or it is unreadable"""
+        try:
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Warning  Ignoring unreadable backfill checkpoint: {e}")
+            return None
+        return self.state
+
+    def start(self, before):
+        """Begin a new backfill of activities before the `before` epoch"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self.state = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'before': int(before),
+            'phase': 'paging',
+            'next_page': 1,
+            'last_detail_id': None,
+            'pending_ids': [],
+            'failed': {},
+        }
+        self.save()
+        return self.state
+
+    def save(self):
+        """Atomically replace checkpoint.json"""
+        self.state['updated_at'] = datetime.now(timezone.utc).isoformat()
+        tmp_path = self.state_file.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_file)
+
+    def append_page(self, activities, next_page):
+        """Persist one page of summaries, then advance the page cursor"""
+        appender = RecordAppender(self.activities_file)
+        try:
+            for activity in activities:
+                appender.write(activity)
+        finally:
+            appender.close()
+        self.state['next_page'] = next_page
+        self.save()
+
+    def activities(self):
+        """Summaries fetched so far, newest first"""
+        if not self.activities_file.exists():
+            return []
+        repair_tail(self.activities_file)
+        records = {record['id']: record for record in iter_records(self.activities_file)}
+        return sorted(records.values(), key=lambda a: a['start_date'], reverse=True)
+
+    def iter_details(self):
+        """Details fetched so far, last copy of each id, in log order"""
+        if not self.details_file.exists():
+            return
+        repair_tail(self.details_file)
+        # Two passes keep memory to one index per id rather than every payload
+        last = {detail['id']: index for index, detail in enumerate(iter_records(self.details_file))}
+        for index, detail in enumerate(iter_records(self.details_file)):
+            if last[detail['id']] == index:
+                yield detail
+
+    def begin_details(self, pending_ids):
+        self.state.update({'phase': 'details', 'pending_ids': list(pending_ids), 'details_offset': 0})
+        self.save()
+
+    def details_appender(self):
+        return RecordAppender(self.details_file)
+
+    def pending_ids(self):
+        """Pending ids, less any detail appended after the last checkpoint"""
+        pending = self.state['pending_ids']
+        if not self.details_file.exists():
+            return pending
+        repair_tail(self.details_file)
+        appended = set()
+        with open(self.details_file, 'rb') as f:
+            f.seek(self.state.get('details_offset', 0))
+            for line in f:
+                if line.strip():
+                    appended.add(json.loads(line)['id'])
+        return [i for i in pending if i not in appended]
+
+    def mark_details(self, appender, last_detail_id, pending_ids):
+        """Checkpoint detail progress after making the appended details durable"""
+        appender.sync()
+        self.state.update({
+            'last_detail_id': last_detail_id,
+            'pending_ids': list(pending_ids),
+            'details_offset': os.fstat(appender.file.fileno()).st_size,
+        })
+        self.save()
+
+    def record_failure(self, activity_id):
+        """Count a failed detail fetch; returns True once it is given up on"""
+        key = str(activity_id)
+        self.state['failed'][key] = self.state['failed'].get(key, 0) + 1
+        return self.state['failed'][key] >= MAX_DETAIL_ATTEMPTS
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.state = None
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Strava sync and static map pipelines against local fake services
+
+For each synthetic history size, runs a full sync, an incremental sync, a
+Mapbox map generation pass and (with Pillow) a local-renderer pass in
+isolated subprocesses pointed at fake_services.py.
+Reports wall time, request counts per endpoint, peak RSS and throughput,
+and writes the results as JSON so runs can be compared for regressions.
+
+Usage: python bench_pipeline.py --sizes 1000,10000 --latency 0.02 --output bench-results.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import map_renderer
+from fake_services import FakeServices, start_server, synthetic_history
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+STAGES = ('sync_full', 'sync_incremental', 'maps', 'maps_local')
+
+
+def run_worker(stage, workspace):
+    """Run one pipeline stage in this process and print its measurements"""
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    os.chdir(workspace / 'scripts')
+    started = time.perf_counter()
+
+    if stage.startswith('sync'):
+        import sync_strava
+        ok = sync_strava.StravaSync().sync_all_activities()
+    else:
+        spec = importlib.util.spec_from_file_location('generate_static_maps', SCRIPTS_DIR / 'generate-static-maps.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        generator = module.StaticMapGenerator(renderer='local' if stage == 'maps_local' else 'mapbox')
+        generator.generate_maps()
+        ok = generator.report.counts()['error'] == 0
+
+    result = {
+        'ok': bool(ok),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print(json.dumps(result))
+
+
+def make_workspace():
+    """Temp tree mirroring the repo layout the scripts resolve paths against"""
+    workspace = Path(tempfile.mkdtemp(prefix='run2-bench-'))
+    (workspace / 'scripts').mkdir()
+    (workspace / 'apps/web/data').mkdir(parents=True)
+    (workspace / 'apps/web/public/maps').mkdir(parents=True)
+    return workspace
+
+
+def run_stage(stage, workspace, base_url, size):
+    env = dict(os.environ)
+    env.update({
+        'STRAVA_CLIENT_ID': 'bench',
+        'STRAVA_CLIENT_SECRET': 'bench',
+        'STRAVA_REFRESH_TOKEN': 'bench',
+        'STRAVA_API_BASE': f"{base_url}/api/v3",
+        'STRAVA_OAUTH_URL': f"{base_url}/oauth/token",
+        # Keep fake tokens out of the real token store
+        'STRAVA_TOKEN_STORE': str(workspace / '.cache' / 'strava-tokens.json'),
+        'MAPBOX_API_BASE': base_url,
+        'MAPBOX_TOKEN': 'bench',
+        'MAP_REQUESTS_PER_SECOND': env.get('MAP_REQUESTS_PER_SECOND', '1000'),
+        'MAP_WORKERS': env.get('MAP_WORKERS', '16'),
+        'FORCE_FULL_SYNC': 'true' if stage == 'sync_full' else 'false',
+        'REGENERATE_MAPS': 'true' if stage == 'maps_local' else 'false',
+    })
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), '--worker', stage, '--workspace', str(workspace)],
+        env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{stage} failed for {size} activities:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def request_delta(before, after):
+    return {
+        endpoint: count - before['requests'].get(endpoint, 0)
+        for endpoint, count in after['requests'].items()
+        if count - before['requests'].get(endpoint, 0)
+    }
+
+
+def bench_size(size, latency, error_rate):
+    services = FakeServices(synthetic_history(size), latency=latency, error_rate=error_rate)
+    server, base_url = start_server(services)
+    workspace = make_workspace()
+    results = []
+    try:
+        for stage in STAGES:
+            if stage == 'maps_local' and not map_renderer.available():
+                print(f"Warning  Skipping {stage}: Pillow is not installed")
+                continue
+            before = services.stats()
+            measured = run_stage(stage, workspace, base_url, size)
+            requests_by_endpoint = request_delta(before, services.stats())
+            wall = measured['wall_seconds']
+            results.append({
+                'size': size,
+                'stage': stage,
+                'ok': measured['ok'],
+                'wall_seconds': wall,
+                'peak_rss_kb': measured['peak_rss_kb'],
+                'requests': sum(requests_by_endpoint.values()),
+                'requests_by_endpoint': requests_by_endpoint,
+                'activities_per_second': round(size / wall, 1) if wall else None,
+            })
+            print(f"Stats {size:>6} {stage:<17} {wall:>8.2f}s "
+                  f"{results[-1]['requests']:>6} req {measured['peak_rss_kb'] / 1024:>7.1f} MB")
+    finally:
+        server.shutdown()
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync and map generation')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma-separated history sizes')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake API latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--output', default='bench-results.json', help='where to write JSON results')
+    parser.add_argument('--worker', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--workspace', type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.workspace)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    for size in sizes:
+        results.extend(bench_size(size, args.latency, args.error_rate))
+
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'latency_seconds': args.latency,
+        'error_rate': args.error_rate,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Save Benchmark results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Build the read-optimized deployment database
+
+Vercel copies apps/web/public/running_page_2.db into /tmp on every cold
+start, so the deployed copy should be as small and as fast to query as
+possible. Starting from the synced apps/web/data/running_page_2.db this:
+
+- clears raw_data / detailed_polyline payloads (kept as columns so the web
+  app's inserts still work; the JSON Lines datasets hold the originals)
+- drops per-sample stream data unless DEPLOY_DB_KEEP_STREAMS=true
+- drops the heatmap count grids (the PNG pyramid in public/heatmap ships instead)
+- replaces single-column indexes with covering indexes for the
+  /api/activities and /api/stats filters (type, start_date, distance)
+- runs ANALYZE and VACUUMs into a fresh file with DEPLOY_DB_PAGE_SIZE pages
+
+and reports file size and query time before and after.
+
+Usage: cd scripts && python build_deploy_db.py [--source ...] [--target ...]
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+DEFAULT_SOURCE = Path('../apps/web/data/running_page_2.db')
+DEFAULT_TARGET = Path('../apps/web/public/running_page_2.db')
+
+# Payload columns only needed while syncing
+STRIPPED_COLUMNS = {
+    'activities': ('raw_data', 'detailed_polyline'),
+    # Never ship OAuth tokens, whatever wrote them into the synced database
+    'data_source_settings': ('access_token', 'refresh_token', 'token_expires_at'),
+}
+
+# Sync-time working state with no reader in the web app
+SYNC_ONLY_TABLES = ('heatmap_tiles', 'heatmap_activities', 'activity_spatial_keys')
+
+# Prefixes of the covering indexes below, so they would only add size
+REDUNDANT_INDEXES = ('idx_activities_start_date', 'idx_activities_type', 'idx_activities_external_id')
+
+# {user_id} is ', user_id' where activities has the column (databases built by
+# migrate-strava-json.js do not, and /api/stats then skips the user filter)
+COVERING_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_activities_date_cover
+  ON activities(start_date, type, distance, moving_time, start_latitude, start_longitude{user_id});
+CREATE INDEX IF NOT EXISTS idx_activities_type_date_cover
+  ON activities(type, start_date, distance, moving_time, start_latitude, start_longitude{user_id});
+CREATE INDEX IF NOT EXISTS idx_activities_distance
+  ON activities(distance);
+"""
+
+# Representative web queries timed against both databases
+BENCH_QUERIES = {
+    'activities_page': (
+        "SELECT * FROM activities WHERE type IN ('Run') ORDER BY start_date DESC LIMIT 20 OFFSET 0"
+    ),
+    'activities_aggregate': (
+        "SELECT COUNT(*), COALESCE(SUM(distance), 0), COALESCE(SUM(moving_time), 0), "
+        "COALESCE(SUM(CASE WHEN start_latitude IS NOT NULL AND start_longitude IS NOT NULL "
+        "THEN 1 ELSE 0 END), 0) FROM activities WHERE type IN ('Run') AND start_date >= '2024-01-01'"
+    ),
+    'activities_distance_range': (
+        "SELECT COUNT(*) FROM activities WHERE distance >= 20000 AND distance <= 50000"
+    ),
+    'type_summary': (
+        "SELECT type, COUNT(*), SUM(distance), SUM(moving_time) FROM activities GROUP BY type"
+    ),
+    'stats_monthly': (
+        "SELECT strftime('%Y-%m', start_date) AS month, COUNT(*), SUM(distance), SUM(moving_time) "
+        "FROM activities WHERE start_date >= '2024-01-01' AND start_date < '2025-01-01' "
+        "GROUP BY month ORDER BY month"
+    ),
+}
+
+
+def database_size(path):
+    """Size of a database including any WAL file next to it"""
+    path = Path(path)
+    wal = path.with_name(path.name + '-wal')
+    return path.stat().st_size + (wal.stat().st_size if wal.exists() else 0)
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def time_queries(path, repeat):
+    """Median milliseconds per benchmark query"""
+    conn = sqlite3.connect(path)
+    try:
+        timings = {}
+        for name, sql in BENCH_QUERIES.items():
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(sql).fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(samples)
+        return timings
+    finally:
+        conn.close()
+
+
+def optimize(conn, keep_streams):
+    """Strip payloads, swap in covering indexes and refresh planner stats"""
+    with conn:
+        for table, columns in STRIPPED_COLUMNS.items():
+            present = [c for c in columns if c in table_columns(conn, table)]
+            if present:
+                conn.execute(f"UPDATE {table} SET {', '.join(f'{c} = NULL' for c in present)}")
+                print(f"Remove  Cleared {', '.join(present)} from {table}")
+
+        if not keep_streams and table_exists(conn, 'activity_data_points'):
+            conn.execute('DELETE FROM activity_data_points')
+            print("Remove  Dropped activity_data_points rows")
+
+        for table in SYNC_ONLY_TABLES:
+            if table_exists(conn, table):
+                conn.execute(f'DELETE FROM {table}')
+                print(f"Remove  Dropped {table} rows")
+
+        for index in REDUNDANT_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index}')
+    user_id = ', user_id' if 'user_id' in table_columns(conn, 'activities') else ''
+    conn.executescript(COVERING_INDEXES_SQL.format(user_id=user_id))
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def build(source, target, page_size, keep_streams):
+    """Write the optimized copy of `source` to `target` atomically"""
+    source = Path(source)
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    staging = target.with_name(target.name + '.staging')
+    tmp = target.with_name(target.name + '.tmp')
+    for path in (staging, tmp):
+        path.unlink(missing_ok=True)
+
+    # Work on a snapshot so the synced database is never modified. A plain
+    # connection (not mode=ro) lets SQLite remove the -wal/-shm files on close.
+    conn = sqlite3.connect(source)
+    try:
+        conn.execute('VACUUM INTO ?', (str(staging),))
+    finally:
+        conn.close()
+
+    try:
+        conn = sqlite3.connect(staging)
+        try:
+            optimize(conn, keep_streams)
+            conn.execute(f'PRAGMA page_size = {int(page_size)}')
+            conn.execute('VACUUM INTO ?', (str(tmp),))
+        finally:
+            conn.close()
+        # The deploy copy is a single file in rollback-journal mode; a -wal or
+        # -shm left beside the target belongs to an older copy and must not be
+        # committed with, or replayed against, this one
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            conn.close()
+        for suffix in ('-wal', '-shm'):
+            target.with_name(target.name + suffix).unlink(missing_ok=True)
+        os.replace(tmp, target)
+    finally:
+        staging.unlink(missing_ok=True)
+        tmp.unlink(missing_ok=True)
+
+
+def report(source, target, repeat):
+    before_size = database_size(source)
+    after_size = database_size(target)
+    print(f"Stats Size: {before_size / 1024:.1f} KB -> {after_size / 1024:.1f} KB "
+          f"({(after_size - before_size) / before_size * 100:+.1f}%)")
+
+    before = time_queries(source, repeat)
+    after = time_queries(target, repeat)
+    for name in BENCH_QUERIES:
+        print(f"Stats {name:<26} {before[name]:>8.3f} ms -> {after[name]:>8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the read-optimized deployment database')
+    parser.add_argument('--source', type=Path, default=DEFAULT_SOURCE)
+    parser.add_argument('--target', type=Path, default=DEFAULT_TARGET)
+    parser.add_argument('--page-size', type=int, default=int(os.getenv('DEPLOY_DB_PAGE_SIZE', '4096')))
+    parser.add_argument('--repeat', type=int, default=20, help='runs per benchmark query')
+    args = parser.parse_args()
+
+    if not args.source.exists():
+        print(f"Warning  Source database not found: {args.source}")
+        return
+
+    keep_streams = os.getenv('DEPLOY_DB_KEEP_STREAMS', 'false').lower() == 'true'
+    build(args.source, args.target, args.page_size, keep_streams)
+    print(f"Save Deploy database written to {args.target}")
+    report(args.source, args.target, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
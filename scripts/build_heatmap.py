@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Build the all-activities heatmap tile pyramid
+
+Adds any routes not yet counted to the heatmap grids in
+apps/web/data/running_page_2.db (a sync normally has done this already),
+then writes the tiles that changed to apps/web/public/heatmap/{z}/{x}/{y}.png.
+Exporting needs Pillow; without it only the count grids are updated, or
+the run fails with --require-tiles (as in the sync workflow).
+
+Usage: cd scripts && python build_heatmap.py [--db ...] [--out ...] [--all] [--require-tiles]
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import heatmap
+
+DEFAULT_DB = Path('../apps/web/data/running_page_2.db')
+DEFAULT_OUT = Path('../apps/web/public/heatmap')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the all-activities heatmap tile pyramid')
+    parser.add_argument('--db', type=Path, default=DEFAULT_DB)
+    parser.add_argument('--out', type=Path, default=DEFAULT_OUT)
+    parser.add_argument('--all', action='store_true', help='re-export every tile, not just changed ones')
+    parser.add_argument('--require-tiles', action='store_true',
+                        help='fail instead of skipping the export when Pillow is missing')
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        print(f"Warning  Database not found: {args.db}")
+        return
+
+    conn = sqlite3.connect(args.db)
+    try:
+        conn.executescript(heatmap.HEATMAP_SCHEMA_SQL)
+        started = time.perf_counter()
+        added, rebuilt = heatmap.refresh_heatmap(conn)
+        action = 'Rebuilt heatmap from' if rebuilt else 'Added to heatmap:'
+        print(f"Route {action} {added} routes in {time.perf_counter() - started:.1f}s")
+
+        if heatmap.Image is None:
+            if args.require_tiles:
+                print("Error Pillow is not installed, cannot export heatmap tiles (pip install Pillow)")
+                raise SystemExit(1)
+            print("Warning  Pillow is not installed, skipping heatmap tile export (pip install Pillow)")
+            return
+
+        started = time.perf_counter()
+        written, removed = heatmap.export_tiles(conn, args.out, everything=args.all)
+        print(f"Save Heatmap tiles: {written} written, {removed} removed "
+              f"in {time.perf_counter() - started:.1f}s -> {args.out}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,50 +3,42 @@
 Check Strava API permissions and token validity
 """
 
-import os
 import requests
-import json
+
+from http_client import HttpError
+from strava_auth import broker_from_env
 
 def check_strava_permissions():
     """Check Strava API permissions and token validity"""
     
-    client_id = os.getenv('STRAVA_CLIENT_ID')
-    client_secret = os.getenv('STRAVA_CLIENT_SECRET')
-    refresh_token = os.getenv('STRAVA_REFRESH_TOKEN')
-    
-    if not all([client_id, client_secret, refresh_token]):
+    broker = broker_from_env()
+    if broker is None:
         print("Error Missing Strava credentials")
         return False
     
     print("Search Checking Strava API permissions...")
     
-    # Step 1: Refresh access token
-    print("\n1. Refreshing access token...")
-    token_url = 'https://www.strava.com/oauth/token'
-    token_data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'refresh_token': refresh_token,
-        'grant_type': 'refresh_token'
-    }
+    # Step 1: Get an access token (cached in the token store until near expiry)
+    print("\n1. Getting access token...")
     
     try:
-        token_response = requests.post(token_url, data=token_data)
-        token_response.raise_for_status()
-        token_info = token_response.json()
-        access_token = token_info['access_token']
+        access_token = broker.access_token()
+        token_info = broker.token_info()
         
-        print("OK Access token refreshed successfully")
-        print(f"   - Token type: {token_info.get('token_type', 'N/A')}")
-        print(f"   - Expires at: {token_info.get('expires_at', 'N/A')}")
+        if broker.refreshed:
+            print("OK Access token refreshed successfully")
+        else:
+            print("OK Reusing cached access token")
+        print(f"   - Token type: {token_info.get('token_type') or 'N/A'}")
+        print(f"   - Expires at: {token_info.get('expires_at') or 'N/A'}")
         
         # Check scope (but don't fail if missing)
         scope = token_info.get('scope', '')
         print(f"   - Scope: {scope if scope else 'NOT PRESENT (will test API directly)'}")
         
-    except requests.exceptions.RequestException as e:
+    except HttpError as e:
         print(f"Error Failed to refresh token: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if e.response is not None:
             print(f"   Response: {e.response.text}")
         return False
     
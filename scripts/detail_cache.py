@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache for Strava activity details
+
+Entries are keyed by activity id and a fingerprint of the summary fields
+that change when an activity is edited, so a detail is only re-downloaded
+when its summary says it changed. The cache is bounded by entry count and
+evicts least-recently-used details first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Summary fields that change whenever the detail payload would change.
+FINGERPRINT_FIELDS = (
+    'name', 'type', 'sport_type', 'start_date', 'distance', 'moving_time',
+    'elapsed_time', 'total_elevation_gain', 'average_heartrate',
+    'max_heartrate', 'kudos_count', 'comment_count', 'achievement_count',
+    'photo_count', 'gear_id', 'private', 'visibility', 'manual', 'updated_at',
+)
+
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def summary_fingerprint(activity):
+    """Stable hash of the change-relevant fields of an activity summary"""
+    fields = {key: activity.get(key) for key in FINGERPRINT_FIELDS}
+    fields['polyline'] = (activity.get('map') or {}).get('summary_polyline')
+    payload = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class DetailCache:
+    """Thread-safe LRU cache of detail payloads stored as one JSON file each"""
+
+    def __init__(self, cache_dir, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / 'index.json'
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.index = self._load_index()
+
+    def _load_index(self):
+        """Load {activity_id: fingerprint} in least- to most-recently-used order"""
+        if not self.index_file.exists():
+            return OrderedDict()
+
+        try:
+            with open(self.index_file, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning  Ignoring unreadable detail cache index: {e}")
+            return OrderedDict()
+
+        return OrderedDict((str(key), fingerprint) for key, fingerprint in entries)
+
+    def _entry_path(self, activity_id):
+        return self.cache_dir / f"{activity_id}.json"
+
+    def get(self, activity_id, fingerprint):
+        """Return the cached detail if its fingerprint still matches"""
+        key = str(activity_id)
+        with self.lock:
+            if self.index.get(key) != fingerprint:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+
+        try:
+            with open(self._entry_path(key), 'r') as f:
+                detail = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.index.pop(key, None)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return detail
+
+    def put(self, activity_id, fingerprint, detail):
+        """Store a detail payload and evict least-recently-used entries"""
+        key = str(activity_id)
+        path = self._entry_path(key)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(detail, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.index[key] = fingerprint
+            self.index.move_to_end(key)
+            evicted = []
+            while len(self.index) > self.max_entries:
+                evicted.append(self.index.popitem(last=False)[0])
+
+        for evicted_key in evicted:
+            self._entry_path(evicted_key).unlink(missing_ok=True)
+
+    def save(self):
+        """Persist the LRU index"""
+        with self.lock:
+            entries = list(self.index.items())
+
+        tmp_path = self.index_file.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.index_file)
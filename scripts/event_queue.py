@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Durable queue of Strava webhook events
+
+Events are committed to a small SQLite database before the receiver
+acknowledges them, so nothing is lost if the worker is down or crashes.
+The worker claims objects whose latest event has settled (no new event for
+`settle_seconds`) and coalesces every pending event for that object into
+one action: a burst of create/update events for an activity costs one
+detail fetch, and anything ending in a delete costs one confirming fetch.
+
+Strava does not sign its events, so the worker screens the sender of
+pending events (owner and subscription id) before claiming them, and
+rejects events that did not come from its own subscription and athlete.
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+QUEUE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  object_type TEXT NOT NULL,
+  object_id INTEGER NOT NULL,
+  aspect_type TEXT NOT NULL,
+  owner_id INTEGER,
+  subscription_id INTEGER,
+  updates TEXT,
+  event_time INTEGER,
+  received_at REAL NOT NULL,
+  available_at REAL NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  processed_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+  ON webhook_events(status, object_type, object_id);
+"""
+
+# Columns added after the first release, created on open when missing
+ADDED_COLUMNS = {
+    'subscription_id': 'INTEGER',
+}
+
+MAX_ATTEMPTS = 5
+
+# Failed events wait RETRY_BASE_SECONDS * 2 ** (attempts - 1) before a retry
+RETRY_BASE_SECONDS = 30
+
+# Processed events are kept this long for inspection
+RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def coalesce(aspect_types):
+    """Fold an object's aspect types, in arrival order, into 'upsert' or 'delete'
+
+    The last delete wins unless the object was created or updated again
+    afterwards.
+    """
+    action = None
+    for aspect_type in aspect_types:
+        action = 'delete' if aspect_type == 'delete' else 'upsert'
+    return action
+
+
+class EventQueue:
+    """SQLite-backed event queue; one connection per thread"""
+
+    def __init__(self, db_path, clock=time.time):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.clock = clock
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        # Acknowledged events must survive a power cut, not just a crash
+        self.conn.execute('PRAGMA synchronous = FULL')
+        self.conn.executescript(QUEUE_SCHEMA_SQL)
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(webhook_events)')}
+        with self.conn:
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f'ALTER TABLE webhook_events ADD COLUMN {column} {definition}')
+
+    def put(self, event):
+        """Persist one webhook payload; returns its queue id"""
+        now = self.clock()
+        with self.conn:
+            cursor = self.conn.execute(
+                '''
+                INSERT INTO webhook_events (
+                  object_type, object_id, aspect_type, owner_id, subscription_id, updates,
+                  event_time, received_at, available_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (
+                    event['object_type'], int(event['object_id']), event['aspect_type'],
+                    event.get('owner_id'), event.get('subscription_id'),
+                    json.dumps(event.get('updates') or {}),
+                    event.get('event_time'), now, now,
+                ),
+            )
+        return cursor.lastrowid
+
+    def recover(self):
+        """Return events left 'processing' by a crashed worker to the queue"""
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE webhook_events SET status = 'pending' WHERE status = 'processing'"
+            ).rowcount
+
+    def pending_senders(self):
+        """Distinct (owner_id, subscription_id) pairs of pending events"""
+        return set(self.conn.execute(
+            "SELECT DISTINCT owner_id, subscription_id FROM webhook_events WHERE status = 'pending'"
+        ))
+
+    def reject(self, senders, reason):
+        """Set aside pending events from these (owner_id, subscription_id) pairs; returns the count"""
+        with self.conn:
+            return sum(
+                self.conn.execute(
+                    '''
+                    UPDATE webhook_events SET status = 'rejected', last_error = ?, processed_at = ?
+                    WHERE status = 'pending' AND owner_id IS ? AND subscription_id IS ?
+                    ''',
+                    (reason, self.clock(), owner_id, subscription_id),
+                ).rowcount
+                for owner_id, subscription_id in senders
+            )
+
+    def claim(self, settle_seconds=0, limit=100):
+        """Claim settled objects; returns [(object_type, object_id, action, event_ids)]"""
+        now = self.clock()
+        with self.conn:
+            objects = self.conn.execute(
+                '''
+                SELECT object_type, object_id FROM webhook_events
+                WHERE status = 'pending'
+                GROUP BY object_type, object_id
+                HAVING MAX(received_at) <= ? AND MAX(available_at) <= ?
+                ORDER BY MIN(id)
+                LIMIT ?
+                ''',
+                (now - settle_seconds, now, limit),
+            ).fetchall()
+
+            claimed = []
+            for object_type, object_id in objects:
+                rows = self.conn.execute(
+                    '''
+                    SELECT id, aspect_type FROM webhook_events
+                    WHERE status = 'pending' AND object_type = ? AND object_id = ?
+                    ORDER BY id
+                    ''',
+                    (object_type, object_id),
+                ).fetchall()
+                event_ids = [row[0] for row in rows]
+                self.conn.executemany(
+                    "UPDATE webhook_events SET status = 'processing', attempts = attempts + 1 WHERE id = ?",
+                    [(event_id,) for event_id in event_ids],
+                )
+                action = coalesce(aspect_type for _, aspect_type in rows)
+                claimed.append((object_type, object_id, action, event_ids))
+        return claimed
+
+    def complete(self, event_ids):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE webhook_events SET status = 'done', last_error = NULL, processed_at = ? WHERE id = ?",
+                [(self.clock(), event_id) for event_id in event_ids],
+            )
+
+    def fail(self, event_ids, error):
+        """Put events back for a retry, or park them after MAX_ATTEMPTS"""
+        with self.conn:
+            self.conn.executemany(
+                '''
+                UPDATE webhook_events
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    available_at = ? + ? * (1 << (attempts - 1)),
+                    last_error = ?
+                WHERE id = ?
+                ''',
+                [(MAX_ATTEMPTS, self.clock(), RETRY_BASE_SECONDS, str(error), event_id)
+                 for event_id in event_ids],
+            )
+
+    def prune(self):
+        """Drop processed and rejected events older than RETENTION_SECONDS"""
+        with self.conn:
+            return self.conn.execute(
+                "DELETE FROM webhook_events WHERE status IN ('done', 'rejected') AND processed_at < ?",
+                (self.clock() - RETENTION_SECONDS,),
+            ).rowcount
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM webhook_events GROUP BY status'))
+
+    def close(self):
+        self.conn.close()
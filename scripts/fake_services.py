@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Strava and Mapbox APIs
+
+Serves a deterministic synthetic activity history over HTTP so the sync and
+map pipelines can be exercised and benchmarked without credentials:
+
+- POST /oauth/token
+- GET  /api/v3/athlete
+- GET  /api/v3/athlete/activities   (page, per_page, after, before)
+- GET  /api/v3/activities/{id}
+- GET  /api/v3/activities/{id}/streams
+- GET  /api/v3/push_subscriptions
+- GET  /styles/v1/mapbox/{style}/static/...
+- GET  /styles/v1/mapbox/{style}/tiles/512/{z}/{x}/{y}@2x   (ETag / 304)
+- GET  /__stats                     (request counts per endpoint)
+
+Responses carry X-RateLimit-Limit / X-RateLimit-Usage headers, can be
+delayed by a fixed latency and can randomly answer 429 to exercise retries.
+
+Run standalone with: python fake_services.py --activities 1000 --port 8765
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from polylines import decode, encode
+
+ACTIVITY_PATH = re.compile(r'^/api/v3/activities/(\d+)$')
+STREAMS_PATH = re.compile(r'^/api/v3/activities/(\d+)/streams$')
+TILE_PATH = re.compile(r'^/styles/v1/mapbox/[^/]+/tiles/512/(\d+)/(\d+)/(\d+)@2x$')
+
+# A few home locations so routes repeat, as real histories do
+HOME_LOCATIONS = [(31.2304, 121.4737), (31.1990, 121.4360), (22.5431, 114.0579)]
+
+# The default athlete and the one webhook subscription
+FAKE_ATHLETE_ID = 1
+FAKE_SUBSCRIPTION_ID = 1
+
+
+def tiny_png(width=1, height=1):
+    """Smallest valid PNG, used as the body of fake map responses"""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + b'\x00\x00\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+
+def synthetic_route(rng, start, points=60):
+    """Loop-shaped random walk around a start point"""
+    lat, lng = start
+    latlngs = []
+    heading = rng.uniform(0, 2 * math.pi)
+    for _ in range(points):
+        heading += rng.uniform(-0.4, 0.4)
+        lat += math.cos(heading) * 0.0008
+        lng += math.sin(heading) * 0.0008
+        latlngs.append((lat, lng))
+    return latlngs
+
+
+def synthetic_history(count, seed=42, end=None, id_base=10_000_000_000):
+    """Newest-first list of synthetic Strava activity summaries"""
+    rng = random.Random(seed)
+    end = end or datetime(2026, 10, 1, 6, 0, tzinfo=timezone.utc)
+    activities = []
+    for index in range(count):
+        start_date = end - timedelta(hours=19 * index)
+        home = HOME_LOCATIONS[rng.randrange(len(HOME_LOCATIONS))]
+        route = synthetic_route(rng, (home[0] + rng.uniform(-0.01, 0.01), home[1] + rng.uniform(-0.01, 0.01)))
+        moving_time = rng.randint(1200, 5400)
+        distance = round(moving_time * rng.uniform(2.4, 3.6), 1)
+        activity_id = id_base + count - index
+        activities.append({
+            'id': activity_id,
+            'name': f"Synthetic Run {activity_id}",
+            'type': 'Run',
+            'sport_type': 'Run',
+            'start_date': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': (start_date + timedelta(hours=8)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'timezone': '(GMT+08:00) Asia/Shanghai',
+            'distance': distance,
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randint(0, 600),
+            'total_elevation_gain': round(rng.uniform(0, 120), 1),
+            'average_speed': round(distance / moving_time, 3),
+            'max_speed': round(distance / moving_time * 1.4, 3),
+            'average_heartrate': round(rng.uniform(130, 170), 1),
+            'max_heartrate': round(rng.uniform(170, 190), 1),
+            'kudos_count': rng.randint(0, 20),
+            'start_latlng': list(route[0]),
+            'end_latlng': list(route[-1]),
+            'map': {'id': f"a{activity_id}", 'summary_polyline': encode(route)},
+        })
+    return activities
+
+
+class FakeServices:
+    """Synthetic API state shared by the request handler threads"""
+
+    def __init__(self, activities, latency=0.0, error_rate=0.0, rate_limits=(100000, 1000000), seed=7,
+                 athletes=None):
+        self.activities = activities
+        # Extra athletes: refresh token 'athlete-{id}' signs in as that athlete
+        self.athletes = athletes or {}
+        self.by_id = {a['id']: a for a in activities}
+        for history in self.athletes.values():
+            self.by_id.update((a['id'], a) for a in history)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limits = rate_limits
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes_sent = Counter()
+        self.usage = [0, 0]
+        self.png = tiny_png()
+
+    def detail(self, activity):
+        detail = dict(activity)
+        detail.update({
+            'description': None,
+            'calories': round(activity['moving_time'] / 6, 1),
+            'splits_metric': [
+                {'distance': 1000.0, 'elapsed_time': 330, 'moving_time': 325,
+                 'average_speed': 3.05, 'split': n + 1}
+                for n in range(int(activity['distance'] // 1000))
+            ],
+            'laps': [
+                {'name': 'Lap 1', 'lap_index': 1, 'distance': activity['distance'],
+                 'moving_time': activity['moving_time'], 'elapsed_time': activity['elapsed_time'],
+                 'average_speed': activity['average_speed'], 'max_speed': activity['max_speed'],
+                 'start_index': 0, 'end_index': 59},
+            ],
+            'best_efforts': [
+                {'name': name, 'distance': meters, 'elapsed_time': round(meters / activity['average_speed']),
+                 'moving_time': round(meters / activity['average_speed']), 'start_index': 0, 'end_index': 10}
+                for name, meters in (('1k', 1000.0), ('5k', 5000.0), ('10k', 10000.0))
+                if meters <= activity['distance']
+            ],
+            'segment_efforts': [],
+        })
+        return detail
+
+    def streams(self, activity):
+        """key_by_type streams sampled along the summary polyline"""
+        latlngs = list(decode(activity['map']['summary_polyline']).latlngs())
+        step = activity['moving_time'] / max(len(latlngs) - 1, 1)
+        spacing = activity['distance'] / max(len(latlngs) - 1, 1)
+        count = len(latlngs)
+
+        def stream(data):
+            return {'data': data, 'series_type': 'distance', 'original_size': count, 'resolution': 'high'}
+
+        return {
+            'latlng': stream([list(point) for point in latlngs]),
+            'time': stream([round(n * step) for n in range(count)]),
+            'distance': stream([round(n * spacing, 1) for n in range(count)]),
+            'altitude': stream([round(10 + 5 * math.sin(n / 7), 1) for n in range(count)]),
+            'heartrate': stream([int(activity['average_heartrate']) + n % 5 for n in range(count)]),
+            'cadence': stream([86 + n % 3 for n in range(count)]),
+            'velocity_smooth': stream([activity['average_speed']] * count),
+        }
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'bytes': dict(self.bytes_sent),
+                    'total_requests': sum(self.requests.values())}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; Nagle plus delayed ACK would add ~40ms each
+    disable_nagle_algorithm = True
+    services = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', endpoint=None, rate_limited=True,
+                  headers=None):
+        services = self.services
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        if rate_limited:
+            with services.lock:
+                usage = list(services.usage)
+            self.send_header('X-RateLimit-Limit', f"{services.rate_limits[0]},{services.rate_limits[1]}")
+            self.send_header('X-RateLimit-Usage', f"{usage[0]},{usage[1]}")
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(body)
+        if endpoint:
+            with services.lock:
+                services.bytes_sent[endpoint] += len(body)
+
+    def send_json(self, payload, endpoint):
+        self.send_body(200, json.dumps(payload).encode('utf-8'), endpoint=endpoint)
+
+    def begin(self, endpoint):
+        """Count, delay and maybe reject a request; returns False if rejected"""
+        services = self.services
+        with services.lock:
+            services.requests[endpoint] += 1
+            services.usage[0] += 1
+            services.usage[1] += 1
+            over_limit = (services.usage[0] > services.rate_limits[0]
+                          or services.usage[1] > services.rate_limits[1])
+            inject = services.error_rate and services.rng.random() < services.error_rate
+        if services.latency:
+            time.sleep(services.latency)
+        if over_limit or inject:
+            self.send_body(429, b'{"message":"Rate Limit Exceeded"}', endpoint=endpoint)
+            return False
+        return True
+
+    def athlete_id(self):
+        """Id of the athlete the bearer token belongs to"""
+        token = (self.headers.get('Authorization') or '').rpartition(' ')[2]
+        prefix = 'fake-access-token-'
+        if token.startswith(prefix) and token[len(prefix):].isdigit():
+            return int(token[len(prefix):])
+        return FAKE_ATHLETE_ID
+
+    def athlete_activities(self):
+        """Activity history of the athlete the bearer token belongs to"""
+        athlete_id = self.athlete_id()
+        if athlete_id in self.services.athletes:
+            return self.services.athletes[athlete_id]
+        return self.services.activities if athlete_id == FAKE_ATHLETE_ID else []
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8', 'replace'))
+        if urlparse(self.path).path != '/oauth/token':
+            self.send_body(404, b'{}', rate_limited=False)
+            return
+        refresh_token = form.get('refresh_token', [''])[0]
+        athlete = refresh_token[len('athlete-'):] if refresh_token.startswith('athlete-') else ''
+        if self.begin('oauth'):
+            self.send_json({
+                'token_type': 'Bearer',
+                'access_token': f'fake-access-token-{athlete}' if athlete else 'fake-access-token',
+                'refresh_token': refresh_token if athlete else 'fake-refresh-token',
+                'expires_at': int(time.time()) + 6 * 3600,
+                'expires_in': 6 * 3600,
+            }, 'oauth')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/__stats':
+            self.send_body(200, json.dumps(self.services.stats()).encode('utf-8'), rate_limited=False)
+            return
+
+        if url.path == '/api/v3/athlete':
+            if self.begin('athlete'):
+                self.send_json({'id': self.athlete_id(), 'resource_state': 2}, 'athlete')
+            return
+
+        if url.path == '/api/v3/push_subscriptions':
+            if self.begin('push_subscriptions'):
+                self.send_json([{'id': FAKE_SUBSCRIPTION_ID, 'callback_url': 'http://127.0.0.1:8788/webhook'}],
+                               'push_subscriptions')
+            return
+
+        if url.path == '/api/v3/athlete/activities':
+            if not self.begin('activities'):
+                return
+            page = int(query.get('page', ['1'])[0])
+            per_page = int(query.get('per_page', ['30'])[0])
+            activities = self.athlete_activities()
+            if 'after' in query:
+                after = int(query['after'][0])
+                activities = [a for a in activities
+                              if datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp() > after]
+            if 'before' in query:
+                before = int(query['before'][0])
+                activities = [a for a in activities
+                              if datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp() < before]
+            self.send_json(activities[(page - 1) * per_page:page * per_page], 'activities')
+            return
+
+        match = STREAMS_PATH.match(url.path)
+        if match:
+            if not self.begin('activity_streams'):
+                return
+            activity = self.services.by_id.get(int(match.group(1)))
+            if activity is None:
+                self.send_body(404, b'{"message":"Record Not Found"}', endpoint='activity_streams')
+            else:
+                self.send_json(self.services.streams(activity), 'activity_streams')
+            return
+
+        match = ACTIVITY_PATH.match(url.path)
+        if match:
+            if not self.begin('activity_detail'):
+                return
+            activity = self.services.by_id.get(int(match.group(1)))
+            if activity is None:
+                self.send_body(404, b'{"message":"Record Not Found"}', endpoint='activity_detail')
+            else:
+                self.send_json(self.services.detail(activity), 'activity_detail')
+            return
+
+        match = TILE_PATH.match(url.path)
+        if match:
+            if self.begin('mapbox_tile'):
+                etag = '"tile-{}-{}-{}"'.format(*match.groups())
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_body(304, b'', endpoint='mapbox_tile', rate_limited=False, headers={'ETag': etag})
+                else:
+                    self.send_body(200, self.services.png, content_type='image/png', endpoint='mapbox_tile',
+                                   rate_limited=False, headers={'ETag': etag})
+            return
+
+        if url.path.startswith('/styles/v1/mapbox/') and '/static/' in url.path:
+            if self.begin('mapbox_static'):
+                self.send_body(200, self.services.png, content_type='image/png',
+                               endpoint='mapbox_static', rate_limited=False)
+            return
+
+        self.send_body(404, b'{}', rate_limited=False)
+
+
+def start_server(services, host='127.0.0.1', port=0):
+    """Start a threaded server in the background; returns (server, base_url)"""
+    handler = type('BoundFakeHandler', (FakeHandler,), {'services': services})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the fake Strava/Mapbox services')
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    args = parser.parse_args()
+
+    services = FakeServices(synthetic_history(args.activities), latency=args.latency, error_rate=args.error_rate)
+    server, base_url = start_server(services, port=args.port)
+    print(f"Web Fake services on {base_url}")
+    print(f"   STRAVA_API_BASE={base_url}/api/v3 STRAVA_OAUTH_URL={base_url}/oauth/token MAPBOX_API_BASE={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@
 const fs = require('fs').promises
 const path = require('path')
 const https = require('https')
+const zlib = require('zlib')
 
 // Load environment variables from .env.local
 async function loadEnvFile() {
@@ -41,9 +42,22 @@ async function ensureDirectories() {
 }
 
 async function loadActivities() {
-  const activitiesFile = path.join(DATA_DIR, 'strava_activities.json')
-  const data = await fs.readFile(activitiesFile, 'utf8')
-  return JSON.parse(data)
+  // Prefer the JSON Lines dataset written by sync_strava.py; fall back to legacy JSON
+  for (const suffix of ['jsonl', 'jsonl.gz', 'json']) {
+    const activitiesFile = path.join(DATA_DIR, `strava_activities.${suffix}`)
+    let raw
+    try {
+      raw = await fs.readFile(activitiesFile)
+    } catch {
+      continue
+    }
+    if (suffix === 'json') {
+      return JSON.parse(raw.toString('utf8'))
+    }
+    const text = suffix.endsWith('.gz') ? zlib.gunzipSync(raw).toString('utf8') : raw.toString('utf8')
+    return text.split('\n').filter(line => line.trim()).map(line => JSON.parse(line))
+  }
+  throw new Error('No strava_activities dataset found')
 }
 
 function hasGpsData(activity) {
@@ -2,44 +2,249 @@
 """
 Generate static maps for activities with GPS data
 This script runs as part of GitHub Actions to pre-generate all activity maps
+
+Maps come from the Mapbox Static Images API by default; with
+--renderer local (or MAP_RENDERER=local) they are drawn offline by
+scripts/map_renderer.py on a process pool instead, optionally over Mapbox
+raster tiles kept in an LRU cache (--tiles / MAP_TILES=true).
+
+The run's timing and Mapbox request counts are merged into the sync trace
+and sync_logs row of the sync that ran before it (scripts/sync_metrics.py).
 """
 
 import os
+import argparse
+import hashlib
 import json
-import requests
-import time
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from datetime import date, datetime, timezone
+from itertools import islice
 from pathlib import Path
 from urllib.parse import quote
 
-class StaticMapGenerator:
+from http_client import HttpClient, HttpError
+from activity_geometry import (
+    URL_POLYLINE_BUDGET, build_geometry, load_geometry, quoted_length, zoom_for_bounds,
+)
+from activity_store import find_dataset, iter_records
+import map_renderer
+from tile_cache import TileCache, tile_range
+from polylines import RouteCache, decode, decode_many, polyline_hash
+from rate_limit import RequestsPerSecondLimiter
+from activity_db import ActivityDatabase
+from sync_metrics import SyncMetrics, merge_into_trace
+
+MAPBOX_API_BASE = os.getenv('MAPBOX_API_BASE', 'https://api.mapbox.com')
+
+RENDERERS = ('mapbox', 'local')
+
+# Activities decoded per route-cache round trip while streaming the dataset
+DECODE_BATCH_SIZE = 500
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from an iterator"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class MapGenerationReport:
+    """Thread-safe per-activity outcome and error accounting"""
+
     def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def record(self, activity_id, status, error=None):
+        with self.lock:
+            self.results[activity_id] = {'status': status, 'error': error}
+            done = len(self.results)
+        return done
+
+    def counts(self):
+        with self.lock:
+            return Counter(result['status'] for result in self.results.values())
+
+    def errors(self):
+        with self.lock:
+            return {
+                activity_id: result['error']
+                for activity_id, result in self.results.items()
+                if result['status'] == 'error'
+            }
+
+
+class MapManifest:
+    """Per-activity record of the inputs and output of each rendered map
+
+    Entries hold the polyline hash, render parameters and PNG checksum, so
+    a map is re-rendered only when one of its inputs changes or the file on
+    disk no longer matches its checksum.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path.exists():
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning  Ignoring unreadable map manifest: {e}")
+
+    def get(self, activity_id):
+        with self.lock:
+            return self.entries.get(str(activity_id))
+
+    def record(self, activity_id, polyline_hash, params, map_file):
+        entry = {
+            'polyline_hash': polyline_hash,
+            'params': params,
+            'checksum': file_checksum(map_file),
+            'rendered_at': datetime.now(timezone.utc).isoformat(),
+        }
+        with self.lock:
+            self.entries[str(activity_id)] = entry
+
+    def remove(self, activity_id):
+        with self.lock:
+            self.entries.pop(str(activity_id), None)
+
+    def is_current(self, activity_id, polyline_hash, params, map_file):
+        """True if the map on disk was rendered from these exact inputs and is intact"""
+        entry = self.get(activity_id)
+        if not (
+            entry is not None
+            and entry['polyline_hash'] == polyline_hash
+            and entry['params'] == params
+            and map_file.exists()
+        ):
+            return False
+        # A truncated, hand-edited or swapped PNG no longer matches its checksum
+        if entry.get('checksum') != file_checksum(map_file):
+            print(f"Warning  Map {map_file.name} does not match its manifest checksum, re-rendering")
+            return False
+        return True
+
+    def save(self):
+        with self.lock:
+            entries = dict(sorted(self.entries.items()))
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def file_checksum(path):
+    """SHA-256 of a rendered map file"""
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class RegenerateSelection:
+    """Which maps to force re-render regardless of the manifest"""
+
+    def __init__(self, enabled=False, ids=None, since=None, until=None, style=None):
+        self.enabled = enabled
+        self.ids = {str(i) for i in ids} if ids else None
+        self.since = since
+        self.until = until
+        self.style = style
+
+    def matches(self, activity, entry):
+        if not self.enabled:
+            return False
+        if self.ids is not None and str(activity['id']) not in self.ids:
+            return False
+        if self.since or self.until:
+            activity_date = date.fromisoformat(activity['start_date'][:10])
+            if self.since and activity_date < self.since:
+                return False
+            if self.until and activity_date > self.until:
+                return False
+        if self.style is not None:
+            return entry is not None and entry['params'].get('style') == self.style
+        return True
+
+
+class StaticMapGenerator:
+    def __init__(self, regenerate=None, renderer=None, tiles=None):
         self.mapbox_token = os.getenv('MAPBOX_TOKEN')
-        if not self.mapbox_token:
+        # 'mapbox' downloads from the Static Images API, 'local' draws offline
+        self.renderer = renderer or os.getenv('MAP_RENDERER', 'mapbox')
+        self.enabled = False
+        if self.renderer not in RENDERERS:
+            print(f"Error Unknown map renderer: {self.renderer}")
+            return
+        if self.renderer == 'mapbox' and not self.mapbox_token:
             print("Warning  No MAPBOX_TOKEN found, skipping map generation")
             return
+        if self.renderer == 'local' and not map_renderer.available():
+            print("Error Local renderer needs Pillow (pip install Pillow)")
+            return
+        self.enabled = True
+        self.use_tiles = self.renderer == 'local' and (
+            tiles if tiles is not None else os.getenv('MAP_TILES', 'false').lower() == 'true')
+        if self.use_tiles and not self.mapbox_token:
+            print("Warning  No MAPBOX_TOKEN found, rendering without base tiles")
+            self.use_tiles = False
             
         self.data_dir = Path('../apps/web/data')
         self.maps_dir = Path('../apps/web/public/maps')
         self.maps_dir.mkdir(exist_ok=True)
         
-        # Rate limiting
-        self.request_delay = 0.1  # 100ms between requests
-        self.generated_count = 0
-        self.skipped_count = 0
-        self.error_count = 0
+        # Concurrency and rate limiting
+        self.workers = int(os.getenv('MAP_WORKERS', '8'))
+        self.render_processes = int(os.getenv('MAP_RENDER_PROCESSES', str(os.cpu_count() or 1)))
+        self.requests_per_second = float(os.getenv('MAP_REQUESTS_PER_SECOND', '10'))
+        self.metrics = SyncMetrics()
+        self.http = HttpClient(
+            pool_size=self.workers,
+            rate_limiter=RequestsPerSecondLimiter(self.requests_per_second),
+            metrics=self.metrics,
+        )
+        self.report = MapGenerationReport()
+        self.tile_cache = None
+        if self.use_tiles:
+            self.tile_cache = TileCache(
+                Path('../.cache/tiles'),
+                self.http,
+                f"{MAPBOX_API_BASE}/styles/v1/mapbox/{{style}}/tiles/512/{{z}}/{{x}}/{{y}}@2x"
+                f"?access_token={self.mapbox_token}",
+                max_bytes=int(os.getenv('MAP_TILE_CACHE_MB', '200')) * 1024 * 1024,
+            )
+        self.route_cache_path = Path('../.cache/routes.db')
+        self.routes = {}
+        # Precomputed by the sync (activity_geometry table), keyed by external id
+        self.db_path = self.data_dir / 'running_page_2.db'
+        self.geometry = {}
+        
+        # Render parameters; changing any of them re-renders affected maps
+        self.style = os.getenv('MAP_STYLE', 'dark-v11')
+        self.width = 400
+        self.height = 300
+        self.manifest = MapManifest(self.data_dir / 'maps-manifest.json')
+        self.regenerate = regenerate or RegenerateSelection(
+            enabled=os.getenv('REGENERATE_MAPS', 'false').lower() == 'true')
         
-    def load_activities(self):
-        """Load activities from JSON file"""
-        activities_file = self.data_dir / 'strava_activities.json'
-        if not activities_file.exists():
+    def iter_activities(self):
+        """Lazily iterate activities from the synced dataset"""
+        activities_file = find_dataset(self.data_dir, 'strava_activities')
+        if not activities_file:
             print("Error No activities file found")
-            return []
-            
-        with open(activities_file, 'r') as f:
-            activities = json.load(f)
-            
-        print(f"Stats Loaded {len(activities)} activities")
-        return activities
+            return iter(())
+        
+        print(f"Stats Streaming activities from {activities_file.name}")
+        return iter_records(activities_file)
     
     def has_gps_data(self, activity):
         """Check if activity has GPS data"""
@@ -49,112 +254,97 @@ class StaticMapGenerator:
             activity.get('map', {}).get('summary_polyline')
         )
     
-    def calculate_bounds(self, polyline_points):
-        """Calculate bounds from polyline points"""
-        if not polyline_points:
-            return None
-            
-        lats = [point[0] for point in polyline_points]
-        lngs = [point[1] for point in polyline_points]
-        
-        min_lat, max_lat = min(lats), max(lats)
-        min_lng, max_lng = min(lngs), max(lngs)
-        
-        # Add padding
-        lat_padding = (max_lat - min_lat) * 0.1
-        lng_padding = (max_lng - min_lng) * 0.1
-        
-        return {
-            'min_lat': min_lat - lat_padding,
-            'max_lat': max_lat + lat_padding,
-            'min_lng': min_lng - lng_padding,
-            'max_lng': max_lng + lng_padding
-        }
-    
     def decode_polyline(self, encoded):
-        """Decode Google polyline to coordinates"""
+        """Return the decoded route for a polyline, or None if it is malformed"""
         if not encoded:
-            return []
-            
-        points = []
-        index = 0
-        lat = 0
-        lng = 0
-        
-        while index < len(encoded):
-            # Decode latitude
-            b = 0
-            shift = 0
-            result = 0
-            while True:
-                b = ord(encoded[index]) - 63
-                index += 1
-                result |= (b & 0x1f) << shift
-                shift += 5
-                if b < 0x20:
-                    break
-            dlat = ~(result >> 1) if result & 1 else result >> 1
-            lat += dlat
-            
-            # Decode longitude
-            b = 0
-            shift = 0
-            result = 0
-            while True:
-                b = ord(encoded[index]) - 63
-                index += 1
-                result |= (b & 0x1f) << shift
-                shift += 5
-                if b < 0x20:
-                    break
-            dlng = ~(result >> 1) if result & 1 else result >> 1
-            lng += dlng
-            
-            points.append([lat / 1e5, lng / 1e5])
-            
-        return points
+            return None
+        route = self.routes.get(polyline_hash(encoded))
+        if route is None:
+            try:
+                route = decode(encoded)
+            except IndexError:
+                return None
+        return route
     
     def calculate_zoom(self, bounds):
         """Calculate appropriate zoom level"""
-        lat_diff = bounds['max_lat'] - bounds['min_lat']
-        lng_diff = bounds['max_lng'] - bounds['min_lng']
-        max_diff = max(lat_diff, lng_diff)
-        
-        if max_diff < 0.01:
-            return 14
-        elif max_diff < 0.05:
-            return 12
-        elif max_diff < 0.1:
-            return 11
-        elif max_diff < 0.5:
-            return 9
-        elif max_diff < 1:
-            return 8
-        else:
-            return 7
+        return zoom_for_bounds(bounds)
     
-    def generate_map_url(self, activity, width=400, height=300):
-        """Generate Mapbox static map URL"""
-        polyline = activity.get('map', {}).get('summary_polyline', '')
-        if not polyline:
+    def activity_geometry(self, activity, budget=None):
+        """Stored geometry for an activity, computed here if missing or stale"""
+        polyline = activity['map']['summary_polyline']
+        geometry = self.geometry.get(str(activity['id']))
+        if budget is None and geometry and geometry['polyline_hash'] == polyline_hash(polyline):
+            return geometry
+        
+        route = self.decode_polyline(polyline)
+        if route is None:
             return None
-            
-        start_lat, start_lng = activity['start_latlng']
-        end_latlng = activity.get('end_latlng')
+        return build_geometry(polyline, route, budget=budget or URL_POLYLINE_BUDGET)
+    
+    def load_batch_geometry(self, batch, route_cache):
+        """Load stored geometry for a batch; decode only routes without it"""
+        geometry = {}
+        if self.db_path.exists():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                geometry = load_geometry(conn, [a['id'] for a in batch])
+            except sqlite3.OperationalError:
+                # Database predates the geometry table
+                geometry = {}
+            finally:
+                conn.close()
         
-        # Decode polyline for bounds calculation
-        points = self.decode_polyline(polyline)
-        bounds = self.calculate_bounds(points)
+        missing = [
+            a['map']['summary_polyline'] for a in batch
+            if (geometry.get(str(a['id'])) or {}).get('polyline_hash')
+            != polyline_hash(a['map']['summary_polyline'])
+        ]
+        self.routes = decode_many(missing, cache=route_cache) if missing else {}
+        self.geometry = geometry
+    
+    def render_params(self):
+        """Inputs besides the route that determine the rendered image"""
+        params = {'renderer': self.renderer, 'style': self.style, 'width': self.width, 'height': self.height}
+        if self.use_tiles:
+            params['tiles'] = True
+        return params
+    
+    def generate_map_url(self, activity, width=None, height=None):
+        """Generate Mapbox static map URL
         
-        if not bounds:
+        Long routes are drawn from their simplified polyline, tightened
+        further if the URL would still exceed 2000 characters.
+        """
+        if not activity.get('map', {}).get('summary_polyline', ''):
             return None
-            
-        center_lat = (bounds['min_lat'] + bounds['max_lat']) / 2
-        center_lng = (bounds['min_lng'] + bounds['max_lng']) / 2
-        zoom = self.calculate_zoom(bounds)
+        
+        geometry = self.activity_geometry(activity)
+        if not geometry:
+            return None
+        
+        url = self.build_map_url(activity, geometry, width, height)
+        if len(url) >= 2000:
+            overflow = len(url) - 1999
+            budget = quoted_length(geometry['simplified_polyline']) - overflow
+            geometry = self.activity_geometry(activity, budget=budget)
+            url = self.build_map_url(activity, geometry, width, height)
+        
+        return url if len(url) < 2000 else None
+    
+    def build_map_url(self, activity, geometry, width=None, height=None):
+        """Mapbox static map URL for a route geometry"""
+        width = width or self.width
+        height = height or self.height
+        polyline = geometry['simplified_polyline']
+        start_lat, start_lng = activity['start_latlng']
+        end_latlng = activity.get('end_latlng')
+        center_lat = geometry['center_lat']
+        center_lng = geometry['center_lng']
+        zoom = geometry['zoom']
         
         # Build URL components
-        base_url = "https://api.mapbox.com/styles/v1/mapbox/dark-v11/static/"
+        base_url = f"{MAPBOX_API_BASE}/styles/v1/mapbox/{self.style}/static/"
         
         # Polyline overlay
         polyline_overlay = f"path-4+ff0000-1.0({quote(polyline)})"
@@ -177,73 +367,217 @@ class StaticMapGenerator:
         overlays_str = ",".join(overlays)
         
         # Final URL
-        url = f"{base_url}{overlays_str}/{center_lng},{center_lat},{zoom},0/{width}x{height}@2x?access_token={self.mapbox_token}"
-        
-        return url if len(url) < 2000 else None
+        return f"{base_url}{overlays_str}/{center_lng},{center_lat},{zoom},0/{width}x{height}@2x?access_token={self.mapbox_token}"
     
     def download_map(self, url, file_path):
-        """Download map image from URL"""
+        """Download map image from URL, replacing the file atomically"""
+        response = self.http.get(url)
+        
+        tmp_path = file_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, file_path)
+    
+    def generate_activity_map(self, activity):
+        """Generate one activity map and record its outcome"""
+        activity_id = activity['id']
+        map_file = self.maps_dir / f"{activity_id}.png"
+        
+        map_url = self.generate_map_url(activity)
+        if not map_url:
+            error = 'could not generate map URL'
+            print(f"Warning  Could not generate URL for activity {activity_id}")
+        else:
+            try:
+                self.download_map(map_url, map_file)
+                error = None
+            except (HttpError, OSError) as e:
+                error = str(e)
+                print(f"Error Error downloading map for {activity_id}: {e}")
+        
+        self.record_outcome(activity, map_file, error)
+    
+    def record_outcome(self, activity, map_file, error):
+        """Update the manifest and report once a map was rendered or failed"""
+        activity_id = activity['id']
+        if not error:
+            polyline = activity['map']['summary_polyline']
+            self.manifest.record(activity_id, polyline_hash(polyline), self.render_params(), map_file)
+        
+        done = self.report.record(activity_id, 'error' if error else 'generated', error)
+        if not error:
+            print(f"OK Generated: {map_file.name} ({done} processed)")
+    
+    def local_render_job(self, activity):
+        """Picklable map_renderer.render_to_file job, or None if unmappable
+
+        The job's base tiles are left empty; with tiles enabled
+        fetch_tiles_and_render fills them in on a fetch thread.
+        """
+        geometry = self.activity_geometry(activity)
+        route = self.decode_polyline(activity['map']['summary_polyline'])
+        if not geometry or route is None:
+            return None
+        
+        start = tuple(activity['start_latlng'])
+        end = activity.get('end_latlng')
+        if not end or len(end) != 2 or (abs(end[0] - start[0]) <= 0.001 and abs(end[1] - start[1]) <= 0.001):
+            end = None
+        map_file = self.maps_dir / f"{activity['id']}.png"
+        return (activity['id'], route.points, geometry['center_lat'], geometry['center_lng'],
+                geometry['zoom'], self.width, self.height, self.style, start,
+                tuple(end) if end else None, str(map_file), [])
+    
+    def frame_tiles(self, center_lat, center_lng, zoom):
+        """Cached (x, y, path) base tiles under a map frame; raises HttpError"""
+        if not self.tile_cache:
+            return []
+        center_x, center_y = map_renderer.world_pixel(center_lat, center_lng, zoom)
+        return [
+            (x, y, str(self.tile_cache.get(self.style, zoom, x, y)))
+            for x, y in tile_range(center_x, center_y, zoom, self.width, self.height, map_renderer.TILE_SIZE)
+        ]
+    
+    def finish_local_render(self, activity, in_flight, future):
+        """Done-callback for a local render submitted to the process pool"""
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-                
-            return True
+            _, error = future.result()
         except Exception as e:
-            print(f"Error Error downloading map: {e}")
-            return False
+            error = str(e)
+        finally:
+            in_flight.release()
+        if error:
+            print(f"Error Error rendering map for {activity['id']}: {error}")
+        self.record_outcome(activity, self.maps_dir / f"{activity['id']}.png", error)
+    
+    def fail_local_render(self, activity, in_flight, error):
+        in_flight.release()
+        print(f"Error Error rendering map for {activity['id']}: {error}")
+        self.report.record(activity['id'], 'error', error)
+    
+    def fetch_tiles_and_render(self, executor, activity, job, in_flight):
+        """Fetch a job's base tiles on a fetch thread, then hand it to the process pool"""
+        try:
+            tiles = self.frame_tiles(*job[2:5])
+        except Exception as e:
+            self.fail_local_render(activity, in_flight, f"could not fetch base tiles: {e}")
+            return
+        future = executor.submit(map_renderer.render_to_file, job[:-1] + (tiles,))
+        future.add_done_callback(partial(self.finish_local_render, activity, in_flight))
+    
+    def submit_render(self, executor, activity, run, in_flight, tile_executor=None):
+        """Queue one map on the thread pool (mapbox) or process pool (local)
+
+        With base tiles, the tiles are fetched on tile_executor's threads
+        first, so a cold tile cache downloads for several maps at once.
+        """
+        if self.renderer != 'local':
+            executor.submit(run, activity)
+            return
+        
+        job = self.local_render_job(activity)
+        if not job:
+            self.fail_local_render(activity, in_flight, 'could not compute route geometry')
+            return
+        if tile_executor:
+            tile_executor.submit(self.fetch_tiles_and_render, executor, activity, job, in_flight)
+            return
+        future = executor.submit(map_renderer.render_to_file, job)
+        future.add_done_callback(partial(self.finish_local_render, activity, in_flight))
     
     def generate_maps(self):
         """Generate static maps for all GPS activities"""
-        if not self.mapbox_token:
+        if not self.enabled:
             return
             
-        activities = self.load_activities()
-        gps_activities = [a for a in activities if self.has_gps_data(a)]
+        gps_activities = (a for a in self.iter_activities() if self.has_gps_data(a))
+        self.report = MapGenerationReport()
         
-        print(f"Map  Found {len(gps_activities)} activities with GPS data")
+        # Bound in-flight work so the queue never holds every activity at once
+        local = self.renderer == 'local'
+        concurrency = self.render_processes if local else self.workers
+        # Tile fetches count as in flight too, so leave room for every fetch thread
+        in_flight = threading.BoundedSemaphore(
+            max(concurrency, self.workers) * 2 if self.tile_cache else concurrency * 2)
         
-        for i, activity in enumerate(gps_activities):
-            activity_id = activity['id']
-            
-            # Check if map already exists
-            map_file = self.maps_dir / f"{activity_id}.png"
-            if map_file.exists():
-                print(f"⏭️  Map for activity {activity_id} already exists")
-                self.skipped_count += 1
-                continue
-            
-            # Generate map URL
-            map_url = self.generate_map_url(activity)
-            if not map_url:
-                print(f"Warning  Could not generate URL for activity {activity_id}")
-                self.error_count += 1
-                continue
-            
-            # Download map
-            print(f"Download Generating map for activity {activity_id} ({i+1}/{len(gps_activities)})")
-            if self.download_map(map_url, map_file):
-                self.generated_count += 1
-                print(f"OK Generated: {map_file.name}")
-            else:
-                self.error_count += 1
-            
-            # Rate limiting
-            time.sleep(self.request_delay)
+        def run(activity):
+            try:
+                self.generate_activity_map(activity)
+            except Exception as e:
+                self.report.record(activity['id'], 'error', str(e))
+            finally:
+                in_flight.release()
+        
+        params = self.render_params()
+        route_cache = RouteCache(self.route_cache_path)
+        try:
+            pool = ProcessPoolExecutor if local else ThreadPoolExecutor
+            # Exits first, so every fetched map is submitted before the render pool shuts down
+            fetch_pool = ThreadPoolExecutor(max_workers=self.workers) if self.tile_cache else nullcontext()
+            with pool(max_workers=concurrency) as executor, fetch_pool as tile_executor:
+                for batch in batched(gps_activities, DECODE_BATCH_SIZE):
+                    # Geometry for the batch in one lookup; in-flight tasks
+                    # from the previous batch fall back to computing their own
+                    self.load_batch_geometry(batch, route_cache)
+                    
+                    for activity in batch:
+                        activity_id = activity['id']
+                        map_file = self.maps_dir / f"{activity_id}.png"
+                        route_hash = polyline_hash(activity['map']['summary_polyline'])
+                        entry = self.manifest.get(activity_id)
+                        
+                        if not self.regenerate.matches(activity, entry):
+                            if self.manifest.is_current(activity_id, route_hash, params, map_file):
+                                self.report.record(activity_id, 'skipped')
+                                continue
+                            if entry is None and map_file.exists():
+                                # Map rendered before the manifest existed; adopt it as-is
+                                self.manifest.record(activity_id, route_hash, params, map_file)
+                                self.report.record(activity_id, 'skipped')
+                                continue
+                        
+                        in_flight.acquire()
+                        self.submit_render(executor, activity, run, in_flight, tile_executor)
+        finally:
+            route_cache.close()
+            if self.tile_cache:
+                self.tile_cache.save()
+        
+        self.manifest.save()
         
         # Summary
+        counts = self.report.counts()
         print(f"\nStats Map Generation Summary:")
-        print(f"OK Generated: {self.generated_count}")
-        print(f"⏭️  Skipped: {self.skipped_count}")
-        print(f"Error Errors: {self.error_count}")
+        print(f"Map  GPS activities: {sum(counts.values())}")
+        print(f"OK Generated: {counts['generated']}")
+        print(f"⏭️  Skipped: {counts['skipped']}")
+        print(f"Error Errors: {counts['error']}")
+        if self.tile_cache:
+            stats = self.tile_cache.stats
+            print(f"Map  Tiles: {stats['hits']} cached, {stats['fetched']} fetched, "
+                  f"{stats['revalidated']} revalidated, {stats['evicted']} evicted")
+        for activity_id, error in sorted(self.report.errors().items()):
+            print(f"   - {activity_id}: {error}")
         print(f"Directory Total files: {len(list(self.maps_dir.glob('*.png')))}")
+
+    def record_metrics(self):
+        """Merge this run's stage timing and requests into the last sync's logs"""
+        trace = merge_into_trace(self.metrics)
+        if trace is None:
+            return
+        log_id = trace.get('sync_log_id')
+        if log_id is not None and self.db_path.exists():
+            db = ActivityDatabase(self.db_path)
+            try:
+                db.merge_sync_metrics(log_id, self.metrics.summary())
+            finally:
+                db.close()
+        print(f"Stats Map generation: {self.metrics.summary()['stages'].get('map_generation', 0):.1f}s, "
+              f"{self.metrics.api_calls} Mapbox requests")
     
     def cleanup_orphaned_maps(self):
         """Remove maps for activities that no longer exist"""
-        activities = self.load_activities()
-        activity_ids = {str(a['id']) for a in activities}
+        activity_ids = {str(a['id']) for a in self.iter_activities()}
         
         removed_count = 0
         for map_file in self.maps_dir.glob('*.png'):
@@ -251,17 +585,47 @@ class StaticMapGenerator:
             if activity_id not in activity_ids:
                 print(f"Remove  Removing orphaned map: {map_file.name}")
                 map_file.unlink()
+                self.manifest.remove(activity_id)
                 removed_count += 1
         
         if removed_count > 0:
+            self.manifest.save()
             print(f"Cleanup Cleaned up {removed_count} orphaned maps")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate static activity maps')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='force re-rendering of the selected maps (all if no filter is given)')
+    parser.add_argument('--ids', help='comma-separated activity ids to regenerate')
+    parser.add_argument('--since', type=date.fromisoformat, help='regenerate activities on or after YYYY-MM-DD')
+    parser.add_argument('--until', type=date.fromisoformat, help='regenerate activities on or before YYYY-MM-DD')
+    parser.add_argument('--rendered-style', help='regenerate maps last rendered with this Mapbox style')
+    parser.add_argument('--renderer', choices=RENDERERS,
+                        help='mapbox (download, default) or local (offline Pillow rendering)')
+    parser.add_argument('--tiles', action='store_true', default=None,
+                        help='with --renderer local, draw routes over cached Mapbox raster tiles')
+    return parser.parse_args()
+
 def main():
-    generator = StaticMapGenerator()
+    args = parse_args()
+    regenerate = None
+    if args.regenerate:
+        regenerate = RegenerateSelection(
+            enabled=True,
+            ids=args.ids.split(',') if args.ids else None,
+            since=args.since,
+            until=args.until,
+            style=args.rendered_style,
+        )
+    generator = StaticMapGenerator(regenerate=regenerate, renderer=args.renderer, tiles=args.tiles)
+    if not generator.enabled:
+        return
     
     print("Deploy Starting static map generation...")
-    generator.generate_maps()
-    generator.cleanup_orphaned_maps()
+    with generator.metrics.stage('map_generation'):
+        generator.generate_maps()
+        generator.cleanup_orphaned_maps()
+    generator.record_metrics()
     print("OK Static map generation completed!")
 
 if __name__ == "__main__":
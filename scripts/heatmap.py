@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+All-activities heatmap as a count grid per zoom level
+
+Every summary polyline is rasterized into 256px Web Mercator tiles at
+HEATMAP_MAX_ZOOM and downsampled to each lower zoom, counting each
+activity at most once per pixel so a cell holds how many activities passed
+through it. Counts live in heatmap_tiles as zlib-compressed little-endian
+uint32 grids; heatmap_activities records which routes (by polyline hash)
+are already counted, so a sync only adds the contributions of new
+activities. A removed or re-drawn route cannot be subtracted without its
+old polyline, so that case rebuilds the grid from scratch.
+
+Changed tiles are flagged dirty until export_tiles writes them out as a
+PNG pyramid (needs Pillow).
+"""
+
+import math
+import os
+import sys
+import zlib
+from array import array
+from pathlib import Path
+
+from map_renderer import world_pixel
+from polylines import decode, polyline_hash
+
+try:
+    from PIL import Image
+except ImportError:  # optional dependency, only needed to export PNG tiles
+    Image = None
+
+HEATMAP_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS heatmap_tiles (
+  zoom INTEGER NOT NULL,
+  x INTEGER NOT NULL,
+  y INTEGER NOT NULL,
+  counts BLOB NOT NULL,
+  max_count INTEGER NOT NULL,
+  dirty INTEGER NOT NULL DEFAULT 1,
+  PRIMARY KEY (zoom, x, y)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS heatmap_activities (
+  activity_id INTEGER PRIMARY KEY,
+  polyline_hash TEXT NOT NULL
+);
+"""
+
+TILE_SIZE = 256
+HEATMAP_MIN_ZOOM = 4
+HEATMAP_MAX_ZOOM = 14
+
+# Count at which a pixel reaches full intensity in exported tiles
+SATURATION = 50
+
+# Transparent -> orange -> white ramp, indexed by intensity 0-255
+RAMP_STOPS = (
+    (0, (255, 80, 0, 0)),
+    (96, (255, 80, 0, 200)),
+    (192, (255, 190, 60, 240)),
+    (255, (255, 255, 220, 255)),
+)
+
+PIXEL_BITS = 32
+PIXEL_MASK = (1 << PIXEL_BITS) - 1
+
+
+def route_pixels(points, zoom=HEATMAP_MAX_ZOOM):
+    """Set of world pixels (x << PIXEL_BITS | y) a route passes through
+
+    Segments are stepped at one-pixel intervals. Segments jumping more than
+    half the world (antimeridian crossings) are skipped rather than drawn
+    across the whole map.
+    """
+    half_world = TILE_SIZE * (2 ** zoom) / 2
+    pixels = set()
+    previous = None
+    for i in range(0, len(points), 2):
+        x, y = world_pixel(points[i], points[i + 1], zoom, TILE_SIZE)
+        if previous is None:
+            pixels.add(int(x) << PIXEL_BITS | int(y))
+        else:
+            x0, y0 = previous
+            dx, dy = x - x0, y - y0
+            if abs(dx) < half_world:
+                steps = int(max(abs(dx), abs(dy))) + 1
+                for step in range(1, steps + 1):
+                    t = step / steps
+                    pixels.add(int(x0 + dx * t) << PIXEL_BITS | int(y0 + dy * t))
+        previous = (x, y)
+    return pixels
+
+
+class HeatmapAccumulator:
+    """Per-tile cell offsets added by a batch of routes, before merging"""
+
+    def __init__(self, min_zoom=HEATMAP_MIN_ZOOM, max_zoom=HEATMAP_MAX_ZOOM):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tiles = {}
+        self.routes = 0
+
+    def add_route(self, points):
+        pixels = route_pixels(points, self.max_zoom)
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            if zoom < self.max_zoom:
+                # Downsample; the set keeps one count per activity per cell
+                pixels = {(p >> PIXEL_BITS) >> 1 << PIXEL_BITS | (p & PIXEL_MASK) >> 1 for p in pixels}
+            for pixel in pixels:
+                x, y = pixel >> PIXEL_BITS, pixel & PIXEL_MASK
+                key = (zoom, x // TILE_SIZE, y // TILE_SIZE)
+                offsets = self.tiles.get(key)
+                if offsets is None:
+                    offsets = self.tiles[key] = array('I')
+                offsets.append((y % TILE_SIZE) * TILE_SIZE + x % TILE_SIZE)
+        self.routes += 1
+
+    def merge_into(self, conn):
+        """Add the accumulated counts to heatmap_tiles (caller commits)"""
+        for (zoom, x, y), offsets in self.tiles.items():
+            row = conn.execute('SELECT counts FROM heatmap_tiles WHERE zoom = ? AND x = ? AND y = ?',
+                               (zoom, x, y)).fetchone()
+            counts = unpack_counts(row[0]) if row else array('I', bytes(4 * TILE_SIZE * TILE_SIZE))
+            for offset in offsets:
+                counts[offset] += 1
+            conn.execute(
+                'INSERT OR REPLACE INTO heatmap_tiles (zoom, x, y, counts, max_count, dirty) '
+                'VALUES (?, ?, ?, ?, ?, 1)',
+                (zoom, x, y, pack_counts(counts), max(counts)),
+            )
+        merged = len(self.tiles)
+        self.tiles = {}
+        return merged
+
+
+def pack_counts(counts):
+    if sys.byteorder == 'big':
+        counts = array('I', counts)
+        counts.byteswap()
+    return zlib.compress(counts.tobytes())
+
+
+def unpack_counts(blob):
+    counts = array('I', zlib.decompress(blob))
+    if sys.byteorder == 'big':
+        counts.byteswap()
+    return counts
+
+
+def refresh_heatmap(conn, batch_size=500):
+    """Add routes not yet counted; rebuild if a counted route changed or went away
+
+    Returns (routes added, rebuilt).
+    """
+    rows = conn.execute('''
+        SELECT a.id, a.summary_polyline, h.polyline_hash
+        FROM activities a LEFT JOIN heatmap_activities h ON h.activity_id = a.id
+        WHERE a.summary_polyline IS NOT NULL AND a.summary_polyline != ''
+    ''').fetchall()
+    hashes = {row_id: polyline_hash(encoded) for row_id, encoded, _ in rows}
+    changed = any(stored is not None and stored != hashes[row_id] for row_id, _, stored in rows)
+    counted = conn.execute('SELECT COUNT(*) FROM heatmap_activities').fetchone()[0]
+    removed = counted != sum(1 for _, _, stored in rows if stored is not None)
+
+    rebuilt = changed or removed
+    if rebuilt:
+        with conn:
+            conn.execute('DELETE FROM heatmap_tiles')
+            conn.execute('DELETE FROM heatmap_activities')
+        pending = [(row_id, encoded) for row_id, encoded, _ in rows]
+    else:
+        pending = [(row_id, encoded) for row_id, encoded, stored in rows if stored is None]
+
+    accumulator = HeatmapAccumulator()
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        for _, encoded in batch:
+            try:
+                route = decode(encoded)
+            except IndexError:
+                continue  # still recorded below so it is not retried every sync
+            accumulator.add_route(route.points)
+        # Counts and the record of what they include commit together
+        with conn:
+            accumulator.merge_into(conn)
+            conn.executemany(
+                'INSERT OR REPLACE INTO heatmap_activities (activity_id, polyline_hash) VALUES (?, ?)',
+                [(row_id, hashes[row_id]) for row_id, _ in batch],
+            )
+    return accumulator.routes, rebuilt
+
+
+def intensity_ramp():
+    """RGBA lookup tables (one 256-entry list per band) for the colour ramp"""
+    bands = ([], [], [], [])
+    for level in range(256):
+        for (start, low), (end, high) in zip(RAMP_STOPS, RAMP_STOPS[1:]):
+            if level <= end:
+                t = (level - start) / (end - start)
+                for band, a, b in zip(bands, low, high):
+                    band.append(round(a + (b - a) * t))
+                break
+    return bands
+
+
+def tile_image(counts, ramp):
+    """RGBA PIL image for a count grid, log-scaled up to SATURATION"""
+    scale = 255 / math.log1p(SATURATION)
+    levels = [min(255, round(math.log1p(c) * scale)) for c in range(SATURATION + 1)]
+    intensity = bytes(levels[c] if c <= SATURATION else 255 for c in counts)
+    level_image = Image.frombytes('L', (TILE_SIZE, TILE_SIZE), intensity)
+    return Image.merge('RGBA', [level_image.point(band) for band in ramp])
+
+
+def export_tiles(conn, out_dir, everything=False):
+    """Write dirty tiles to out_dir/{z}/{x}/{y}.png and clear their flag
+
+    Tile files with no counts left (after a rebuild) are removed.
+    Returns (written, removed).
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is not installed (pip install Pillow)')
+
+    out_dir = Path(out_dir)
+    ramp = intensity_ramp()
+    where = '' if everything else 'WHERE dirty = 1'
+    written = 0
+    for zoom, x, y, blob in conn.execute(f'SELECT zoom, x, y, counts FROM heatmap_tiles {where}').fetchall():
+        path = out_dir / str(zoom) / str(x) / f"{y}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tile_image(unpack_counts(blob), ramp).save(tmp_path, format='PNG')
+        os.replace(tmp_path, path)
+        written += 1
+    with conn:
+        conn.execute('UPDATE heatmap_tiles SET dirty = 0 WHERE dirty = 1')
+
+    existing = {(str(z), str(x), f"{y}.png") for z, x, y in conn.execute('SELECT zoom, x, y FROM heatmap_tiles')}
+    removed = 0
+    for path in out_dir.glob('*/*/*.png'):
+        if path.relative_to(out_dir).parts not in existing:
+            path.unlink()
+            removed += 1
+    return written, removed
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for the Strava and Mapbox scripts
+
+Wraps one pooled keep-alive requests.Session and retries transient failures
+(connection errors, timeouts, 429 and 5xx) with exponential backoff and
+jitter, honouring Retry-After. Failures surface as typed exceptions so
+callers can tell "retries exhausted" from "the server said no" instead of
+treating every error as an empty result. An optional SyncMetrics
+(scripts/sync_metrics.py) sees every attempt, retries included.
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpError(Exception):
+    """Base class for failed HTTP calls"""
+
+    def __init__(self, message, url=None, status_code=None, response=None):
+        super().__init__(message)
+        self.url = url
+        self.status_code = status_code
+        self.response = response
+
+
+class TransientHttpError(HttpError):
+    """A retryable failure that persisted through every retry"""
+
+
+class PermanentHttpError(HttpError):
+    """A non-retryable 4xx response (bad token, missing resource, ...)"""
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def redact_url(url):
+    """Drop the query string so tokens never end up in logs"""
+    return url.split('?', 1)[0]
+
+
+class HttpClient:
+    """Pooled session with retry, backoff and optional rate limiting"""
+
+    def __init__(self, pool_size=10, max_retries=4, backoff_base=0.5, backoff_max=60.0,
+                 timeout=30, rate_limiter=None, rate_limit_max_wait=None, sleep=time.sleep,
+                 metrics=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.rate_limit_max_wait = rate_limit_max_wait
+        self.sleep = sleep
+        self.metrics = metrics
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with equal jitter for the given retry attempt"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures; returns the response"""
+        kwargs.setdefault('timeout', self.timeout)
+        label = f"{method} {redact_url(url)}"
+        error = None
+        delay = 0.0
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.sleep(delay)
+
+            if self.rate_limiter:
+                self.rate_limiter.acquire(max_wait=self.rate_limit_max_wait)
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if self.metrics:
+                    self.metrics.record_request(method, url, time.perf_counter() - started)
+                error = TransientHttpError(f"{label} failed: {type(e).__name__}", url=url)
+                delay = self.backoff_delay(attempt)
+                continue
+
+            if self.metrics:
+                self.metrics.record_request(method, url, time.perf_counter() - started, response)
+
+            if self.rate_limiter:
+                self.rate_limiter.update_from_headers(response.headers)
+
+            status = response.status_code
+            if status in RETRY_STATUSES:
+                error = TransientHttpError(f"{label} returned {status}", url=url,
+                                           status_code=status, response=response)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = min(self.backoff_max,
+                            retry_after if retry_after is not None else self.backoff_delay(attempt))
+                continue
+
+            if status >= 400:
+                raise PermanentHttpError(f"{label} returned {status}", url=url,
+                                         status_code=status, response=response)
+
+            return response
+
+        raise error
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Local static-map renderer
+
+Draws a route, start/end markers and a styled background straight to PNG
+with Pillow, framed like a Mapbox static map (Web Mercator, 512px world
+tiles, @2x output), so maps can be rendered offline and in parallel across
+cores instead of one network round-trip each.
+
+Backgrounds are either the flat style colour or raster tiles from
+scripts/tile_cache.py composited under the route.
+
+Pillow is optional; MapRenderError is raised when it is missing.
+Render jobs are plain tuples of picklable values so they can be sent to a
+process pool.
+"""
+
+import math
+import os
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # optional dependency, only needed for local rendering
+    Image = ImageDraw = None
+
+# Mapbox GL styles render 512px tiles; static images are requested @2x
+TILE_SIZE = 512
+PIXEL_RATIO = 2
+
+# Background, route, start pin and end pin colours per Mapbox style name
+STYLE_COLORS = {
+    'dark-v11': ((33, 33, 38), (255, 0, 0), (255, 0, 0), (0, 255, 0)),
+    'light-v11': ((242, 242, 240), (255, 0, 0), (255, 0, 0), (0, 170, 0)),
+    'streets-v12': ((236, 233, 224), (255, 0, 0), (255, 0, 0), (0, 170, 0)),
+    'outdoors-v12': ((232, 236, 222), (255, 0, 0), (255, 0, 0), (0, 170, 0)),
+}
+DEFAULT_STYLE = 'dark-v11'
+
+ROUTE_WIDTH = 4
+PIN_RADIUS = 5
+
+
+class MapRenderError(Exception):
+    """A map could not be rendered locally"""
+
+
+def available():
+    """True if Pillow is installed"""
+    return Image is not None
+
+
+def world_pixel(lat, lng, zoom, tile_size=TILE_SIZE):
+    """Web Mercator world pixel coordinates at a zoom level"""
+    world = tile_size * (2 ** zoom)
+    sin_lat = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    x = (lng + 180.0) / 360.0 * world
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world
+    return x, y
+
+
+def frame_projector(center_lat, center_lng, zoom, width, height, scale=PIXEL_RATIO):
+    """Function mapping (lat, lng) to image pixels for a centered frame"""
+    center_x, center_y = world_pixel(center_lat, center_lng, zoom)
+
+    def project(lat, lng):
+        x, y = world_pixel(lat, lng, zoom)
+        return ((x - center_x) * scale + width * scale / 2,
+                (y - center_y) * scale + height * scale / 2)
+
+    return project
+
+
+def compose_tiles(tiles, center_lat, center_lng, zoom, width, height, style=DEFAULT_STYLE):
+    """Background image pasted together from (x, y, path) @2x tiles
+
+    x is the unwrapped tile column, so frames crossing the antimeridian
+    still line up. Missing or unreadable tiles leave the style colour.
+    """
+    if not available():
+        raise MapRenderError('Pillow is not installed (pip install Pillow)')
+
+    fill = STYLE_COLORS.get(style, STYLE_COLORS[DEFAULT_STYLE])[0]
+    background = Image.new('RGB', (width * PIXEL_RATIO, height * PIXEL_RATIO), fill)
+    center_x, center_y = world_pixel(center_lat, center_lng, zoom)
+    left = center_x - width / 2
+    top = center_y - height / 2
+    tile_pixels = TILE_SIZE * PIXEL_RATIO
+
+    for x, y, path in tiles:
+        try:
+            with Image.open(path) as tile:
+                tile = tile.convert('RGB')
+                if tile.size != (tile_pixels, tile_pixels):
+                    tile = tile.resize((tile_pixels, tile_pixels))
+        except OSError:
+            continue
+        offset = (round((x * TILE_SIZE - left) * PIXEL_RATIO), round((y * TILE_SIZE - top) * PIXEL_RATIO))
+        background.paste(tile, offset)
+    return background
+
+
+def render_route(points, center_lat, center_lng, zoom, width, height, style=DEFAULT_STYLE,
+                 start=None, end=None, background=None):
+    """Render interleaved lat/lng `points` to a PIL image
+
+    `background` is an optional RGB image of the full output size to draw
+    on (for example composited map tiles) instead of the flat style colour.
+    """
+    if not available():
+        raise MapRenderError('Pillow is not installed (pip install Pillow)')
+
+    fill, route_color, start_color, end_color = STYLE_COLORS.get(style, STYLE_COLORS[DEFAULT_STYLE])
+    size = (width * PIXEL_RATIO, height * PIXEL_RATIO)
+    image = background.copy() if background is not None else Image.new('RGB', size, fill)
+    draw = ImageDraw.Draw(image)
+    project = frame_projector(center_lat, center_lng, zoom, width, height)
+
+    pixels = [project(points[i], points[i + 1]) for i in range(0, len(points), 2)]
+    if len(pixels) > 1:
+        draw.line(pixels, fill=route_color, width=ROUTE_WIDTH * PIXEL_RATIO, joint='curve')
+
+    radius = PIN_RADIUS * PIXEL_RATIO
+    for latlng, color in ((end, end_color), (start, start_color)):
+        if latlng:
+            x, y = project(*latlng)
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                         fill=color, outline=(255, 255, 255), width=PIXEL_RATIO)
+    return image
+
+
+def render_to_file(job):
+    """Process-pool entry point: render a job tuple and write its PNG atomically
+
+    job = (activity_id, points, center_lat, center_lng, zoom, width, height,
+           style, start, end, file_path, tiles). `tiles` is a list of
+    (x, y, path) for compose_tiles, or empty for a flat background.
+    Returns (activity_id, error or None).
+    """
+    (activity_id, points, center_lat, center_lng, zoom, width, height,
+     style, start, end, file_path, tiles) = job
+    file_path = Path(file_path)
+    tmp_path = file_path.with_suffix('.tmp')
+    try:
+        background = None
+        if tiles:
+            background = compose_tiles(tiles, center_lat, center_lng, zoom, width, height, style)
+        image = render_route(points, center_lat, center_lng, zoom, width, height,
+                             style=style, start=start, end=end, background=background)
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, file_path)
+    except (MapRenderError, OSError, ValueError) as e:
+        tmp_path.unlink(missing_ok=True)
+        return activity_id, str(e)
+    return activity_id, None
@@ -7,6 +7,7 @@
 
 const fs = require('fs');
 const path = require('path');
+const zlib = require('zlib');
 const Database = require('better-sqlite3');
 
 const DATA_DIR = path.join(__dirname, '../apps/web/data');
@@ -162,16 +163,40 @@ function convertStravaActivity(activity) {
   };
 }
 
+// Datasets are JSON Lines (optionally gzipped); legacy pretty-printed JSON is still accepted
+function findDataset(name) {
+  for (const suffix of ['jsonl', 'jsonl.gz', 'json']) {
+    const file = path.join(DATA_DIR, `${name}.${suffix}`);
+    if (fs.existsSync(file)) {
+      return file;
+    }
+  }
+  return null;
+}
+
+function readDataset(file) {
+  if (file.endsWith('.json')) {
+    return JSON.parse(fs.readFileSync(file, 'utf8'));
+  }
+
+  const raw = fs.readFileSync(file);
+  const text = file.endsWith('.gz') ? zlib.gunzipSync(raw).toString('utf8') : raw.toString('utf8');
+  return text
+    .split('\n')
+    .filter(line => line.trim())
+    .map(line => JSON.parse(line));
+}
+
 function migrateStravaData() {
-  const activitiesFile = path.join(DATA_DIR, 'strava_activities.json');
-  const detailedFile = path.join(DATA_DIR, 'strava_detailed.json');
+  const activitiesFile = findDataset('strava_activities');
+  const detailedFile = findDataset('strava_detailed');
   
   let activities = [];
   
   // Load basic activities
-  if (fs.existsSync(activitiesFile)) {
+  if (activitiesFile) {
     try {
-      const data = JSON.parse(fs.readFileSync(activitiesFile, 'utf8'));
+      const data = readDataset(activitiesFile);
       activities = activities.concat(data);
       console.log(`File Loaded ${data.length} basic activities`);
     } catch (error) {
@@ -180,9 +205,9 @@ function migrateStravaData() {
   }
   
   // Load detailed activities (will override basic ones)
-  if (fs.existsSync(detailedFile)) {
+  if (detailedFile) {
     try {
-      const data = JSON.parse(fs.readFileSync(detailedFile, 'utf8'));
+      const data = readDataset(detailedFile);
       
       // Create a map of detailed activities
       const detailedMap = new Map();
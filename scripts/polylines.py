@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Batch Google polyline decoding with a persistent decoded-route cache
+
+Routes decode into compact array('d') storage (interleaved lat, lng) and
+the bounds, haversine length and centroid are computed in the same pass.
+Decoded routes are cached in SQLite keyed by a hash of the encoded
+polyline, so later runs and other tools never decode the same route twice.
+Routes can be simplified (Douglas-Peucker) until their encoding fits a
+size budget such as a static-map URL.
+"""
+
+import hashlib
+import math
+import sqlite3
+from array import array
+from pathlib import Path
+
+EARTH_RADIUS_M = 6371008.8
+
+# SQLite's default limit on bound parameters per statement (older builds)
+SQLITE_MAX_VARIABLES = 999
+LOOKUP_BATCH_SIZE = 500
+
+
+class DecodedRoute:
+    """A decoded polyline with its bounds, length and centroid"""
+
+    __slots__ = ('points', 'min_lat', 'max_lat', 'min_lng', 'max_lng',
+                 'length_m', 'centroid_lat', 'centroid_lng')
+
+    def __init__(self, points, min_lat=None, max_lat=None, min_lng=None, max_lng=None,
+                 length_m=0.0, centroid_lat=None, centroid_lng=None):
+        self.points = points
+        self.min_lat = min_lat
+        self.max_lat = max_lat
+        self.min_lng = min_lng
+        self.max_lng = max_lng
+        self.length_m = length_m
+        self.centroid_lat = centroid_lat
+        self.centroid_lng = centroid_lng
+
+    def __len__(self):
+        return len(self.points) // 2
+
+    def latlngs(self):
+        """Iterate (lat, lng) pairs without materializing a list"""
+        points = self.points
+        return zip(points[0::2], points[1::2])
+
+    def bounds(self, padding=0.0):
+        """Bounding box dict, padded by a fraction of its span on each side"""
+        if not len(self):
+            return None
+
+        lat_padding = (self.max_lat - self.min_lat) * padding
+        lng_padding = (self.max_lng - self.min_lng) * padding
+        return {
+            'min_lat': self.min_lat - lat_padding,
+            'max_lat': self.max_lat + lat_padding,
+            'min_lng': self.min_lng - lng_padding,
+            'max_lng': self.max_lng + lng_padding,
+        }
+
+
+def polyline_hash(encoded):
+    """Cache key for an encoded polyline"""
+    return hashlib.sha1(encoded.encode('ascii')).hexdigest()
+
+
+def decode(encoded, precision=5):
+    """Decode one polyline, computing bounds, length and centroid in one pass"""
+    points = array('d')
+    if not encoded:
+        return DecodedRoute(points)
+
+    data = encoded.encode('ascii')
+    size = len(data)
+    factor = 10.0 ** precision
+    to_rad = math.pi / 180.0
+    sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+
+    index = lat_e = lng_e = 0
+    min_lat = min_lng = math.inf
+    max_lat = max_lng = -math.inf
+    sum_lat = sum_lng = length = 0.0
+    prev_lat = prev_lng = None
+
+    while index < size:
+        result = shift = 0
+        while True:
+            b = data[index] - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lat_e += ~(result >> 1) if result & 1 else result >> 1
+
+        result = shift = 0
+        while True:
+            b = data[index] - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lng_e += ~(result >> 1) if result & 1 else result >> 1
+
+        lat = lat_e / factor
+        lng = lng_e / factor
+        points.append(lat)
+        points.append(lng)
+
+        if lat < min_lat:
+            min_lat = lat
+        if lat > max_lat:
+            max_lat = lat
+        if lng < min_lng:
+            min_lng = lng
+        if lng > max_lng:
+            max_lng = lng
+        sum_lat += lat
+        sum_lng += lng
+
+        if prev_lat is not None:
+            dlat = (lat - prev_lat) * to_rad
+            dlng = (lng - prev_lng) * to_rad
+            h = sin(dlat / 2) ** 2 + cos(prev_lat * to_rad) * cos(lat * to_rad) * sin(dlng / 2) ** 2
+            length += 2 * EARTH_RADIUS_M * asin(sqrt(min(1.0, h)))
+        prev_lat, prev_lng = lat, lng
+
+    count = len(points) // 2
+    return DecodedRoute(points, min_lat, max_lat, min_lng, max_lng,
+                        length, sum_lat / count, sum_lng / count)
+
+
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode(latlngs, precision=5):
+    """Encode an iterable of (lat, lng) pairs as a Google polyline"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in latlngs:
+        lat_e = round(lat * factor)
+        lng_e = round(lng * factor)
+        _encode_value(lat_e - prev_lat, out)
+        _encode_value(lng_e - prev_lng, out)
+        prev_lat, prev_lng = lat_e, lng_e
+    return ''.join(out)
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker over interleaved lat/lng points; returns kept indices
+
+    `tolerance` is in degrees of latitude; longitudes are scaled by the
+    cosine of the mid latitude so the test is roughly isotropic.
+    """
+    count = len(points) // 2
+    if count < 3:
+        return list(range(count))
+
+    scale = math.cos(math.radians((points[0] + points[-2]) / 2))
+    keep = bytearray(count)
+    keep[0] = keep[count - 1] = 1
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, count - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        ay, ax = points[2 * first], points[2 * first + 1] * scale
+        by, bx = points[2 * last], points[2 * last + 1] * scale
+        dx, dy = bx - ax, by - ay
+        segment_sq = dx * dx + dy * dy
+        max_sq = -1.0
+        index = first
+
+        for i in range(first + 1, last):
+            py, px = points[2 * i], points[2 * i + 1] * scale
+            if segment_sq:
+                t = ((px - ax) * dx + (py - ay) * dy) / segment_sq
+                t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                ex, ey = ax + t * dx - px, ay + t * dy - py
+            else:
+                ex, ey = ax - px, ay - py
+            distance_sq = ex * ex + ey * ey
+            if distance_sq > max_sq:
+                max_sq, index = distance_sq, i
+
+        if max_sq > tolerance_sq:
+            keep[index] = 1
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [i for i in range(count) if keep[i]]
+
+
+def simplify_to_budget(encoded, route, budget, measure=len, tolerance=0.00001, refine_steps=8):
+    """Simplify a route with the smallest tolerance whose encoding fits `budget`
+
+    Returns (encoded, point_count, tolerance); the original encoding is kept
+    (tolerance 0) when it already fits. `measure` gives the encoded cost,
+    e.g. its URL-quoted length. The tolerance doubles until the route fits,
+    then is bisected back towards the largest route that still fits.
+    """
+    if measure(encoded) <= budget:
+        return encoded, len(route), 0.0
+
+    points = route.points
+
+    def attempt(tolerance):
+        kept = simplify(points, tolerance)
+        simplified = encode((points[2 * i], points[2 * i + 1]) for i in kept)
+        return simplified, len(kept), tolerance
+
+    low = 0.0
+    best = attempt(tolerance)
+    while measure(best[0]) > budget and best[1] > 2:
+        low = tolerance
+        tolerance *= 2
+        best = attempt(tolerance)
+
+    high = tolerance
+    for _ in range(refine_steps):
+        candidate = attempt((low + high) / 2)
+        if measure(candidate[0]) <= budget:
+            best, high = candidate, candidate[2]
+        else:
+            low = candidate[2]
+    return best
+
+
+def decode_many(encoded_polylines, cache=None):
+    """Decode a batch of polylines, returning {polyline_hash: DecodedRoute}
+
+    Malformed polylines are omitted from the result. With a RouteCache,
+    cached routes are loaded in bulk and only misses are decoded and
+    written back in a single transaction.
+    """
+    by_hash = {}
+    for encoded in encoded_polylines:
+        if encoded:
+            by_hash.setdefault(polyline_hash(encoded), encoded)
+
+    routes = cache.get_many(by_hash.keys()) if cache else {}
+    decoded = {}
+    for key, encoded in by_hash.items():
+        if key in routes:
+            continue
+        try:
+            decoded[key] = decode(encoded)
+        except IndexError:
+            # Truncated polyline; leave it out so callers treat it as unmappable
+            continue
+    if cache and decoded:
+        cache.put_many(decoded)
+
+    routes.update(decoded)
+    return routes
+
+
+class RouteCache:
+    """SQLite store of decoded routes keyed by polyline hash"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS routes (
+                hash TEXT PRIMARY KEY,
+                points BLOB NOT NULL,
+                min_lat REAL, max_lat REAL, min_lng REAL, max_lng REAL,
+                length_m REAL,
+                centroid_lat REAL, centroid_lng REAL
+            )
+        ''')
+
+    def get_many(self, hashes):
+        """Load cached routes for the given hashes"""
+        hashes = list(hashes)
+        routes = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            chunk = hashes[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT * FROM routes WHERE hash IN ({placeholders})', chunk)
+            for key, blob, *fields in rows:
+                points = array('d')
+                points.frombytes(blob)
+                routes[key] = DecodedRoute(points, *fields)
+        return routes
+
+    def put_many(self, routes):
+        """Store {hash: DecodedRoute} in one transaction"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (key, route.points.tobytes(), route.min_lat, route.max_lat,
+                     route.min_lng, route.max_lng, route.length_m,
+                     route.centroid_lat, route.centroid_lng)
+                    for key, route in routes.items()
+                ],
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Token-bucket rate limiting shared by the sync and map scripts
+
+Strava enforces a 15-minute and a daily request window and reports both in
+the X-RateLimit-Limit / X-RateLimit-Usage headers ("short,daily"). The
+limiter keeps one bucket per window, starts from conservative defaults and
+re-calibrates from those headers after every response. Strava resets the
+windows at fixed boundaries (every quarter hour and at midnight UTC), so
+once a window is reported used up the limiter waits for that boundary
+rather than for the continuous refill.
+"""
+
+import threading
+import time
+from collections import deque
+
+SHORT_WINDOW_SECONDS = 15 * 60
+DAILY_WINDOW_SECONDS = 24 * 60 * 60
+
+# Strava's default read limits; real values are learned from the headers.
+DEFAULT_SHORT_LIMIT = 100
+DEFAULT_DAILY_LIMIT = 1000
+
+
+class RateLimitExhausted(Exception):
+    """Raised when the next token is further away than the caller will wait"""
+
+    def __init__(self, wait_seconds):
+        super().__init__(f"rate limit exhausted, next request allowed in {wait_seconds:.0f}s")
+        self.wait_seconds = wait_seconds
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at capacity / window tokens per second
+
+    A bucket the server reports as used up stays empty until the window's
+    next fixed reset (multiples of window_seconds since the epoch, in UTC),
+    then starts full again.
+
+    Not thread-safe on its own; callers hold a lock around it.
+    """
+
+    def __init__(self, capacity, window_seconds, clock=time.monotonic, wall_clock=time.time):
+        self.capacity = float(capacity)
+        self.window_seconds = float(window_seconds)
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.tokens = float(capacity)
+        self.updated_at = clock()
+        # clock() time of the next window reset while the server reports it used up
+        self.blocked_until = None
+
+    @property
+    def rate(self):
+        return self.capacity / self.window_seconds
+
+    def seconds_to_reset(self):
+        """Seconds until the current fixed window ends"""
+        return self.window_seconds - self.wall_clock() % self.window_seconds
+
+    def refill(self):
+        now = self.clock()
+        if self.blocked_until is not None:
+            if now < self.blocked_until:
+                self.updated_at = now
+                return
+            # A new window has started
+            self.blocked_until = None
+            self.tokens = self.capacity
+            self.updated_at = now
+            return
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` are available (0 if available now)"""
+        self.refill()
+        if self.blocked_until is not None:
+            return self.blocked_until - self.clock()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens=1):
+        self.tokens -= tokens
+
+    def calibrate(self, capacity, used):
+        """Align the bucket with limits and usage reported by the server"""
+        self.refill()
+        self.capacity = float(capacity)
+        if used >= capacity:
+            self.tokens = 0.0
+            self.blocked_until = self.clock() + self.seconds_to_reset()
+        elif self.blocked_until is None:
+            # A lower count arriving while blocked is a response from before the block
+            self.tokens = min(self.tokens, max(0.0, self.capacity - used))
+
+
+class RequestsPerSecondLimiter:
+    """Thread-safe limiter for a plain requests-per-second ceiling (e.g. Mapbox)"""
+
+    def __init__(self, requests_per_second, clock=time.monotonic, sleep=time.sleep):
+        burst = max(1.0, float(requests_per_second))
+        self.bucket = TokenBucket(burst, burst / float(requests_per_second), clock=clock)
+        self.lock = threading.Lock()
+        self.sleep = sleep
+
+    def acquire(self, max_wait=None):
+        """Block until a request is allowed under the ceiling"""
+        while True:
+            with self.lock:
+                wait = self.bucket.wait_time()
+                if wait == 0:
+                    self.bucket.take()
+                    return
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExhausted(wait)
+            self.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """Plain ceilings are not calibrated from response headers"""
+
+
+class StravaRateLimiter:
+    """Thread-safe limiter enforcing Strava's 15-minute and daily windows"""
+
+    def __init__(self, short_limit=DEFAULT_SHORT_LIMIT, daily_limit=DEFAULT_DAILY_LIMIT,
+                 clock=time.monotonic, sleep=time.sleep, wall_clock=time.time):
+        self.short = TokenBucket(short_limit, SHORT_WINDOW_SECONDS, clock=clock, wall_clock=wall_clock)
+        self.daily = TokenBucket(daily_limit, DAILY_WINDOW_SECONDS, clock=clock, wall_clock=wall_clock)
+        self.lock = threading.Lock()
+        self.sleep = sleep
+
+    def acquire(self, max_wait=None):
+        """Block until both windows have a token, then consume one from each
+
+        Raises RateLimitExhausted instead of sleeping when the required wait
+        exceeds `max_wait` seconds (e.g. the daily quota is spent and the
+        next UTC midnight is hours away).
+        """
+        while True:
+            with self.lock:
+                wait = max(self.short.wait_time(), self.daily.wait_time())
+                if wait == 0:
+                    self.short.take()
+                    self.daily.take()
+                    return
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExhausted(wait)
+            self.sleep(min(wait, 1.0))
+
+    def update_from_headers(self, headers):
+        """Re-calibrate from X-RateLimit-* (or X-ReadRateLimit-*) response headers"""
+        limits = parse_rate_limit_pair(
+            headers.get('X-ReadRateLimit-Limit') or headers.get('X-RateLimit-Limit'))
+        usage = parse_rate_limit_pair(
+            headers.get('X-ReadRateLimit-Usage') or headers.get('X-RateLimit-Usage'))
+        if not limits or not usage:
+            return
+
+        with self.lock:
+            self.short.calibrate(limits[0], usage[0])
+            self.daily.calibrate(limits[1], usage[1])
+
+    def remaining(self):
+        """Approximate (short, daily) requests left right now"""
+        with self.lock:
+            self.short.refill()
+            self.daily.refill()
+            return int(self.short.tokens), int(self.daily.tokens)
+
+
+class FairShareLimiter:
+    """Round-robin access to one limiter for several clients (e.g. athletes)
+
+    Strava's limits apply to the whole application, so concurrent athlete
+    syncs draw from one StravaRateLimiter. Tokens go to waiting clients in
+    turn, so a client running more threads than another does not get a
+    bigger share.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.condition = threading.Condition()
+        self.turns = deque()
+        self.waiting = {}
+        self.busy = False
+
+    def client(self, name):
+        """Limiter interface for one client, as HttpClient expects"""
+        return FairShareClient(self, name)
+
+    def acquire(self, name, max_wait=None):
+        with self.condition:
+            self.waiting[name] = self.waiting.get(name, 0) + 1
+            if name not in self.turns:
+                self.turns.append(name)
+            while self.busy or self.turns[0] != name:
+                self.condition.wait()
+            self.busy = True
+        try:
+            self.limiter.acquire(max_wait=max_wait)
+        finally:
+            with self.condition:
+                self.busy = False
+                self.waiting[name] -= 1
+                self.turns.popleft()
+                if self.waiting[name]:
+                    self.turns.append(name)
+                self.condition.notify_all()
+
+    def update_from_headers(self, headers):
+        self.limiter.update_from_headers(headers)
+
+
+class FairShareClient:
+    def __init__(self, shared, name):
+        self.shared = shared
+        self.name = name
+
+    def acquire(self, max_wait=None):
+        self.shared.acquire(self.name, max_wait=max_wait)
+
+    def update_from_headers(self, headers):
+        self.shared.update_from_headers(headers)
+
+
+def parse_rate_limit_pair(value):
+    """Parse a "short,daily" header value into a pair of ints"""
+    if not value:
+        return None
+    try:
+        short, daily = (int(part.strip()) for part in value.split(','))
+    except ValueError:
+        return None
+    return short, daily
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Repeated-route detection
+
+Each route is resampled to ROUTE_SAMPLES points evenly spaced along its
+length and compared to existing cluster representatives with the discrete
+Fréchet distance. A route joins the closest cluster within
+ROUTE_MATCH_M metres, otherwise it starts a new cluster and becomes its
+representative. Direction matters: the same loop run the other way round
+is a different route.
+
+Comparisons are limited to candidates that can possibly match: a Fréchet
+distance of at most ROUTE_MATCH_M between two sample sequences implies
+start points and all four edges of the samples' bounding boxes within
+ROUTE_MATCH_M, so clusters are bucketed by start point and checked on
+sample bounds before any Fréchet computation. The bounds must come from
+the samples rather than the full polyline: a corner the samples cut
+widens the polyline's box but not what Fréchet sees.
+
+Matching is incremental: activity_routes records the cluster and polyline
+hash per activity, and only new or re-drawn routes are matched, against
+the representatives stored in route_clusters rather than every
+historical route.
+"""
+
+import math
+from array import array
+
+from polylines import EARTH_RADIUS_M, decode, polyline_hash
+
+ROUTE_CLUSTER_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS route_clusters (
+  id INTEGER PRIMARY KEY,
+  representative_id INTEGER,
+  start_lat REAL NOT NULL,
+  start_lng REAL NOT NULL,
+  min_lat REAL NOT NULL,
+  max_lat REAL NOT NULL,
+  min_lng REAL NOT NULL,
+  max_lng REAL NOT NULL,
+  length_m REAL NOT NULL,
+  samples BLOB NOT NULL,
+  member_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS activity_routes (
+  activity_id INTEGER PRIMARY KEY,
+  cluster_id INTEGER NOT NULL,
+  polyline_hash TEXT NOT NULL,
+  frechet_m REAL NOT NULL,
+  FOREIGN KEY (activity_id) REFERENCES activities(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_activity_routes_cluster ON activity_routes(cluster_id);
+"""
+
+ROUTE_SAMPLES = 48
+ROUTE_MATCH_M = 200
+
+METRES_PER_DEGREE = math.radians(1) * EARTH_RADIUS_M
+MATCH_DEGREES = ROUTE_MATCH_M / METRES_PER_DEGREE
+
+
+def resample(points, count=ROUTE_SAMPLES):
+    """array('d') of `count` lat/lng pairs evenly spaced along a route"""
+    scale_x = math.cos(math.radians(points[0]))
+    cumulative = [0.0]
+    for i in range(2, len(points), 2):
+        dy = points[i] - points[i - 2]
+        dx = (points[i + 1] - points[i - 1]) * scale_x
+        cumulative.append(cumulative[-1] + math.hypot(dx, dy))
+
+    total = cumulative[-1]
+    samples = array('d')
+    segment = 0
+    for k in range(count):
+        target = total * k / (count - 1) if count > 1 else 0.0
+        while segment < len(cumulative) - 2 and cumulative[segment + 1] < target:
+            segment += 1
+        span = cumulative[segment + 1] - cumulative[segment] if len(cumulative) > 1 else 0.0
+        t = (target - cumulative[segment]) / span if span > 0 else 0.0
+        i = 2 * segment
+        j = min(i + 2, len(points) - 2)
+        samples.append(points[i] + (points[j] - points[i]) * t)
+        samples.append(points[i + 1] + (points[j + 1] - points[i + 1]) * t)
+    return samples
+
+
+def sample_bounds(samples):
+    """(min_lat, max_lat, min_lng, max_lng) of resampled points"""
+    lats, lngs = samples[0::2], samples[1::2]
+    return min(lats), max(lats), min(lngs), max(lngs)
+
+
+def frechet_m(a, b, limit=math.inf):
+    """Discrete Fréchet distance in metres between two resampled routes
+
+    Returns math.inf as soon as it is certain to exceed `limit`.
+    """
+    scale_y = METRES_PER_DEGREE
+    scale_x = scale_y * math.cos(math.radians(a[0]))
+    n, m = len(a) // 2, len(b) // 2
+    previous = [math.inf] * m
+    for i in range(n):
+        lat, lng = a[2 * i], a[2 * i + 1]
+        row = [0.0] * m
+        row_min = math.inf
+        for j in range(m):
+            d = math.hypot((lat - b[2 * j]) * scale_y, (lng - b[2 * j + 1]) * scale_x)
+            if i == 0 and j == 0:
+                best = d
+            elif i == 0:
+                best = max(row[j - 1], d)
+            elif j == 0:
+                best = max(previous[0], d)
+            else:
+                best = max(min(previous[j], previous[j - 1], row[j - 1]), d)
+            row[j] = best
+            row_min = min(row_min, best)
+        # Every coupling path crosses each row, so the row minimum is a lower bound
+        if row_min > limit:
+            return math.inf
+        previous = row
+    return previous[-1]
+
+
+class ClusterIndex:
+    """Cluster representatives bucketed by start point"""
+
+    def __init__(self):
+        self.buckets = {}
+
+    @staticmethod
+    def bucket(lat, lng):
+        return math.floor(lat / MATCH_DEGREES), math.floor(lng / MATCH_DEGREES)
+
+    def add(self, cluster):
+        self.buckets.setdefault(self.bucket(cluster['start_lat'], cluster['start_lng']), []).append(cluster)
+
+    def candidates(self, route):
+        """Clusters whose start point and sample bounds are within ROUTE_MATCH_M of a route's"""
+        lat, lng = route['start_lat'], route['start_lng']
+        lat_delta = MATCH_DEGREES
+        lng_delta = MATCH_DEGREES / max(math.cos(math.radians(lat)), 1e-6)
+        row, col = self.bucket(lat, lng)
+        span = math.ceil(lng_delta / MATCH_DEGREES)
+        for r in range(row - 1, row + 2):
+            for c in range(col - span, col + span + 1):
+                for cluster in self.buckets.get((r, c), ()):
+                    if (abs(cluster['start_lat'] - lat) <= lat_delta
+                            and abs(cluster['start_lng'] - lng) <= lng_delta
+                            and abs(cluster['min_lat'] - route['min_lat']) <= lat_delta
+                            and abs(cluster['max_lat'] - route['max_lat']) <= lat_delta
+                            and abs(cluster['min_lng'] - route['min_lng']) <= lng_delta
+                            and abs(cluster['max_lng'] - route['max_lng']) <= lng_delta):
+                        yield cluster
+
+
+def route_summary(encoded):
+    """Samples, start point, bounds and length for matching, or None"""
+    try:
+        route = decode(encoded)
+    except IndexError:
+        return None
+    if len(route) < 2:
+        return None
+    samples = resample(route.points)
+    min_lat, max_lat, min_lng, max_lng = sample_bounds(samples)
+    return {
+        'samples': samples,
+        'start_lat': samples[0],
+        'start_lng': samples[1],
+        'min_lat': min_lat,
+        'max_lat': max_lat,
+        'min_lng': min_lng,
+        'max_lng': max_lng,
+        'length_m': route.length_m,
+    }
+
+
+def load_clusters(conn):
+    index = ClusterIndex()
+    for cluster_id, blob in conn.execute('SELECT id, samples FROM route_clusters'):
+        samples = array('d', blob)
+        # Older rows stored polyline bounds; the prefilter needs sample bounds
+        min_lat, max_lat, min_lng, max_lng = sample_bounds(samples)
+        index.add({
+            'id': cluster_id, 'start_lat': samples[0], 'start_lng': samples[1],
+            'min_lat': min_lat, 'max_lat': max_lat, 'min_lng': min_lng, 'max_lng': max_lng,
+            'samples': samples,
+        })
+    return index
+
+
+def match_route(index, route):
+    """(closest cluster, Fréchet metres) within ROUTE_MATCH_M, or (None, None)"""
+    best, best_distance = None, None
+    limit = ROUTE_MATCH_M
+    for cluster in index.candidates(route):
+        distance = frechet_m(route['samples'], cluster['samples'], limit)
+        if distance <= limit:
+            best, best_distance, limit = cluster, distance, distance
+    return best, best_distance
+
+
+def refresh_route_clusters(conn, batch_size=500):
+    """Match new or re-drawn routes to clusters; returns (matched, new clusters)"""
+    rows = conn.execute('''
+        SELECT id, summary_polyline FROM activities
+        WHERE summary_polyline IS NOT NULL AND summary_polyline != ''
+        ORDER BY start_date
+    ''').fetchall()
+    stored = dict(conn.execute('SELECT activity_id, polyline_hash FROM activity_routes'))
+    pending = [(row_id, encoded) for row_id, encoded in rows
+               if stored.get(row_id) != polyline_hash(encoded)]
+
+    index = load_clusters(conn)
+    matched = created = 0
+    for start in range(0, len(pending), batch_size):
+        with conn:
+            for row_id, encoded in pending[start:start + batch_size]:
+                conn.execute('DELETE FROM activity_routes WHERE activity_id = ?', (row_id,))
+                route = route_summary(encoded)
+                if route is None:
+                    continue
+
+                cluster, distance = match_route(index, route)
+                if cluster is None:
+                    cursor = conn.execute(
+                        'INSERT INTO route_clusters (representative_id, start_lat, start_lng, min_lat, '
+                        'max_lat, min_lng, max_lng, length_m, samples) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (row_id, route['start_lat'], route['start_lng'], route['min_lat'], route['max_lat'],
+                         route['min_lng'], route['max_lng'], route['length_m'], route['samples'].tobytes()),
+                    )
+                    cluster = dict(route, id=cursor.lastrowid)
+                    index.add(cluster)
+                    distance = 0.0
+                    created += 1
+                else:
+                    matched += 1
+                conn.execute(
+                    'INSERT INTO activity_routes (activity_id, cluster_id, polyline_hash, frechet_m) '
+                    'VALUES (?, ?, ?, ?)',
+                    (row_id, cluster['id'], polyline_hash(encoded), distance),
+                )
+
+    # Drop routes that were deleted or lost their polyline, then empty clusters
+    with conn:
+        conn.execute('''
+            DELETE FROM activity_routes WHERE activity_id NOT IN (
+              SELECT id FROM activities WHERE summary_polyline IS NOT NULL AND summary_polyline != ''
+            )
+        ''')
+        conn.execute('''
+            UPDATE route_clusters SET member_count = (
+              SELECT COUNT(*) FROM activity_routes r WHERE r.cluster_id = route_clusters.id
+            )
+        ''')
+        conn.execute('DELETE FROM route_clusters WHERE member_count = 0')
+    return matched, created
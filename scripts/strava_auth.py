@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Shared Strava credential broker
+
+Strava access tokens last six hours, yet every script used to trade its
+refresh token for a new one on each invocation. TokenBroker keeps the
+access token, its expires_at and the (possibly rotated) refresh token per
+athlete in a token store (.secrets/strava-tokens.json, or
+STRAVA_TOKEN_STORE), and only calls /oauth/token when the cached token is
+missing or within REFRESH_MARGIN of expiring.
+
+With STRAVA_TOKEN_STORE_KEY set, the store is encrypted (Fernet, with a key
+derived from that secret; needs the cryptography package), so it can be
+kept somewhere readable by others, such as the Actions cache. Without
+cryptography an encrypted store is neither read nor written, and tokens
+last only for the process.
+
+Threads sharing a broker take its lock, and processes sharing a store take
+an exclusive lock on the store's .lock file while they refresh, so
+concurrent workers make a single refresh and the rest reuse its token. The
+store is replaced atomically and is readable by its owner only; it never
+goes into the committed data.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from http_client import HttpClient, PermanentHttpError
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # optional dependency, only needed for an encrypted store
+    Fernet = None
+    InvalidToken = ValueError
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; the thread lock still applies
+    fcntl = None
+
+STRAVA_OAUTH_URL = os.getenv('STRAVA_OAUTH_URL', 'https://www.strava.com/oauth/token')
+# Not under .cache: that directory goes into the Actions cache, which pull request runs can read
+DEFAULT_TOKEN_STORE = Path(os.getenv('STRAVA_TOKEN_STORE', '../.secrets/strava-tokens.json'))
+DEFAULT_STORE_KEY = os.getenv('STRAVA_TOKEN_STORE_KEY')
+
+# Refresh a cached access token this long before it expires
+REFRESH_MARGIN = 10 * 60
+
+
+def store_key(secret):
+    """Fernet key derived from an arbitrary secret string"""
+    digest = hashlib.sha256(b'strava-token-store\0' + secret.encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest)
+
+
+class TokenStore:
+    """Tokens per user id in a JSON file outside the committed data, encrypted when given a key"""
+
+    def __init__(self, path=DEFAULT_TOKEN_STORE, key=DEFAULT_STORE_KEY):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix('.lock')
+        self.lock = threading.Lock()
+        self.encrypted = bool(key)
+        self.fernet = None
+        if key and Fernet is None:
+            print("Warning  STRAVA_TOKEN_STORE_KEY is set but cryptography is not installed; "
+                  "tokens will not be stored")
+        elif key:
+            self.fernet = Fernet(store_key(key))
+        self.tokens = {}
+        self.load()
+
+    @property
+    def persistent(self):
+        return not self.encrypted or self.fernet is not None
+
+    def load(self):
+        """Re-read the file; another process may have refreshed a token"""
+        if not self.persistent:
+            return self.tokens
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if self.fernet:
+                data = self.fernet.decrypt(data)
+            self.tokens = json.loads(data)
+        except FileNotFoundError:
+            self.tokens = {}
+        except (OSError, ValueError, InvalidToken) as e:
+            # InvalidToken also covers a plaintext store or a changed key
+            print(f"Warning  Ignoring unreadable token store: {e!r}")
+            self.tokens = {}
+        return self.tokens
+
+    def get(self, user_id):
+        return dict(self.tokens.get(str(user_id)) or {})
+
+    def refresh_token(self, user_id):
+        return self.get(user_id).get('refresh_token')
+
+    @contextmanager
+    def locked(self):
+        """Hold the store exclusively, across threads and processes, with fresh contents"""
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    self.load()
+                    yield self
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def update(self, user_id, entry):
+        """Replace one user's tokens; call while holding locked()"""
+        self.tokens[str(user_id)] = entry
+        if not self.persistent:
+            return
+        data = json.dumps(self.tokens).encode('utf-8')
+        if self.fernet:
+            data = self.fernet.encrypt(data)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            os.chmod(tmp_path, 0o600)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class TokenBroker:
+    """Hands out one athlete's access token, refreshing it only near expiry
+
+    The stored refresh token wins over the one passed in, since it is the
+    latest rotation; if Strava rejects it, the passed-in one is tried.
+    Refresh failures raise HttpError.
+    """
+
+    def __init__(self, client_id, client_secret, refresh_token, user_id=1, store=None,
+                 http=None, margin=REFRESH_MARGIN, clock=time.time):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.initial_refresh_token = refresh_token
+        self.user_id = user_id
+        self.store = store if store is not None else TokenStore()
+        self.http = http or HttpClient(pool_size=1)
+        self.margin = margin
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.token = self.stored()
+        # Whether the last access_token() call went to /oauth/token
+        self.refreshed = False
+
+    def stored(self):
+        """This athlete's store entry, unless it was issued to another client"""
+        entry = self.store.get(self.user_id)
+        if entry.get('client_id') not in (None, str(self.client_id)):
+            return {}
+        return entry
+
+    @property
+    def refresh_token(self):
+        return self.token.get('refresh_token') or self.initial_refresh_token
+
+    @property
+    def expires_at(self):
+        return self.token.get('expires_at')
+
+    def is_fresh(self, token=None):
+        token = self.token if token is None else token
+        return bool(token.get('access_token')) and \
+            (token.get('expires_at') or 0) - self.margin > self.clock()
+
+    def access_token(self, force=False):
+        """A valid access token, refreshed (once, under the lock) if needed"""
+        if not force and self.is_fresh():
+            self.refreshed = False
+            return self.token['access_token']
+
+        with self.lock, self.store.locked():
+            stored = self.stored()
+            # Another worker may have refreshed while we waited for the lock
+            if not force or stored.get('access_token') != self.token.get('access_token'):
+                self.token = stored
+                if self.is_fresh():
+                    self.refreshed = False
+                    return self.token['access_token']
+
+            self.token = self.refresh(stored.get('refresh_token'))
+            self.store.update(self.user_id, self.token)
+            self.refreshed = True
+            return self.token['access_token']
+
+    def refresh(self, stored_refresh_token):
+        """Trade a refresh token for a new access token; returns the store entry"""
+        candidates = [t for t in (stored_refresh_token, self.initial_refresh_token) if t]
+        candidates = list(dict.fromkeys(candidates))
+        if not candidates:
+            raise PermanentHttpError('No Strava refresh token', url=STRAVA_OAUTH_URL)
+
+        for i, refresh_token in enumerate(candidates):
+            try:
+                response = self.http.post(STRAVA_OAUTH_URL, data={
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'refresh_token': refresh_token,
+                    'grant_type': 'refresh_token',
+                })
+            except PermanentHttpError:
+                if i == len(candidates) - 1:
+                    raise
+                print("Warning  Stored refresh token was rejected, trying the configured one")
+                continue
+            data = response.json()
+            return {
+                'client_id': str(self.client_id),
+                'access_token': data['access_token'],
+                'expires_at': data.get('expires_at'),
+                # Strava may rotate the refresh token; keep whichever is current
+                'refresh_token': data.get('refresh_token') or refresh_token,
+                'token_type': data.get('token_type'),
+                'scope': data.get('scope'),
+                'refreshed_at': int(self.clock()),
+            }
+
+    def auth_headers(self):
+        return {'Authorization': f'Bearer {self.access_token()}'}
+
+    def token_info(self):
+        """Non-secret details of the current access token"""
+        return {key: self.token.get(key) for key in ('token_type', 'expires_at', 'scope', 'refreshed_at')}
+
+
+def broker_from_env(user_id=1, refresh_token=None, **kwargs):
+    """TokenBroker from STRAVA_CLIENT_ID / _SECRET / _REFRESH_TOKEN, or None if they are missing"""
+    client_id = os.getenv('STRAVA_CLIENT_ID')
+    client_secret = os.getenv('STRAVA_CLIENT_SECRET')
+    refresh_token = refresh_token or os.getenv('STRAVA_REFRESH_TOKEN')
+    if not all([client_id, client_secret, refresh_token]):
+        return None
+    return TokenBroker(client_id, client_secret, refresh_token, user_id=user_id, **kwargs)
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Strava webhook receiver and event worker
+
+The receiver answers Strava's subscription validation (GET with
+hub.challenge) and commits every event POST to the durable queue in
+scripts/event_queue.py before acknowledging it. The worker drains the
+queue, coalescing bursts per activity: settled create/update events cost
+one detail fetch, and the changes are folded into the local datasets and
+database without re-paging the history. Publishing still goes through the
+sync-data workflow commit.
+
+Strava does not sign events, and the callback URL is public, so the worker
+trusts none of them blindly: events must carry our subscription id and
+the synced athlete's owner_id, and a delete is only applied once
+/activities/{id} answers 404.
+
+Usage:
+  cd scripts && python strava_webhook.py serve [--host 0.0.0.0] [--port 8788]
+  python strava_webhook.py drain      # process settled events once and exit
+  python strava_webhook.py send --url http://127.0.0.1:8788/webhook --id 123 [--aspect update]
+  python strava_webhook.py subscribe --callback-url https://example.com/webhook
+
+Environment: STRAVA_WEBHOOK_VERIFY_TOKEN (required by serve and subscribe),
+STRAVA_WEBHOOK_QUEUE (default ../.cache/strava-events.db) and the usual
+STRAVA_CLIENT_ID / STRAVA_CLIENT_SECRET / STRAVA_REFRESH_TOKEN.
+STRAVA_WEBHOOK_SUBSCRIPTION_ID and STRAVA_ATHLETE_ID skip looking up the
+subscription (/push_subscriptions) and athlete (/athlete) at start.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from event_queue import EventQueue
+from http_client import HttpClient, HttpError, PermanentHttpError
+from sync_strava import STRAVA_API_BASE, StravaSync
+
+DEFAULT_QUEUE = Path(os.getenv('STRAVA_WEBHOOK_QUEUE', '../.cache/strava-events.db'))
+
+# Strava sends several updates within seconds of an upload (title, gear, privacy...)
+SETTLE_SECONDS = 10
+POLL_SECONDS = 2
+
+OBJECT_TYPES = ('activity', 'athlete')
+ASPECT_TYPES = ('create', 'update', 'delete')
+
+# Strava expects an answer within two seconds; an event is never this big
+MAX_EVENT_BYTES = 64 * 1024
+
+
+def validate_event(event):
+    """Error message for a malformed event payload, or None"""
+    if not isinstance(event, dict):
+        return 'event must be a JSON object'
+    if event.get('object_type') not in OBJECT_TYPES:
+        return f"unknown object_type: {event.get('object_type')!r}"
+    if event.get('aspect_type') not in ASPECT_TYPES:
+        return f"unknown aspect_type: {event.get('aspect_type')!r}"
+    try:
+        int(event.get('object_id'))
+    except (TypeError, ValueError):
+        return 'object_id must be an integer'
+    return None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """GET: subscription validation, POST: enqueue an event"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        if parsed.path != self.server.path:
+            self.send_json(404, {'error': 'not found'})
+        elif (query.get('hub.mode') == 'subscribe'
+              and query.get('hub.verify_token') == self.server.verify_token
+              and 'hub.challenge' in query):
+            print("OK Webhook subscription validated")
+            self.send_json(200, {'hub.challenge': query['hub.challenge']})
+        else:
+            print("Warning  Rejected webhook validation request")
+            self.send_json(403, {'error': 'verification failed'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != self.server.path:
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_EVENT_BYTES:
+            self.send_json(413, {'error': 'event too large'})
+            return
+        try:
+            event = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {'error': 'invalid JSON'})
+            return
+        error = validate_event(event)
+        if error:
+            print(f"Warning  Rejected webhook event: {error}")
+            self.send_json(400, {'error': error})
+            return
+
+        event_id = self.server.queue().put(event)
+        print(f"Sync Queued {event['object_type']} {event['object_id']} "
+              f"{event['aspect_type']} (event {event_id})")
+        self.send_json(200, {'queued': event_id})
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue_path, verify_token, path='/webhook'):
+        super().__init__(address, WebhookHandler)
+        self.queue_path = queue_path
+        self.verify_token = verify_token
+        self.path = path
+        self.local = threading.local()
+
+    def queue(self):
+        """This handler thread's queue connection"""
+        if not hasattr(self.local, 'queue'):
+            self.local.queue = EventQueue(self.queue_path)
+        return self.local.queue
+
+
+class EventWorker:
+    """Applies settled queue entries to the local datasets and database"""
+
+    def __init__(self, sync, queue, settle_seconds=SETTLE_SECONDS, subscription_ids=None, athlete_ids=None):
+        self.sync = sync
+        self.queue = queue
+        self.settle_seconds = settle_seconds
+        # Looked up from Strava on first use when not given
+        self.subscription_ids = subscription_ids
+        self.athlete_ids = athlete_ids
+
+    def ensure_token(self):
+        # The broker refreshes shortly before expiry, so a long-lived worker stays valid
+        if self.sync.access_token and self.sync.token_broker.is_fresh():
+            return True
+        return self.sync.refresh_access_token()
+
+    def fetch_detail(self, activity_id, missing=(403, 404)):
+        """Activity detail, or None when Strava answers one of the `missing` statuses"""
+        url = f'{STRAVA_API_BASE}/activities/{activity_id}'
+        headers = {'Authorization': f'Bearer {self.sync.access_token}'}
+        try:
+            return self.sync.http.get(url, headers=headers).json()
+        except PermanentHttpError as e:
+            if e.status_code in missing:
+                return None
+            raise
+
+    def load_senders(self):
+        """Look up our subscription and athlete ids if they were not configured"""
+        if self.subscription_ids is None:
+            response = self.sync.http.get(f'{STRAVA_API_BASE}/push_subscriptions', params={
+                'client_id': self.sync.client_id,
+                'client_secret': self.sync.client_secret,
+            })
+            self.subscription_ids = {int(s['id']) for s in response.json()}
+        if self.athlete_ids is None:
+            headers = {'Authorization': f'Bearer {self.sync.access_token}'}
+            response = self.sync.http.get(f'{STRAVA_API_BASE}/athlete', headers=headers)
+            self.athlete_ids = {int(response.json()['id'])}
+
+    def screen(self):
+        """Reject pending events not from our subscription and athlete
+
+        Returns False when the ids cannot be looked up yet; events then
+        stay pending rather than being processed unchecked.
+        """
+        senders = self.queue.pending_senders()
+        if not senders:
+            return True
+        try:
+            if self.subscription_ids is None or self.athlete_ids is None:
+                if not self.ensure_token():
+                    return False
+                self.load_senders()
+        except Exception as e:
+            print(f"Error Could not look up the webhook subscription and athlete: {e}")
+            return False
+
+        unknown = {(owner_id, subscription_id) for owner_id, subscription_id in senders
+                   if owner_id not in self.athlete_ids or subscription_id not in self.subscription_ids}
+        if unknown:
+            rejected = self.queue.reject(unknown, 'unknown subscription or owner')
+            print(f"Warning  Rejected {rejected} webhook events from unknown senders: {sorted(unknown, key=str)}")
+        return True
+
+    def run_once(self):
+        """Process every settled object once; returns the number of objects handled
+
+        Claimed events always end up completed or failed, even when
+        processing raises, so none are left 'processing' until a restart.
+        """
+        if not self.screen():
+            return 0
+        claimed = self.queue.claim(self.settle_seconds)
+        if not claimed:
+            return 0
+
+        unsettled = {i for c in claimed for i in c[3]}
+        try:
+            self.process(claimed, unsettled)
+        except Exception as e:
+            print(f"Error Webhook batch failed: {e}")
+            self.queue.fail(sorted(unsettled), e)
+        return len(claimed)
+
+    def process(self, claimed, unsettled):
+        """Apply claimed objects, removing event ids from `unsettled` as they are completed or failed"""
+        def complete(event_ids):
+            self.queue.complete(event_ids)
+            unsettled.difference_update(event_ids)
+
+        def fail(event_ids, error):
+            self.queue.fail(event_ids, error)
+            unsettled.difference_update(event_ids)
+
+        done = []
+        activities = []
+        for object_type, object_id, action, event_ids in claimed:
+            if object_type == 'activity':
+                activities.append((object_id, action, event_ids))
+                continue
+            # Athlete events only report profile changes and deauthorization
+            print(f"Warning  Athlete {object_id} event ({action}); nothing to sync")
+            done.extend(event_ids)
+
+        if activities:
+            self.sync.reset_metrics()
+            if not self.ensure_token():
+                fail([i for _, _, ids in activities for i in ids], 'token refresh failed')
+                activities = []
+
+        details = []
+        deleted_ids = []
+        applied = []
+        for object_id, action, event_ids in activities:
+            try:
+                with self.sync.metrics.stage('detail_fetch'):
+                    # A delete only counts once Strava no longer has the activity
+                    detail = self.fetch_detail(object_id, missing=(404,) if action == 'delete' else (403, 404))
+            except Exception as e:
+                print(f"Error Failed to fetch activity {object_id}: {e}")
+                fail(event_ids, e)
+                continue
+            if detail is None:
+                deleted_ids.append(object_id)
+            else:
+                if action == 'delete':
+                    print(f"Warning  Activity {object_id} still exists; ignoring its delete event")
+                details.append(detail)
+            applied.extend(event_ids)
+
+        if details or deleted_ids:
+            try:
+                self.sync.apply_activity_changes(details, deleted_ids)
+            except Exception as e:
+                print(f"Error Failed to apply webhook changes: {e}")
+                fail(applied, e)
+                applied = []
+
+        complete(done + applied)
+        self.queue.prune()
+        print(f"Sync Webhook batch: {len(details)} updated, {len(deleted_ids)} deleted, "
+              f"{len(claimed)} objects from {sum(len(c[3]) for c in claimed)} events")
+
+    def run_forever(self, poll_seconds=POLL_SECONDS, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error Webhook worker: {e}")
+            stop.wait(poll_seconds)
+
+
+def make_worker(queue_path, settle_seconds):
+    sync = StravaSync()
+    if not getattr(sync, 'client_id', None):
+        return None
+    queue = EventQueue(queue_path)
+    recovered = queue.recover()
+    if recovered:
+        print(f"Sync Re-queued {recovered} events left in progress")
+    subscription_id = os.getenv('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+    athlete_id = os.getenv('STRAVA_ATHLETE_ID')
+    return EventWorker(sync, queue, settle_seconds,
+                       subscription_ids={int(subscription_id)} if subscription_id else None,
+                       athlete_ids={int(athlete_id)} if athlete_id else None)
+
+
+def serve(args):
+    verify_token = os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    if not verify_token:
+        print("Error STRAVA_WEBHOOK_VERIFY_TOKEN is not set")
+        return False
+    stop = threading.Event()
+
+    def work():
+        # The worker's queue connection belongs to this thread
+        worker = make_worker(args.queue, args.settle)
+        if worker is None:
+            print("Warning  Strava credentials not configured, events will only be queued")
+            return
+        worker.run_forever(args.poll, stop)
+
+    server = WebhookServer((args.host, args.port), args.queue, verify_token, args.path)
+    threading.Thread(target=work, daemon=True).start()
+    print(f"Sync Listening on http://{args.host}:{server.server_address[1]}{args.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    return True
+
+
+def drain(args):
+    worker = make_worker(args.queue, args.settle)
+    if worker is None:
+        print("Warning  Strava credentials not configured, skipping drain")
+        return False
+    while worker.run_once():
+        pass
+    print(f"Stats Queue: {worker.queue.counts()}")
+    worker.queue.close()
+    return True
+
+
+def send(args):
+    """Post a hand-made event, standing in for Strava"""
+    event = {
+        'object_type': args.object_type,
+        'object_id': args.id,
+        'aspect_type': args.aspect,
+        'owner_id': args.owner,
+        'subscription_id': args.subscription_id,
+        'event_time': int(time.time()),
+        'updates': json.loads(args.updates) if args.updates else {},
+    }
+    response = HttpClient(max_retries=0).post(args.url, json=event)
+    print(f"OK Sent {args.aspect} {args.object_type} {args.id}: {response.text}")
+    return True
+
+
+def subscribe(args):
+    """Register the callback URL with Strava (one subscription per application)"""
+    verify_token = os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    if not all([os.getenv('STRAVA_CLIENT_ID'), os.getenv('STRAVA_CLIENT_SECRET'), verify_token]):
+        print("Error STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET and STRAVA_WEBHOOK_VERIFY_TOKEN are required")
+        return False
+    try:
+        response = HttpClient(max_retries=0).post(f'{STRAVA_API_BASE}/push_subscriptions', data={
+            'client_id': os.getenv('STRAVA_CLIENT_ID'),
+            'client_secret': os.getenv('STRAVA_CLIENT_SECRET'),
+            'callback_url': args.callback_url,
+            'verify_token': verify_token,
+        })
+    except HttpError as e:
+        print(f"Error Subscription failed: {e}")
+        return False
+    subscription = response.json()
+    print(f"OK Subscribed: {subscription}")
+    print(f"   Set STRAVA_WEBHOOK_SUBSCRIPTION_ID={subscription.get('id')} to skip looking it up")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Strava webhook receiver and event worker')
+    parser.add_argument('--queue', type=Path, default=DEFAULT_QUEUE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='receive events and process them in the background')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8788)
+    serve_parser.add_argument('--path', default='/webhook')
+    serve_parser.add_argument('--settle', type=float, default=SETTLE_SECONDS)
+    serve_parser.add_argument('--poll', type=float, default=POLL_SECONDS)
+    serve_parser.set_defaults(handler=serve)
+
+    drain_parser = commands.add_parser('drain', help='process settled events once and exit')
+    drain_parser.add_argument('--settle', type=float, default=0)
+    drain_parser.set_defaults(handler=drain)
+
+    send_parser = commands.add_parser('send', help='post a test event to a receiver')
+    send_parser.add_argument('--url', default='http://127.0.0.1:8788/webhook')
+    send_parser.add_argument('--id', type=int, required=True)
+    send_parser.add_argument('--aspect', choices=ASPECT_TYPES, default='create')
+    send_parser.add_argument('--object-type', choices=OBJECT_TYPES, default='activity')
+    # The ids fake_services.py answers /athlete and /push_subscriptions with
+    send_parser.add_argument('--owner', type=int, default=1)
+    send_parser.add_argument('--subscription-id', type=int, default=1)
+    send_parser.add_argument('--updates', help='JSON object, e.g. \'{"title": "Lunch Run"}\'')
+    send_parser.set_defaults(handler=send)
+
+    subscribe_parser = commands.add_parser('subscribe', help='register the callback URL with Strava')
+    subscribe_parser.add_argument('--callback-url', required=True)
+    subscribe_parser.set_defaults(handler=subscribe)
+
+    args = parser.parse_args()
+    if not args.handler(args):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Per-run instrumentation for the sync pipeline
+
+SyncMetrics times named stages and, when handed to HttpClient, counts
+requests, response bytes, errors and time per endpoint and keeps the last
+Strava rate-limit usage it saw. A run is persisted as one sync_logs row
+(api_calls_made, rate_limit_remaining and a compact summary in
+sync_params) plus a JSON trace file; later workflow steps such as map
+generation merge their own stages into that trace and row.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from rate_limit import parse_rate_limit_pair
+
+DEFAULT_TRACE_FILE = Path('../apps/web/data/sync-trace.json')
+
+# Later steps only merge into a trace from the same workflow run
+TRACE_MERGE_WINDOW = timedelta(hours=6)
+
+# Path segments that vary per request: ids, tile coordinates, sizes
+NUMERIC_SEGMENT = re.compile(r'^[\d.,x-]+(@\dx)?$')
+
+
+def endpoint_label(method, url):
+    """'GET /activities/{id}/streams' style label for a request URL
+
+    Numeric segments become {id} and overlay segments (Mapbox static map
+    paths and markers) become {...}, so labels stay few.
+    """
+    segments = []
+    for segment in urlsplit(url).path.split('/'):
+        if segment and NUMERIC_SEGMENT.match(segment):
+            segment = '{id}'
+        elif '(' in segment or len(segment) > 64:
+            segment = '{...}'
+        segments.append(segment)
+    return f"{method} {'/'.join(segments)}"
+
+
+class SyncMetrics:
+    """Thread-safe stage timings, endpoint counters and rate-limit usage"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = {}
+        self.endpoints = {}
+        self.rate_limit = None
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block; repeated stages accumulate"""
+        started = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - started
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def record_request(self, method, url, seconds, response=None):
+        """Count one HTTP attempt; response is None for connection failures"""
+        label = endpoint_label(method, url)
+        with self.lock:
+            counters = self.endpoints.setdefault(
+                label, {'requests': 0, 'bytes': 0, 'errors': 0, 'seconds': 0.0})
+            counters['requests'] += 1
+            counters['seconds'] += seconds
+            if response is None or response.status_code >= 400:
+                counters['errors'] += 1
+            if response is not None:
+                counters['bytes'] += len(response.content)
+                self.capture_rate_limit(response.headers)
+
+    def capture_rate_limit(self, headers):
+        """Keep the latest X-RateLimit-* usage (lock held)"""
+        limits = parse_rate_limit_pair(
+            headers.get('X-ReadRateLimit-Limit') or headers.get('X-RateLimit-Limit'))
+        usage = parse_rate_limit_pair(
+            headers.get('X-ReadRateLimit-Usage') or headers.get('X-RateLimit-Usage'))
+        if limits and usage:
+            self.rate_limit = {'limit': list(limits), 'usage': list(usage)}
+
+    @property
+    def api_calls(self):
+        with self.lock:
+            return sum(c['requests'] for c in self.endpoints.values())
+
+    @property
+    def rate_limit_remaining(self):
+        """Requests left in the tighter of the 15-minute and daily windows"""
+        with self.lock:
+            if not self.rate_limit:
+                return None
+            return min(limit - used for limit, used in zip(self.rate_limit['limit'], self.rate_limit['usage']))
+
+    def summary(self):
+        """Compact per-run figures for the sync_logs row"""
+        with self.lock:
+            return {
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'requests': {label: c['requests'] for label, c in self.endpoints.items()},
+                'bytes': sum(c['bytes'] for c in self.endpoints.values()),
+                'rate_limit': self.rate_limit,
+            }
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'duration_seconds': round(self.clock() - self.started, 3),
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'endpoints': {
+                    label: dict(c, seconds=round(c['seconds'], 3)) for label, c in self.endpoints.items()
+                },
+                'rate_limit': self.rate_limit,
+            }
+
+    def print_summary(self):
+        for name, seconds in self.summary()['stages'].items():
+            print(f"Stats Stage {name:<16} {seconds:>8.2f}s")
+        for label, counters in sorted(self.to_dict()['endpoints'].items()):
+            print(f"Stats {label:<40} {counters['requests']:>5} requests "
+                  f"{counters['bytes'] / 1024:>9.1f} KB {counters['errors']:>3} errors")
+
+
+def write_trace(trace, path=DEFAULT_TRACE_FILE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(trace, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_trace(path=DEFAULT_TRACE_FILE):
+    """The last run's trace, or None if missing or unreadable"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_into_trace(metrics, path=DEFAULT_TRACE_FILE):
+    """Add a later step's stages and endpoints to the latest sync trace
+
+    Returns the updated trace, or None when there is no trace from the
+    last TRACE_MERGE_WINDOW (e.g. the sync step was skipped).
+    """
+    trace = load_trace(path)
+    if not trace or 'started_at' not in trace:
+        return None
+    if datetime.now(timezone.utc) - datetime.fromisoformat(trace['started_at']) > TRACE_MERGE_WINDOW:
+        return None
+
+    step = metrics.to_dict()
+    trace.setdefault('stages', {}).update(step['stages'])
+    endpoints = trace.setdefault('endpoints', {})
+    for label, counters in step['endpoints'].items():
+        if label in endpoints:
+            for key, value in counters.items():
+                endpoints[label][key] = endpoints[label].get(key, 0) + value
+        else:
+            endpoints[label] = counters
+    write_trace(trace, path)
+    return trace
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Multi-athlete Strava sync scheduler
+
+Syncs every active auto-sync Strava connection in data_source_settings,
+least recently synced first, several athletes at a time. Each athlete
+has its own token refresh, incremental cursor, datasets and detail cache.
+Strava's rate limits apply to the whole application, so all athletes draw
+from one StravaRateLimiter, taken in turn through a FairShareLimiter.
+Writes to the shared database are serialized. Wall time therefore grows
+with the application's request budget, not with the sum of the
+per-athlete runtimes.
+
+Athlete 1 keeps the single-athlete paths (apps/web/data, .cache) and
+STRAVA_REFRESH_TOKEN. Other athletes live under apps/web/data/athletes/{id}
+and .cache/athletes/{id}. Refresh tokens are looked up in the token store
+(.secrets/strava-tokens.json, or STRAVA_TOKEN_STORE), then (athlete 1 only)
+in STRAVA_REFRESH_TOKEN, then in data_source_settings. Access tokens and
+rotated refresh tokens are kept in the token store only (through
+scripts/strava_auth.py), never in the committed database.
+
+Usage: cd scripts && python sync_scheduler.py [--workers 4] [--users 1,2,3]
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from activity_db import ActivityDatabase
+from rate_limit import FairShareLimiter, StravaRateLimiter
+from strava_auth import DEFAULT_TOKEN_STORE, TokenStore
+from sync_strava import DEFAULT_CACHE_DIR, DEFAULT_DATA_DIR, StravaSync
+
+DEFAULT_DB = DEFAULT_DATA_DIR / 'running_page_2.db'
+
+
+def athlete_dirs(user_id):
+    """(data_dir, cache_dir) for an athlete"""
+    if user_id == 1:
+        return DEFAULT_DATA_DIR, DEFAULT_CACHE_DIR
+    return DEFAULT_DATA_DIR / 'athletes' / str(user_id), DEFAULT_CACHE_DIR / 'athletes' / str(user_id)
+
+
+def load_athletes(db_path, token_store, only_users=None):
+    """[(user_id, refresh_token)] to sync, least recently synced first"""
+    db = ActivityDatabase(db_path)
+    try:
+        connections = db.sync_connections()
+    finally:
+        db.close()
+
+    athletes = []
+    for user_id, stored_token, _ in connections:
+        token = token_store.refresh_token(user_id)
+        if user_id == 1:
+            token = token or os.getenv('STRAVA_REFRESH_TOKEN')
+        token = token or stored_token
+        athletes.append((user_id, token))
+
+    # A fresh database has no connection rows yet; athlete 1 comes from the environment
+    if not any(user_id == 1 for user_id, _ in athletes) and os.getenv('STRAVA_REFRESH_TOKEN'):
+        athletes.insert(0, (1, token_store.refresh_token(1) or os.getenv('STRAVA_REFRESH_TOKEN')))
+
+    if only_users:
+        athletes = [a for a in athletes if a[0] in only_users]
+    return athletes
+
+
+def sync_athlete(user_id, refresh_token, db_path, limiter, db_lock, token_store):
+    """Run one athlete's sync; returns (ok, seconds, api_calls)"""
+    started = time.perf_counter()
+    data_dir, cache_dir = athlete_dirs(user_id)
+    sync = StravaSync(user_id=user_id, refresh_token=refresh_token, data_dir=data_dir,
+                      cache_dir=cache_dir, db_path=db_path,
+                      rate_limiter=limiter.client(user_id), db_lock=db_lock,
+                      token_store=token_store)
+    if not hasattr(sync, 'http'):
+        return False, 0.0, 0
+    ok = sync.run()
+    return ok, time.perf_counter() - started, sync.metrics.api_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync every connected Strava athlete')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SYNC_ATHLETE_WORKERS', '4')),
+                        help='athletes synced at the same time')
+    parser.add_argument('--users', help='comma-separated user ids to sync (default: all active)')
+    parser.add_argument('--db', type=Path, default=DEFAULT_DB)
+    parser.add_argument('--token-store', type=Path, default=DEFAULT_TOKEN_STORE)
+    args = parser.parse_args()
+
+    if not (os.getenv('STRAVA_CLIENT_ID') and os.getenv('STRAVA_CLIENT_SECRET')):
+        print("Warning  Strava credentials not configured, skipping sync")
+        return
+
+    token_store = TokenStore(args.token_store)
+    only_users = {int(u) for u in args.users.split(',')} if args.users else None
+    athletes = load_athletes(args.db, token_store, only_users)
+    missing = [user_id for user_id, token in athletes if not token]
+    for user_id in missing:
+        print(f"Warning  No refresh token for user {user_id}, skipping")
+    athletes = [(user_id, token) for user_id, token in athletes if token]
+    if not athletes:
+        print("Warning  No athletes to sync")
+        return
+
+    print(f"Sync Syncing {len(athletes)} athletes, {args.workers} at a time "
+          f"(order: {', '.join(str(user_id) for user_id, _ in athletes)})")
+    limiter = FairShareLimiter(StravaRateLimiter())
+    db_lock = threading.Lock()
+    started = time.perf_counter()
+    failed = []
+    serial_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(sync_athlete, user_id, token, args.db, limiter, db_lock, token_store): user_id
+            for user_id, token in athletes
+        }
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                ok, seconds, api_calls = future.result()
+            except Exception as e:
+                print(f"Error Sync for user {user_id} crashed: {e}")
+                failed.append(user_id)
+                continue
+            serial_seconds += seconds
+            if not ok:
+                failed.append(user_id)
+            print(f"{'OK' if ok else 'Error'} User {user_id}: {seconds:.1f}s, {api_calls} API calls")
+
+    elapsed = time.perf_counter() - started
+    print(f"Stats {len(athletes)} athletes in {elapsed:.1f}s wall time "
+          f"({serial_seconds:.1f}s summed per-athlete time), {len(failed)} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
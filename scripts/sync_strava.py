@@ -2,142 +2,717 @@
 """
 Strava Data Sync Script for GitHub Actions
 Fetches activities from Strava API and saves to JSON files
+
+Recent activities also get their per-sample streams (GPS, heart rate,
+cadence, ...) stored in the activity_data_points table.
+
+Each run is timed per stage, with request counts and the last Strava
+rate-limit usage; the figures land in its sync_logs row and in
+apps/web/data/sync-trace.json (scripts/sync_metrics.py).
+
+Runs incrementally by default: a sync-state file records the newest
+start_date and the activity ids already seen, and only activities after
+that high-water mark are requested. Set FORCE_FULL_SYNC=true to re-page
+the whole history.
+
+STRAVA_BACKFILL=true starts a checkpointed backfill instead: the whole
+history is paged and every activity's detail fetched, at most
+STRAVA_BACKFILL_BUDGET details per run. Progress is kept in
+.cache/backfill/ (scripts/backfill.py), and later runs resume it until it
+is done.
 """
 
 import os
 import json
-import requests
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from activity_db import ActivityDatabase, UpsertResult
+from activity_segments import SEGMENT_COLUMNS, segment_rows
+from activity_streams import DATA_POINT_COLUMNS, STREAM_KEYS, stream_rows
+from activity_store import (
+    JsonLinesWriter, dataset_path, find_dataset, iter_records, merge_records, remove_other_formats,
+)
+from backfill import MAX_DETAIL_ATTEMPTS, BackfillCheckpoint
+from detail_cache import DetailCache, summary_fingerprint
+from http_client import HttpClient, HttpError, PermanentHttpError
+from rate_limit import RateLimitExhausted, StravaRateLimiter
+from strava_auth import TokenBroker
+from sync_metrics import DEFAULT_TRACE_FILE, SyncMetrics, write_trace
+
+STRAVA_API_BASE = os.getenv('STRAVA_API_BASE', 'https://www.strava.com/api/v3')
+
+# Re-request a few days before the high-water mark so activities uploaded
+# late (watch synced days after the run) are still picked up.
+INCREMENTAL_LOOKBACK = timedelta(days=7)
+
+# Give up on a request instead of sleeping into the next quota window.
+MAX_RATE_LIMIT_WAIT = 15 * 60
+
+# Save backfill progress after this many details
+BACKFILL_CHECKPOINT_EVERY = 25
+
+# Detail payload keys that /athlete/activities summaries do not carry
+DETAIL_ONLY_KEYS = (
+    'segment_efforts', 'splits_metric', 'splits_standard', 'laps', 'best_efforts',
+    'photos', 'similar_activities', 'available_zones', 'description',
+)
+
+
+DEFAULT_DATA_DIR = Path('../apps/web/data')
+DEFAULT_CACHE_DIR = Path('../.cache')
+
+
+def parse_start_date(value):
+    """Parse a Strava ISO-8601 start_date into an aware datetime"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
 class StravaSync:
-    def __init__(self):
+    """Sync of one athlete; defaults to the env-configured athlete 1
+
+    The multi-athlete scheduler (scripts/sync_scheduler.py) passes each
+    athlete's refresh token and directories, a shared rate limiter, a
+    lock serializing writes to the shared database and its token store.
+    """
+
+    def __init__(self, user_id=1, refresh_token=None, data_dir=DEFAULT_DATA_DIR,
+                 cache_dir=DEFAULT_CACHE_DIR, db_path=None, rate_limiter=None, db_lock=None,
+                 token_store=None):
         self.client_id = os.getenv('STRAVA_CLIENT_ID')
         self.client_secret = os.getenv('STRAVA_CLIENT_SECRET')
-        self.refresh_token = os.getenv('STRAVA_REFRESH_TOKEN')
+        self.refresh_token = refresh_token or os.getenv('STRAVA_REFRESH_TOKEN')
         
         if not all([self.client_id, self.client_secret, self.refresh_token]):
             print("Warning  Missing Strava credentials, skipping sync")
             return
             
+        self.user_id = user_id
         self.access_token = None
-        self.data_dir = Path('../apps/web/data')
-        self.data_dir.mkdir(exist_ok=True)
-        
-    def refresh_access_token(self):
-        """Refresh Strava access token"""
-        url = 'https://www.strava.com/oauth/token'
-        data = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'refresh_token': self.refresh_token,
-            'grant_type': 'refresh_token'
-        }
+        self.token_expires_at = None
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        cache_dir = Path(cache_dir)
+        self.state_file = self.data_dir / 'strava_sync_state.json'
+        self.trace_file = self.data_dir / DEFAULT_TRACE_FILE.name
+        self.force_full_sync = os.getenv('FORCE_FULL_SYNC', 'false').lower() == 'true'
+        self.db_path = Path(db_path) if db_path else DEFAULT_DATA_DIR / 'running_page_2.db'
+        self.db_lock = db_lock or threading.Lock()
+        self.detail_workers = int(os.getenv('STRAVA_DETAIL_WORKERS', '8'))
+        self.rate_limiter = rate_limiter or StravaRateLimiter()
+        self.metrics = SyncMetrics()
+        self.http = HttpClient(
+            pool_size=max(4, self.detail_workers),
+            rate_limiter=self.rate_limiter,
+            rate_limit_max_wait=MAX_RATE_LIMIT_WAIT,
+            metrics=self.metrics,
+        )
+        # Access tokens are cached in the token store (scripts/strava_auth.py)
+        self.token_broker = TokenBroker(
+            self.client_id, self.client_secret, self.refresh_token,
+            user_id=user_id, store=token_store, http=self.http,
+        )
+        # 'jsonl' or 'jsonl.gz'
+        self.output_format = os.getenv('STRAVA_OUTPUT_FORMAT', 'jsonl')
+        # Days of history to keep detailed; 0 means the whole history (backfill)
+        self.detail_days = int(os.getenv('STRAVA_DETAIL_DAYS', '30'))
+        self.detail_cache = DetailCache(
+            cache_dir / 'strava-details',
+            max_entries=int(os.getenv('STRAVA_DETAIL_CACHE_MAX', '5000')),
+        )
+        # Most activities to fetch streams for per run; 0 disables the stage
+        self.streams_limit = int(os.getenv('STRAVA_STREAMS_LIMIT', '200'))
+        # Checkpointed whole-history backfill; an unfinished one resumes on every run
+        self.backfill = os.getenv('STRAVA_BACKFILL', 'false').lower() == 'true'
+        self.backfill_budget = int(os.getenv('STRAVA_BACKFILL_BUDGET', '500'))
+        self.backfill_checkpoint = BackfillCheckpoint(cache_dir / 'backfill')
         
+    def refresh_access_token(self, force=False):
+        """Get an access token, reusing the cached one until it nears expiry"""
         try:
-            response = requests.post(url, data=data)
-            response.raise_for_status()
-            token_data = response.json()
-            self.access_token = token_data['access_token']
-            print("OK Access token refreshed")
-            return True
+            self.access_token = self.token_broker.access_token(force=force)
         except Exception as e:
             print(f"Error Failed to refresh token: {e}")
             return False
+        # Strava may rotate the refresh token; the broker has already persisted it
+        self.refresh_token = self.token_broker.refresh_token
+        self.token_expires_at = self.token_broker.expires_at
+        if self.token_broker.refreshed:
+            print("OK Access token refreshed")
+        else:
+            expires = datetime.fromtimestamp(self.token_expires_at, timezone.utc).isoformat()
+            print(f"OK Reusing cached access token (expires {expires})")
+        return True
     
-    def get_activities(self, page=1, per_page=200):
-        """Fetch activities from Strava API"""
+    def get_activities(self, page=1, per_page=200, after=None, before=None):
+        """Fetch one page of activities from Strava API
+
+        Raises HttpError when the page cannot be fetched, so a failure is
+        never mistaken for the end of the activity history.
+        """
         if not self.access_token:
             return []
             
-        url = 'https://www.strava.com/api/v3/athlete/activities'
+        url = f'{STRAVA_API_BASE}/athlete/activities'
         headers = {'Authorization': f'Bearer {self.access_token}'}
         params = {
             'page': page,
             'per_page': per_page
         }
+        if after is not None:
+            params['after'] = int(after)
+        if before is not None:
+            params['before'] = int(before)
         
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            print(f"Error Failed to fetch activities: {e}")
-            return []
+        response = self.http.get(url, headers=headers, params=params)
+        return response.json()
     
-    def get_activity_detail(self, activity_id):
-        """Fetch detailed activity data"""
+    def get_activity_detail(self, activity_id, raise_errors=False):
+        """Fetch detailed activity data
+
+        Returns None when the fetch fails, or raises the HttpError with
+        raise_errors so the caller can tell a missing activity from a
+        transient failure.
+        """
         if not self.access_token:
             return None
             
-        url = f'https://www.strava.com/api/v3/activities/{activity_id}'
+        url = f'{STRAVA_API_BASE}/activities/{activity_id}'
         headers = {'Authorization': f'Bearer {self.access_token}'}
         
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            response = self.http.get(url, headers=headers)
             return response.json()
-        except Exception as e:
+        except HttpError as e:
+            if raise_errors:
+                raise
+            # Skipped details are not cached, so the next run retries them
             print(f"Error Failed to fetch activity {activity_id}: {e}")
             return None
     
-    def sync_all_activities(self):
-        """Sync all activities from Strava"""
-        if not self.refresh_access_token():
-            return False
-            
-        print("Sync Starting Strava data sync...")
-        
-        all_activities = []
+    def get_activity_streams(self, activity_id):
+        """Fetch an activity's streams keyed by type
+
+        Returns {} when Strava has none for it (manual entries, deleted or
+        private activities) and None when the fetch failed and is worth
+        retrying.
+        """
+        if not self.access_token:
+            return None
+
+        url = f'{STRAVA_API_BASE}/activities/{activity_id}/streams'
+        headers = {'Authorization': f'Bearer {self.access_token}'}
+        params = {'keys': ','.join(STREAM_KEYS), 'key_by_type': 'true'}
+
+        try:
+            response = self.http.get(url, headers=headers, params=params)
+            return response.json()
+        except PermanentHttpError as e:
+            if e.status_code in (403, 404):
+                return {}
+            print(f"Error Failed to fetch streams for {activity_id}: {e}")
+            return None
+        except HttpError as e:
+            print(f"Error Failed to fetch streams for {activity_id}: {e}")
+            return None
+
+    def load_sync_state(self):
+        """Load the incremental sync high-water mark"""
+        if not self.state_file.exists():
+            return None
+
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning  Ignoring unreadable sync state: {e}")
+            return None
+
+    def save_sync_state(self, latest_start_date, activity_ids):
+        """Persist the newest start_date and the ids already seen"""
+        state = {
+            'latest_start_date': latest_start_date,
+            'activity_ids': sorted(activity_ids),
+            'last_sync_at': datetime.now(timezone.utc).isoformat(),
+        }
+        with open(self.state_file, 'w') as f:
+            json.dump(state, f)
+
+    def iter_activity_pages(self, after=None):
+        """Yield pages of /athlete/activities, optionally only after an epoch"""
         page = 1
-        
+
         while True:
             print(f"File Fetching page {page}...")
-            activities = self.get_activities(page=page)
-            
+            activities = self.get_activities(page=page, after=after)
+
             if not activities:
                 break
-                
-            all_activities.extend(activities)
+
+            yield activities
             page += 1
-            
-            # Rate limiting
-            time.sleep(0.5)
-            
+
             # Strava API returns max 200 per page
             if len(activities) < 200:
                 break
-        
-        print(f"Stats Found {len(all_activities)} activities")
-        
-        # Save activities summary
-        activities_file = self.data_dir / 'strava_activities.json'
-        with open(activities_file, 'w') as f:
-            json.dump(all_activities, f, indent=2)
-        
+
+    def get_cached_activity_detail(self, activity, raise_errors=False):
+        """Return the cached detail, fetching only if the summary changed"""
+        fingerprint = summary_fingerprint(activity)
+        detail = self.detail_cache.get(activity['id'], fingerprint)
+        if detail is not None:
+            return detail
+
+        print(f"List Fetching details for: {activity['name']}")
+        detail = self.get_activity_detail(activity['id'], raise_errors=raise_errors)
+        if detail:
+            self.detail_cache.put(activity['id'], fingerprint, detail)
+        return detail
+
+    def iter_activity_details(self, activities):
+        """Yield details in input order, fetched concurrently under the rate limiter"""
+        with ThreadPoolExecutor(max_workers=self.detail_workers) as executor:
+            futures = [executor.submit(self.get_cached_activity_detail, a) for a in activities]
+            try:
+                for index, future in enumerate(futures):
+                    futures[index] = None
+                    detail = future.result()
+                    if detail:
+                        yield detail
+            except RateLimitExhausted as e:
+                print(f"Warning  Stopping detail fetch: {e}")
+                for pending in futures:
+                    if pending:
+                        pending.cancel()
+            finally:
+                self.detail_cache.save()
+
+        print(f"Stats Detail cache: {self.detail_cache.hits} hits, {self.detail_cache.misses} misses")
+
+    def write_database(self, activities, detailed_file, only_ids=None, deleted_ids=()):
+        """Upsert activities into SQLite, preferring detail payloads over summaries"""
+        details = {}
+        if detailed_file.exists():
+            details = {
+                d['id']: d for d in iter_records(detailed_file)
+                if only_ids is None or d['id'] in only_ids
+            }
+
+        with self.db_lock:
+            db = ActivityDatabase(self.db_path)
+            try:
+                result = db.upsert_activities((details.get(a['id'], a) for a in activities),
+                                              user_id=self.user_id)
+                if deleted_ids:
+                    db.delete_activities(deleted_ids, result)
+                segment_count = self.write_segments(db, details.values())
+                refreshed = db.refresh_rollups()
+                geometry_count = db.refresh_geometry()
+                heatmap_added, heatmap_rebuilt = db.refresh_heatmap()
+                spatial_count, _ = db.refresh_spatial_index()
+                routes_matched, routes_created = db.refresh_route_clusters()
+            finally:
+                db.close()
+
+        print(f"Save Database: {result.created} created, {result.updated} updated, "
+              f"{result.unchanged} unchanged, {result.deleted} deleted, {segment_count} segments")
+        if refreshed is None:
+            print("Stats Rebuilt stats rollups")
+        else:
+            print(f"Stats Refreshed {refreshed} stats rollup buckets")
+        print(f"Route Computed geometry for {geometry_count} routes")
+        print(f"Route {'Rebuilt heatmap from' if heatmap_rebuilt else 'Added to heatmap:'} {heatmap_added} routes")
+        print(f"Route Spatial index updated for {spatial_count} activities")
+        print(f"Route Matched {routes_matched} routes to known routes, {routes_created} new routes")
+        return result
+
+    def write_segments(self, db, details):
+        """Replace activity_segments for the given detail payloads"""
+        details = list(details)
+        row_ids = db.activity_row_ids(str(d['id']) for d in details)
+        rows = []
+        for detail in details:
+            row_id = row_ids.get(str(detail['id']))
+            if row_id is not None:
+                rows.extend(segment_rows(row_id, detail))
+        db.replace_segments(row_ids.values(), rows, SEGMENT_COLUMNS)
+        return len(rows)
+
+    def sync_streams(self, activities):
+        """Store streams for activities that have no data points yet"""
+        if self.streams_limit <= 0:
+            return 0
+
+        db = ActivityDatabase(self.db_path)
+        stored = 0
+        empty = []
+        try:
+            candidates = db.activities_missing_streams([str(a['id']) for a in activities])
+            candidates = candidates[:self.streams_limit]
+            if not candidates:
+                return 0
+
+            print(f"Route Fetching streams for {len(candidates)} activities")
+            # Fetch concurrently; inserts stay on this thread's connection
+            with ThreadPoolExecutor(max_workers=self.detail_workers) as executor:
+                futures = {
+                    executor.submit(self.get_activity_streams, external_id): (row_id, start_date)
+                    for row_id, external_id, start_date in candidates
+                }
+                try:
+                    for future in as_completed(futures):
+                        streams = future.result()
+                        if streams is None:
+                            continue
+                        row_id, start_date = futures[future]
+                        rows = stream_rows(row_id, parse_start_date(start_date), streams) if streams else []
+                        if rows:
+                            with self.db_lock:
+                                db.replace_data_points(row_id, rows, DATA_POINT_COLUMNS)
+                            stored += 1
+                        else:
+                            empty.append(row_id)
+                except RateLimitExhausted as e:
+                    print(f"Warning  Stopping stream fetch: {e}")
+                    for pending in futures:
+                        pending.cancel()
+            if empty:
+                # Skipped on later runs, so they stop costing quota every time
+                with self.db_lock:
+                    db.mark_streams_checked(empty)
+        finally:
+            db.close()
+
+        print(f"Save Stored streams for {stored} activities"
+              + (f", {len(empty)} have none" if empty else ""))
+        return stored
+
+    def reset_metrics(self):
+        """Start a fresh SyncMetrics, e.g. per webhook batch in a long-lived worker"""
+        self.metrics = SyncMetrics()
+        self.http.metrics = self.metrics
+
+    def apply_activity_changes(self, details, deleted_ids=()):
+        """Fold fetched details and deleted ids into the datasets and database
+
+        Lets the webhook worker (scripts/strava_webhook.py) apply a few
+        changed activities without re-paging the history.
+        """
+        started_at = datetime.now(timezone.utc)
+        details = list(details)
+        deleted_ids = {int(i) for i in deleted_ids}
+
+        for name, records in (
+            ('strava_activities', [{k: v for k, v in d.items() if k not in DETAIL_ONLY_KEYS} for d in details]),
+            ('strava_detailed', details),
+        ):
+            target = dataset_path(self.data_dir, name, self.output_format)
+            merge_records(find_dataset(self.data_dir, name), target, records, deleted_ids)
+            remove_other_formats(self.data_dir, name, keep=target)
+
+        for detail in details:
+            self.detail_cache.put(detail['id'], summary_fingerprint(detail), detail)
+        self.detail_cache.save()
+
+        # Only advance an existing high-water mark; without one the next run is a full sync anyway
+        state = self.load_sync_state()
+        if state and state.get('latest_start_date'):
+            activity_ids = (set(state.get('activity_ids', [])) | {d['id'] for d in details}) - deleted_ids
+            latest = max([state['latest_start_date']] + [d['start_date'] for d in details],
+                         key=parse_start_date)
+            self.save_sync_state(latest, activity_ids)
+
+        detailed_file = dataset_path(self.data_dir, 'strava_detailed', self.output_format)
+        with self.metrics.stage('database_write'):
+            result = self.write_database(details, detailed_file, only_ids={d['id'] for d in details},
+                                         deleted_ids=[str(i) for i in deleted_ids])
+        self.finish_run('webhook', 'success', result, started_at)
+        return result
+
+    def run_params(self):
+        return {
+            'force_full_sync': self.force_full_sync,
+            'detail_days': self.detail_days,
+            'detail_workers': self.detail_workers,
+            'streams_limit': self.streams_limit,
+            'output_format': self.output_format,
+        }
+
+    def finish_run(self, sync_type, status, result, started_at, error=None, params=None):
+        """Log the run with its metrics to sync_logs and the trace file"""
+        params = dict(self.run_params(), **(params or {}))
+        with self.db_lock:
+            db = ActivityDatabase(self.db_path)
+            try:
+                log_id = db.record_sync(sync_type, status, result, started_at,
+                                        error_message=str(error) if error else None,
+                                        user_id=self.user_id, metrics=self.metrics, params=params)
+            finally:
+                db.close()
+
+        trace = self.metrics.to_dict()
+        trace.update({
+            'sync_log_id': log_id,
+            'sync_type': sync_type,
+            'status': status,
+            'params': params,
+            'result': {'processed': result.processed, 'created': result.created,
+                       'updated': result.updated, 'unchanged': result.unchanged},
+        })
+        write_trace(trace, self.trace_file)
+        self.metrics.print_summary()
+        print(f"Stats {self.metrics.api_calls} API calls, "
+              f"rate limit remaining: {self.metrics.rate_limit_remaining}")
+
+    def record_failure(self, sync_type, started_at, error):
+        """Log a failed run to sync_logs"""
+        self.finish_run(sync_type, 'error', UpsertResult(), started_at, error)
+
+    def backfill_pages(self, checkpoint):
+        """Page the history before the backfill anchor, checkpointing each page"""
+        state = checkpoint.state
+        while True:
+            page = state['next_page']
+            print(f"File Fetching backfill page {page}...")
+            activities = self.get_activities(page=page, before=state['before'])
+            if activities:
+                checkpoint.append_page(activities, page + 1)
+            # Strava API returns max 200 per page
+            if len(activities) < 200:
+                return
+
+    def backfill_details(self, checkpoint, activities_by_id):
+        """Fetch up to backfill_budget pending details; returns the ids stored
+
+        Only a 403/404 counts towards giving up on an activity. Transient
+        failures (429s and 5xx that outlast the retries, expired tokens)
+        are retried on the next run without using up attempts, and a spent
+        rate limit window stops the run with the rest left pending.
+        """
+        pending = [i for i in checkpoint.pending_ids() if i in activities_by_id]
+        batch = pending[:self.backfill_budget]
+        stored = []
+        retry = []
+        handled = 0
+        last_id = checkpoint.state.get('last_detail_id')
+        appender = checkpoint.details_appender()
+        try:
+            with ThreadPoolExecutor(max_workers=self.detail_workers) as executor:
+                futures = [executor.submit(self.get_cached_activity_detail, activities_by_id[i], True)
+                           for i in batch]
+                try:
+                    for index, future in enumerate(futures):
+                        futures[index] = None
+                        activity_id = batch[index]
+                        given_up = False
+                        try:
+                            detail = future.result()
+                        except HttpError as e:
+                            print(f"Error Failed to fetch activity {activity_id}: {e}")
+                            detail = None
+                            # Only an activity Strava refuses or lacks uses up an attempt
+                            permanent = isinstance(e, PermanentHttpError) and e.status_code in (403, 404)
+                            if permanent and checkpoint.record_failure(activity_id):
+                                print(f"Warning  Giving up on details for {activity_id}")
+                                given_up = True
+                        if detail:
+                            appender.write(detail)
+                            stored.append(activity_id)
+                        elif not given_up:
+                            retry.append(activity_id)
+                        handled, last_id = index + 1, activity_id
+                        if handled % BACKFILL_CHECKPOINT_EVERY == 0:
+                            checkpoint.mark_details(appender, last_id, pending[handled:] + retry)
+                except RateLimitExhausted as e:
+                    print(f"Warning  Stopping backfill detail fetch: {e}")
+                    for future in futures:
+                        if future:
+                            future.cancel()
+        finally:
+            # Failed ids go to the back of the queue for the next run
+            checkpoint.mark_details(appender, last_id, pending[handled:] + retry)
+            appender.close()
+            self.detail_cache.save()
+        return stored
+
+    def finish_backfill(self, checkpoint, activities):
+        """Replace the datasets and sync state with the completed backfill"""
+        activities_file = dataset_path(self.data_dir, 'strava_activities', self.output_format)
+        with JsonLinesWriter(activities_file) as writer:
+            writer.write_many(activities)
+        remove_other_formats(self.data_dir, 'strava_activities', keep=activities_file)
+
+        detailed_file = dataset_path(self.data_dir, 'strava_detailed', self.output_format)
+        with JsonLinesWriter(detailed_file) as detail_writer:
+            detail_writer.write_many(checkpoint.iter_details())
+        remove_other_formats(self.data_dir, 'strava_detailed', keep=detailed_file)
+        print(f"Save Saved {writer.count} activities and {detail_writer.count} detailed activities")
+
+        self.save_sync_state(activities[0]['start_date'] if activities else None,
+                             [a['id'] for a in activities])
+        with self.metrics.stage('database_write'):
+            result = self.write_database(iter_records(activities_file), detailed_file)
+        checkpoint.clear()
+        return result
+
+    def run_backfill(self):
+        """Page and detail the whole history, resuming from the last checkpoint
+
+        Each run stores what it fetched in the database, so progress shows
+        before the backfill completes; the datasets and sync state are
+        replaced once every detail is in.
+        """
+        started_at = datetime.now(timezone.utc)
+        with self.metrics.stage('token_refresh'):
+            refreshed = self.refresh_access_token()
+        if not refreshed:
+            self.record_failure('backfill', started_at, 'token refresh failed')
+            return False
+
+        checkpoint = self.backfill_checkpoint
+        state = checkpoint.load()
+        if state is None:
+            state = checkpoint.start(started_at.timestamp())
+            print(f"Sync Starting backfill of activities before {started_at.isoformat()}")
+        else:
+            print(f"Sync Resuming backfill started {state['started_at']} ({state['phase']})")
+
+        paged_now = state['phase'] == 'paging'
+        if paged_now:
+            try:
+                with self.metrics.stage('paging'):
+                    self.backfill_pages(checkpoint)
+            except (HttpError, RateLimitExhausted) as e:
+                print(f"Error Backfill paging stopped at page {state['next_page']}: {e}")
+                self.record_failure('backfill', started_at, e)
+                return False
+
+        activities = checkpoint.activities()
+        activities_by_id = {a['id']: a for a in activities}
+        if paged_now:
+            print(f"Stats Paged {len(activities)} activities")
+            checkpoint.begin_details([a['id'] for a in activities])
+
+        with self.metrics.stage('detail_fetch'):
+            stored = self.backfill_details(checkpoint, activities_by_id)
+        pending = checkpoint.state['pending_ids']
+        progress = {'backfill': {
+            'fetched': len(stored),
+            'pending': len(pending),
+            'given_up': sum(1 for n in checkpoint.state['failed'].values() if n >= MAX_DETAIL_ATTEMPTS),
+        }}
+        print(f"Stats Backfill: {len(stored)} details fetched, {len(pending)} pending")
+
+        if pending:
+            # Summaries go in as soon as paging is done, details as they arrive
+            rows = activities if paged_now else [activities_by_id[i] for i in stored]
+            with self.metrics.stage('database_write'):
+                result = self.write_database(rows, checkpoint.details_file, only_ids=set(stored))
+        else:
+            result = self.finish_backfill(checkpoint, activities)
+            print("OK Backfill complete")
+
+        self.finish_run('backfill', 'success', result, started_at, params=progress)
+        return True
+
+    def run(self):
+        """Continue an unfinished backfill, otherwise run the normal sync"""
+        if self.backfill or self.backfill_checkpoint.exists():
+            return self.run_backfill()
+        return self.sync_all_activities()
+
+    def sync_all_activities(self):
+        """Sync all activities from Strava"""
+        started_at = datetime.now(timezone.utc)
+        with self.metrics.stage('token_refresh'):
+            refreshed = self.refresh_access_token()
+        if not refreshed:
+            self.record_failure(None, started_at, 'token refresh failed')
+            return False
+
+        print("Sync Starting Strava data sync...")
+
+        state = None if self.force_full_sync else self.load_sync_state()
+        existing_file = find_dataset(self.data_dir, 'strava_activities')
+        activities_file = dataset_path(self.data_dir, 'strava_activities', self.output_format)
+
+        # Track what the state file and detail stage need while streaming
+        activity_ids = []
+        recent = []
+        latest = [None, None]
+        cutoff_date = None
+        if self.detail_days > 0:
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=self.detail_days)
+
+        def write(writer, activity):
+            writer.write(activity)
+            activity_ids.append(activity['id'])
+            start = parse_start_date(activity['start_date'])
+            if latest[0] is None or start > latest[0]:
+                latest[:] = [start, activity['start_date']]
+            if cutoff_date is None or start > cutoff_date:
+                recent.append(activity)
+
+        incremental = bool(state and state.get('latest_start_date') and existing_file)
+        sync_type = 'incremental' if incremental else 'full'
+        fetched = None
+
+        try:
+            with self.metrics.stage('paging'), JsonLinesWriter(activities_file) as writer:
+                if incremental:
+                    seen_ids = set(state.get('activity_ids', []))
+                    after = parse_start_date(state['latest_start_date']) - INCREMENTAL_LOOKBACK
+                    print(f"Sync Incremental sync after {after.isoformat()}")
+                    fetched = [a for page in self.iter_activity_pages(after=after.timestamp()) for a in page]
+                    fetched.sort(key=lambda a: parse_start_date(a['start_date']), reverse=True)
+                    fetched_ids = {a['id'] for a in fetched}
+                    new_count = len(fetched_ids - seen_ids)
+                    print(f"Stats Fetched {len(fetched)} activities ({new_count} new)")
+
+                    # Everything newer than `after` was re-fetched, so fetched
+                    # records followed by the untouched history stay newest first
+                    for activity in fetched:
+                        write(writer, activity)
+                    for activity in iter_records(existing_file):
+                        if activity['id'] not in fetched_ids:
+                            write(writer, activity)
+                else:
+                    print("Sync Full sync of activity history")
+                    for page in self.iter_activity_pages():
+                        for activity in page:
+                            write(writer, activity)
+        except (HttpError, RateLimitExhausted) as e:
+            # Keep the previous dataset rather than writing a truncated one
+            print(f"Error Failed to fetch activities: {e}")
+            self.record_failure(sync_type, started_at, e)
+            return False
+
+        remove_other_formats(self.data_dir, 'strava_activities', keep=activities_file)
+        print(f"Stats Found {writer.count} activities")
         print(f"Save Saved activities to {activities_file}")
+        self.save_sync_state(latest[1], activity_ids)
         
-        # Fetch detailed data for recent activities (last 30 days)
-        recent_activities = []
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=30)
-        
-        for activity in all_activities:
-            activity_date = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
-            if activity_date > cutoff_date:
-                print(f"List Fetching details for: {activity['name']}")
-                detail = self.get_activity_detail(activity['id'])
-                if detail:
-                    recent_activities.append(detail)
-                time.sleep(0.5)  # Rate limiting
-        
-        # Save detailed activities
-        if recent_activities:
-            detailed_file = self.data_dir / 'strava_detailed.json'
-            with open(detailed_file, 'w') as f:
-                json.dump(recent_activities, f, indent=2)
-            print(f"Save Saved {len(recent_activities)} detailed activities")
+        # Fetch detailed data for recent activities (last 30 days by default)
+        detailed_file = dataset_path(self.data_dir, 'strava_detailed', self.output_format)
+        with self.metrics.stage('detail_fetch'), JsonLinesWriter(detailed_file) as detail_writer:
+            detail_writer.write_many(self.iter_activity_details(recent))
+        remove_other_formats(self.data_dir, 'strava_detailed', keep=detailed_file)
+        print(f"Save Saved {detail_writer.count} detailed activities")
         
+        # Incremental runs only touch the re-fetched window; full runs stream
+        # everything and let the upsert skip rows that did not change
+        with self.metrics.stage('database_write'):
+            if fetched is not None:
+                result = self.write_database(fetched, detailed_file, only_ids={a['id'] for a in fetched})
+            else:
+                result = self.write_database(iter_records(activities_file), detailed_file)
+
+        with self.metrics.stage('streams'):
+            self.sync_streams(recent)
+
+        self.finish_run(sync_type, 'success', result, started_at)
         return True
 
 def main():
@@ -147,7 +722,7 @@ def main():
         print("Warning  Strava credentials not configured, skipping sync")
         return
     
-    success = sync.sync_all_activities()
+    success = sync.run()
     
     if success:
         print("OK Strava sync completed successfully")
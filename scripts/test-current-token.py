@@ -7,6 +7,9 @@ Test current refresh token directly
 import requests
 import json
 
+from http_client import HttpError
+from strava_auth import TokenBroker
+
 def test_current_token():
     """Test the current refresh token"""
     
@@ -17,27 +20,20 @@ def test_current_token():
     
     print("Testing current refresh token...")
     
-    # Step 1: Refresh access token
-    print("\n1. Refreshing access token...")
-    token_url = 'https://www.strava.com/oauth/token'
-    token_data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'refresh_token': refresh_token,
-        'grant_type': 'refresh_token'
-    }
+    # Step 1: Get an access token (cached in the token store until near expiry)
+    print("\n1. Getting access token...")
+    broker = TokenBroker(client_id, client_secret, refresh_token)
     
     try:
-        token_response = requests.post(token_url, data=token_data)
-        token_response.raise_for_status()
-        token_info = token_response.json()
-        
-        print("Access token refreshed successfully")
-        print("Response: " + json.dumps(token_info, indent=2))
+        access_token = broker.access_token()
         
-        access_token = token_info['access_token']
+        if broker.refreshed:
+            print("Access token refreshed successfully")
+        else:
+            print("Reusing cached access token")
+        print("Token info: " + json.dumps(broker.token_info(), indent=2))
         
-    except requests.exceptions.RequestException as e:
+    except HttpError as e:
         print("Token refresh failed: " + str(e))
         return False
     
@@ -6,7 +6,9 @@ Run this script locally to test your Strava API credentials
 
 import os
 import requests
-import json
+
+from http_client import HttpError
+from strava_auth import TokenBroker
 
 def test_strava_connection():
     """Test Strava API connection with provided credentials"""
@@ -22,31 +24,26 @@ def test_strava_connection():
     
     print("Sync Testing Strava API connection...")
     
-    # Step 1: Refresh access token
-    print("1. Refreshing access token...")
-    token_url = 'https://www.strava.com/oauth/token'
-    token_data = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'refresh_token': refresh_token,
-        'grant_type': 'refresh_token'
-    }
+    # Step 1: Get an access token (cached in the token store until near expiry)
+    print("1. Getting access token...")
+    broker = TokenBroker(client_id, client_secret, refresh_token)
     
     try:
-        token_response = requests.post(token_url, data=token_data)
-        token_response.raise_for_status()
-        token_info = token_response.json()
-        access_token = token_info['access_token']
-        print("OK Access token refreshed successfully")
+        access_token = broker.access_token()
+        token_info = broker.token_info()
+        if broker.refreshed:
+            print("OK Access token refreshed successfully")
+        else:
+            print("OK Reusing cached access token")
         
         # Print token info (without sensitive data)
-        print(f"   - Token type: {token_info.get('token_type', 'N/A')}")
-        print(f"   - Expires at: {token_info.get('expires_at', 'N/A')}")
-        print(f"   - Scope: {token_info.get('scope', 'N/A')}")
+        print(f"   - Token type: {token_info.get('token_type') or 'N/A'}")
+        print(f"   - Expires at: {token_info.get('expires_at') or 'N/A'}")
+        print(f"   - Scope: {token_info.get('scope') or 'N/A'}")
         
-    except requests.exceptions.RequestException as e:
+    except HttpError as e:
         print(f"Error Failed to refresh token: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if e.response is not None:
             print(f"   Response: {e.response.text}")
         return False
     
@@ -0,0 +1,61 @@
+import pytest
+
+from rate_limit import DAILY_WINDOW_SECONDS, RateLimitExhausted, StravaRateLimiter
+
+# 2026-10-17 18:00:00 UTC
+SIX_PM_UTC = 1792260000
+
+
+class FakeClock:
+    def __init__(self, wall):
+        self.monotonic = 0.0
+        self.wall = float(wall)
+
+    def sleep(self, seconds):
+        self.monotonic += seconds
+        self.wall += seconds
+
+
+def make_limiter(clock):
+    return StravaRateLimiter(clock=lambda: clock.monotonic, wall_clock=lambda: clock.wall,
+                             sleep=clock.sleep)
+
+
+def test_exhausted_day_raises_until_utc_midnight():
+    clock = FakeClock(SIX_PM_UTC)
+    limiter = make_limiter(clock)
+    limiter.update_from_headers({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '3,1000'})
+
+    with pytest.raises(RateLimitExhausted) as excinfo:
+        limiter.acquire(max_wait=15 * 60)
+    assert excinfo.value.wait_seconds == pytest.approx(6 * 3600)
+    assert clock.monotonic == 0.0
+
+
+def test_exhausted_day_resets_at_utc_midnight():
+    clock = FakeClock(SIX_PM_UTC)
+    limiter = make_limiter(clock)
+    limiter.update_from_headers({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '3,1000'})
+
+    limiter.acquire()
+    assert clock.wall % DAILY_WINDOW_SECONDS == pytest.approx(0)
+    assert limiter.remaining()[1] == 999
+
+
+def test_exhausted_short_window_waits_for_next_quarter_hour():
+    clock = FakeClock(SIX_PM_UTC + 10 * 60)
+    limiter = make_limiter(clock)
+    limiter.update_from_headers({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,400'})
+
+    limiter.acquire(max_wait=15 * 60)
+    assert clock.monotonic == pytest.approx(5 * 60)
+
+
+def test_stale_lower_usage_does_not_lift_the_block():
+    clock = FakeClock(SIX_PM_UTC)
+    limiter = make_limiter(clock)
+    limiter.update_from_headers({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '3,1000'})
+    limiter.update_from_headers({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '2,999'})
+
+    with pytest.raises(RateLimitExhausted):
+        limiter.acquire(max_wait=15 * 60)
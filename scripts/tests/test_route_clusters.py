@@ -0,0 +1,27 @@
+from polylines import encode
+from route_clusters import ROUTE_MATCH_M, ClusterIndex, frechet_m, match_route, route_summary
+
+
+def straight_route(detour):
+    """40 km due north with a ~280 m out-and-back detour halfway along"""
+    points = []
+    for i in range(401):
+        lat = 51.0 + i * 0.0009
+        points.append((lat, -0.1))
+        if i == 200:
+            points.append(detour(lat))
+            points.append((lat, -0.1))
+    return encode(points)
+
+
+def test_detour_between_samples_does_not_reject_a_match():
+    # Same length either way, so the samples line up; neither detour is sampled
+    plain = route_summary(straight_route(lambda lat: (lat - 0.0025, -0.1)))
+    spur = route_summary(straight_route(lambda lat: (lat, -0.096)))
+    assert frechet_m(plain['samples'], spur['samples']) <= ROUTE_MATCH_M
+
+    index = ClusterIndex()
+    index.add(dict(plain, id=1))
+    cluster, distance = match_route(index, spur)
+    assert cluster is not None and cluster['id'] == 1
+    assert distance <= ROUTE_MATCH_M
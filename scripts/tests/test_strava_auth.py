@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from strava_auth import TokenStore
+
+ENTRY = {'client_id': '1', 'access_token': 'access', 'refresh_token': 'rotated', 'expires_at': 2000000000}
+
+
+def test_encrypted_store_round_trips_without_plaintext(tmp_path):
+    pytest.importorskip('cryptography')
+    path = tmp_path / 'strava-tokens.enc'
+    store = TokenStore(path, key='client-secret')
+    with store.locked():
+        store.update(1, ENTRY)
+
+    assert b'rotated' not in path.read_bytes()
+    assert TokenStore(path, key='client-secret').get(1) == ENTRY
+
+
+def test_encrypted_store_ignores_wrong_key_and_plaintext(tmp_path):
+    pytest.importorskip('cryptography')
+    path = tmp_path / 'strava-tokens.enc'
+    store = TokenStore(path, key='client-secret')
+    with store.locked():
+        store.update(1, ENTRY)
+    assert TokenStore(path, key='another-secret').get(1) == {}
+
+    path.write_text(json.dumps({'1': ENTRY}))
+    assert TokenStore(path, key='client-secret').get(1) == {}
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of Mapbox raster tiles for the local map renderer
+
+Tiles are stored one PNG per (style, z, x, y) and bounded by total bytes,
+evicting least-recently-used tiles first. Tiles older than max_age are
+revalidated with If-None-Match, so an unchanged tile costs a 304 instead
+of a download. Since most activities start from the same few places,
+network cost scales with distinct geography rather than activity count.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from http_client import HttpError
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+
+def tile_range(center_x, center_y, zoom, width, height, tile_size):
+    """(x, y) indexes of the tiles covering a frame centered on world pixels
+
+    x may fall outside [0, 2**zoom) near the antimeridian; callers wrap it
+    when fetching and keep it unwrapped for positioning.
+    """
+    first_x = math.floor((center_x - width / 2) / tile_size)
+    last_x = math.floor((center_x + width / 2 - 1e-9) / tile_size)
+    first_y = max(0, math.floor((center_y - height / 2) / tile_size))
+    last_y = min(2 ** zoom - 1, math.floor((center_y + height / 2 - 1e-9) / tile_size))
+    return [(x, y) for y in range(first_y, last_y + 1) for x in range(first_x, last_x + 1)]
+
+
+class TileCache:
+    """LRU tile store with ETag revalidation; fetches run on the caller's thread
+
+    Safe to share between threads: a tile several threads need at once is
+    downloaded by the first and read by the rest.
+    """
+
+    def __init__(self, cache_dir, http, url_template, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE, clock=time.time):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / 'index.json'
+        self.http = http
+        # e.g. .../styles/v1/mapbox/{style}/tiles/512/{z}/{x}/{y}@2x?access_token=...
+        self.url_template = url_template
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.used = set()
+        # Per-tile locks so concurrent misses on one tile make one download
+        self.fetch_locks = {}
+        self.stats = {'hits': 0, 'fetched': 0, 'revalidated': 0, 'evicted': 0}
+        self.index = self._load_index()
+        self.total_bytes = sum(entry['bytes'] for entry in self.index.values())
+
+    def _load_index(self):
+        """Load {key: {etag, bytes, fetched_at}} in least- to most-recently-used order"""
+        if not self.index_file.exists():
+            return OrderedDict()
+
+        try:
+            with open(self.index_file, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning  Ignoring unreadable tile cache index: {e}")
+            return OrderedDict()
+
+        return OrderedDict(
+            (key, entry) for key, entry in entries
+            if (self.cache_dir / f"{key}.png").exists()
+        )
+
+    def tile_path(self, style, z, x, y):
+        return self.cache_dir / f"{style}/{z}/{x}/{y}.png"
+
+    def get(self, style, z, x, y):
+        """Path of a cached tile, downloading or revalidating it if needed
+
+        Raises HttpError when the tile is not cached and cannot be fetched.
+        """
+        x %= 2 ** z
+        key = f"{style}/{z}/{x}/{y}"
+        path = self.tile_path(style, z, x, y)
+        with self.lock:
+            self.used.add(key)
+            fetch_lock = self.fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            return self._get(key, path, style, z, x, y)
+
+    def _get(self, key, path, style, z, x, y):
+        with self.lock:
+            entry = self.index.get(key)
+            if entry:
+                self.index.move_to_end(key)
+
+        if entry and self.clock() - entry['fetched_at'] < self.max_age:
+            with self.lock:
+                self.stats['hits'] += 1
+            return path
+
+        url = self.url_template.format(style=style, z=z, x=x, y=y)
+        headers = {'If-None-Match': entry['etag']} if entry and entry.get('etag') else {}
+        try:
+            response = self.http.get(url, headers=headers)
+        except HttpError:
+            if entry:
+                # Serve the stale tile rather than fail the map
+                return path
+            raise
+
+        if response.status_code == 304 and entry:
+            with self.lock:
+                entry['fetched_at'] = self.clock()
+                self.stats['revalidated'] += 1
+            return path
+
+        self._store(key, path, response.content, response.headers.get('ETag'))
+        return path
+
+    def _store(self, key, path, content, etag):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            previous = self.index.pop(key, None)
+            if previous:
+                self.total_bytes -= previous['bytes']
+            self.index[key] = {'etag': etag, 'bytes': len(content), 'fetched_at': self.clock()}
+            self.total_bytes += len(content)
+            self.stats['fetched'] += 1
+            evicted = self._evict()
+
+        for evicted_key in evicted:
+            (self.cache_dir / f"{evicted_key}.png").unlink(missing_ok=True)
+
+    def _evict(self):
+        """Drop least-recently-used tiles over the byte bound (lock held)
+
+        Tiles used during this run are kept so queued renders can still
+        read them; the bound may be exceeded until the next run.
+        """
+        evicted = []
+        for key in list(self.index):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self.used:
+                continue
+            self.total_bytes -= self.index.pop(key)['bytes']
+            evicted.append(key)
+        self.stats['evicted'] += len(evicted)
+        return evicted
+
+    def save(self):
+        """Enforce the byte bound and persist the LRU index
+
+        Call once queued renders are done; tiles used this run become
+        evictable again.
+        """
+        with self.lock:
+            self.used.clear()
+            self.fetch_locks.clear()
+            evicted = self._evict()
+            entries = list(self.index.items())
+
+        for evicted_key in evicted:
+            (self.cache_dir / f"{evicted_key}.png").unlink(missing_ok=True)
+
+        tmp_path = self.index_file.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.index_file)